@@ -4,10 +4,36 @@ PDF Viewer Application with Upload and Scroll Navigation
 Based on design.md specifications
 """
 import os
+import re
+import asyncio
+import bisect
+import contextlib
+import fcntl
+import json
+import math
+import heapq
+import zlib
+import sqlite3
+import time
+import unicodedata
 import uuid
+import hashlib
+import html
+import itertools
+import shutil
+import subprocess
+import threading
+import multiprocessing
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import httpx
+import numpy as np
 import openai
 from dotenv import load_dotenv
-from flask import Flask, render_template_string, request, redirect, url_for, send_file, send_from_directory, flash, jsonify
+from flask import Flask, Request, Response, render_template_string, request, redirect, url_for, send_file, flash, jsonify, stream_with_context
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 
 # Load environment variables from .env file
@@ -24,12 +50,1885 @@ MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB max file size
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
+# Content-addressed storage: each distinct PDF is stored once as objects/<sha256>.pdf
+# and every upload of it becomes a `<sha256>_<original name>` alias in UPLOAD_FOLDER
+OBJECTS_FOLDER = os.path.join(UPLOAD_FOLDER, 'objects')
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Read uploads in 1MB chunks while hashing
+PDF_CACHE_MAX_AGE = 365 * 24 * 3600  # Uploads are immutable, let browsers keep them for a year
+
 # Create upload directory if it doesn't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+# OpenAI client settings (one pooled client per process, see get_openai_client)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None  # e.g. a local stub for load tests
+OPENAI_POOL_SIZE = int(os.getenv('OPENAI_POOL_SIZE', '20'))  # Max open connections
+OPENAI_KEEPALIVE = float(os.getenv('OPENAI_KEEPALIVE', '60'))  # Seconds an idle connection is kept
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '60'))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', '5'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '2'))  # Retried with exponential backoff
+
+_openai_client = None
+_async_openai_client = None
+_openai_client_lock = threading.Lock()
+
+def openai_http_options():
+    return {
+        'limits': httpx.Limits(max_connections=OPENAI_POOL_SIZE,
+                               max_keepalive_connections=OPENAI_POOL_SIZE,
+                               keepalive_expiry=OPENAI_KEEPALIVE),
+        'timeout': httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+    }
+
+def get_openai_client():
+    # Build the client once so every request reuses its connection pool and TLS sessions
+    global _openai_client
+    if _openai_client is None:
+        with _openai_client_lock:
+            if _openai_client is None:
+                _openai_client = openai.OpenAI(
+                    api_key=os.getenv('OPENAI_API_KEY'),
+                    base_url=OPENAI_BASE_URL,
+                    max_retries=OPENAI_MAX_RETRIES,
+                    http_client=httpx.Client(**openai_http_options()),
+                )
+    return _openai_client
+
+def get_async_openai_client():
+    # Async counterpart for the ASGI chat route; only ever touched from the event loop
+    global _async_openai_client
+    if _async_openai_client is None:
+        _async_openai_client = openai.AsyncOpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            base_url=OPENAI_BASE_URL,
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=httpx.AsyncClient(**openai_http_options()),
+        )
+    return _async_openai_client
+
+def open_db(path):
+    # SQLite files are shared between threads and gunicorn workers; WAL keeps readers off the writer
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+_db_local = threading.local()
+
+def get_db(path):
+    # One connection per thread and database file, opened on first use
+    connections = getattr(_db_local, 'connections', None)
+    if connections is None:
+        connections = _db_local.connections = {}
+    if path not in connections:
+        connections[path] = open_db(path)
+    return connections[path]
+
+# Metrics in the Prometheus text format at /metrics. Values are kept per process
+# (each gunicorn worker reports its own), and with METRICS off every hook, span and
+# observation is skipped.
+METRICS_ENABLED = os.getenv('METRICS', '1').lower() in ('1', 'true', 'yes')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTE_BUCKETS = tuple(1024 * 4 ** i for i in range(11))  # 1KB to 1GB
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 4 ** i for i in range(9))  # 64KB/s to 4GB/s
+TOKEN_BUCKETS = tuple(2 ** i for i in range(7, 16))  # 128 to 32768 tokens
+
+METRICS = []
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def metric_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{metric_labels(self.labels, key)} {value}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(labels.get(name, '') for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, **labels):
+        return HistogramTimer(self, labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f'{self.name}_bucket{metric_labels(self.labels, key, le)} {cumulative}')
+                lines.append(f'{self.name}_sum{metric_labels(self.labels, key)} {total}')
+                lines.append(f'{self.name}_count{metric_labels(self.labels, key)} {cumulative}')
+        return lines
+
+class HistogramTimer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+http_request_seconds = Histogram('chatpdf_http_request_duration_seconds',
+                                 'Time to the response headers by route.', ('route', 'method', 'status'))
+upload_bytes = Counter('chatpdf_upload_bytes_total', 'Bytes of PDF uploads received.', ('method',))
+upload_throughput = Histogram('chatpdf_upload_throughput_bytes_per_second',
+                              'Receive rate of each form upload or upload chunk.', ('method',), THROUGHPUT_BUCKETS)
+pdf_response_bytes = Histogram('chatpdf_pdf_response_bytes', 'Body size of /pdf responses.',
+                               ('status',), BYTE_BUCKETS)
+llm_ttft_seconds = Histogram('chatpdf_llm_time_to_first_token_seconds',
+                             'Time from the streaming completion request to its first token.')
+prompt_tokens = Histogram('chatpdf_prompt_tokens', 'Tokens in each assembled chat prompt.', (), TOKEN_BUCKETS)
+chat_stage_seconds = Histogram('chatpdf_chat_stage_duration_seconds',
+                               'Duration of the chat stages (prompt_build, retrieval, completion).', ('stage',))
+
+NO_SPAN = contextlib.nullcontext()
+
+def chat_span(stage):
+    # `with chat_span('retrieval'): ...` times a stage of a chat request
+    if not METRICS_ENABLED:
+        return NO_SPAN
+    return chat_stage_seconds.time(stage=stage)
+
+def cache_metrics():
+    # The response cache keeps its own counters; they are read at scrape time
+    hits, misses = chat_cache.hits, chat_cache.misses
+    lines = ['# HELP chatpdf_cache_requests_total Response cache lookups by result.',
+             '# TYPE chatpdf_cache_requests_total counter',
+             f'chatpdf_cache_requests_total{{cache="chat",result="hit"}} {hits}',
+             f'chatpdf_cache_requests_total{{cache="chat",result="miss"}} {misses}',
+             '# HELP chatpdf_cache_hit_ratio Share of response cache lookups that were hits.',
+             '# TYPE chatpdf_cache_hit_ratio gauge',
+             f'chatpdf_cache_hit_ratio{{cache="chat"}} {hits / (hits + misses) if hits + misses else 0}']
+    return lines
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(cache_metrics())
+    return '\n'.join(lines) + '\n'
+
+if METRICS_ENABLED:
+    @app.before_request
+    def start_request_timer():
+        request.environ['metrics.started'] = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        started = request.environ.get('metrics.started')
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            http_request_seconds.observe(time.perf_counter() - started, route=route,
+                                         method=request.method, status=response.status_code)
+        return response
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def upload_pdf_path(filename):
+    # Only the uploaded PDFs themselves are served; the metadata index and the
+    # per-document artifacts kept next to them in UPLOAD_FOLDER are not
+    if not allowed_file(filename) or filename.startswith('.'):
+        return None
+    path = safe_join(UPLOAD_FOLDER, filename)
+    if not path or os.path.dirname(path) != UPLOAD_FOLDER or not os.path.isfile(path):
+        return None
+    # send_file resolves relative paths against the app's root, not the working directory
+    return os.path.abspath(path)
+
+def is_digest(value):
+    return len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+def doc_key(filename):
+    # Content-addressed uploads share every derived artifact through their hash
+    prefix = filename.split('_', 1)[0]
+    return prefix if is_digest(prefix) else filename
+
+def display_name_for(filename):
+    # Remove the UUID (legacy uploads) or content hash prefix if present
+    prefix, _, rest = filename.partition('_')
+    if rest and (len(prefix) == 36 or is_digest(prefix)):
+        return rest
+    return filename
+
+# Uploads stream straight into UPLOAD_FOLDER: the form parser writes the file part into
+# an UploadSpool (hashed and checked for the PDF header as it arrives), which is then
+# renamed into objects/ without a second copy
+PDF_MAGIC = b'%PDF-'
+
+class UploadSpool:
+    def __init__(self):
+        self.path = os.path.join(UPLOAD_FOLDER, f".upload-{uuid.uuid4()}.tmp")
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.started = time.perf_counter()
+        self._head = b''
+        self._file = open(self.path, 'wb+')
+
+    def write(self, data):
+        if len(self._head) < len(PDF_MAGIC):
+            # Reject anything that is not a PDF before writing it to disk
+            self._head += data[:len(PDF_MAGIC) - len(self._head)]
+            if not PDF_MAGIC.startswith(self._head):
+                self.close()
+                raise UnsupportedMediaType('The uploaded file is not a PDF.')
+        self.sha256.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def close(self):
+        # Spools that were never moved into objects/ (aborted or rejected uploads) are dropped
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+class UploadRequest(Request):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._spools = []  # Every spool the form parser opened for this request
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool = UploadSpool()
+        self._spools.append(spool)
+        return spool
+
+    def close(self):
+        # Called when the request ends, also when the form never finished parsing
+        # (client disconnect): spools not moved into objects/ are removed here
+        super().close()
+        for spool in self._spools:
+            spool.close()
+
+app.request_class = UploadRequest
+
+UPLOAD_SPOOL_STALE_AFTER = 3600  # Seconds without a write before a leftover spool is removed
+
+def sweep_upload_spools():
+    # Spools left by a process that died mid-upload. Other workers may be writing
+    # theirs right now, so only spools idle for a long time are removed.
+    cutoff = time.time() - UPLOAD_SPOOL_STALE_AFTER
+    for entry in os.scandir(UPLOAD_FOLDER):
+        if entry.name.startswith('.upload-') and entry.name.endswith('.tmp'):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def store_object(tmp_path, digest):
+    # Move a fully written upload into the content-addressed store
+    object_path = os.path.join(OBJECTS_FOLDER, f"{digest}.pdf")
+    if os.path.exists(object_path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, object_path)
+    return object_path
+
+def link_alias(object_path, digest, original_filename):
+    unique_filename = f"{digest}_{original_filename}"
+    alias_path = os.path.join(UPLOAD_FOLDER, unique_filename)
+    if os.path.exists(alias_path):
+        os.utime(alias_path)  # Bump repeat uploads to the top of the recent list
+    else:
+        try:
+            os.link(object_path, alias_path)
+        except FileExistsError:
+            pass
+        except OSError:
+            # Filesystem without hard links: fall back to a copy, artifacts are still shared
+            shutil.copyfile(object_path, alias_path)
+    return unique_filename
+
+def save_upload(file_storage, original_filename):
+    spool = file_storage.stream
+    if not isinstance(spool, UploadSpool):
+        # Not from the form parser: copy it through a spool in fixed-size buffers
+        spool = UploadSpool()
+        try:
+            while True:
+                chunk = file_storage.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                spool.write(chunk)
+        except Exception:
+            spool.close()
+            raise
+    if spool.size < len(PDF_MAGIC):
+        spool.close()
+        raise UnsupportedMediaType('The uploaded file is not a PDF.')
+    spool.flush()
+    upload_bytes.inc(spool.size, method='form')
+    upload_throughput.observe(spool.size / max(time.perf_counter() - spool.started, 1e-6), method='form')
+    digest = spool.sha256.hexdigest()
+    object_path = store_object(spool.path, digest)
+    return link_alias(object_path, digest, original_filename)
+
+# Resumable chunked uploads for files over MAX_CONTENT_LENGTH: the client creates an
+# upload, then PUTs consecutive chunks at the offset the server reports; chunks are
+# appended to uploads/partial/<id>.part and an interrupted upload resumes from there
+PARTIAL_FOLDER = os.path.join(UPLOAD_FOLDER, 'partial')
+UPLOAD_PART_SIZE = 8 * 1024 * 1024  # Chunk size the browser sends, below MAX_CONTENT_LENGTH
+MAX_CHUNKED_UPLOAD_SIZE = int(os.getenv('MAX_CHUNKED_UPLOAD_SIZE', str(2 * 1024 * 1024 * 1024)))
+UPLOAD_SESSION_TTL = 24 * 3600  # Seconds before an unfinished upload is discarded
+
+# Hash of the bytes received so far, while consecutive chunks arrive at this process.
+# Chunks handled by another worker (or before a restart) break the chain, and the
+# part file is then hashed once when the upload completes.
+_upload_hashers = {}  # upload id -> (sha256, offset)
+
+def partial_path(upload_id):
+    return os.path.join(PARTIAL_FOLDER, f"{upload_id}.part")
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    return sha256
+
+@contextlib.contextmanager
+def locked_part(upload_id):
+    # Chunks of one upload are appended one at a time across threads and gunicorn
+    # workers: an exclusive flock on the part file, held until the request is done.
+    # Yields None if the upload is gone (cancelled, or completed by another request).
+    path = partial_path(upload_id)
+    try:
+        part = open(path, 'ab')
+    except FileNotFoundError:
+        yield None
+        return
+    with part:
+        fcntl.flock(part, fcntl.LOCK_EX)
+        try:
+            current = os.stat(path)
+        except FileNotFoundError:
+            current = None
+        if current is None or current.st_ino != os.fstat(part.fileno()).st_ino:
+            yield None
+        else:
+            yield part
+
+# Metadata index for the recent-files list: one SQLite row per upload, written on
+# upload and extraction, so the home page is an indexed top-k query instead of a
+# directory scan with a stat per file
+METADATA_DB = os.path.join(UPLOAD_FOLDER, 'metadata.db')
+RECENT_FILES_LIMIT = 5
+
+def init_metadata_index():
+    conn = get_db(METADATA_DB)
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS files ('
+        'name TEXT PRIMARY KEY, display_name TEXT NOT NULL, doc_key TEXT NOT NULL, '
+        'size INTEGER NOT NULL, pages INTEGER, uploaded_at REAL NOT NULL)'
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS files_uploaded_at ON files (uploaded_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS files_doc_key ON files (doc_key)')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS upload_sessions ('
+        'id TEXT PRIMARY KEY, filename TEXT NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL)'
+    )
+    global search_available
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS page_search USING fts5("
+                     "text, doc_key UNINDEXED, page UNINDEXED, tokenize='unicode61 remove_diacritics 2')")
+        conn.execute('CREATE TABLE IF NOT EXISTS search_docs ('
+                     'doc_key TEXT PRIMARY KEY, first_rowid INTEGER NOT NULL, last_rowid INTEGER NOT NULL, '
+                     'tokens INTEGER, page_tokens BLOB)')
+        # Tables from before page statistics get the columns; backfill_search_index fills them
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(search_docs)')}
+        for column in ('tokens INTEGER', 'page_tokens BLOB'):
+            if column.split()[0] not in columns:
+                try:
+                    conn.execute(f'ALTER TABLE search_docs ADD COLUMN {column}')
+                except sqlite3.OperationalError as e:
+                    if 'duplicate column' not in str(e):  # Another process added it first
+                        raise
+        conn.execute('CREATE INDEX IF NOT EXISTS search_docs_first_rowid ON search_docs (first_rowid)')
+        conn.execute('CREATE TABLE IF NOT EXISTS search_terms ('
+                     'term TEXT NOT NULL, first_rowid INTEGER NOT NULL, pages BLOB NOT NULL, tfs BLOB NOT NULL, '
+                     'PRIMARY KEY (term, first_rowid)) WITHOUT ROWID')
+        conn.execute('CREATE INDEX IF NOT EXISTS search_terms_first_rowid ON search_terms (first_rowid)')
+        search_available = True
+    except sqlite3.OperationalError as e:
+        print(f"Search disabled, SQLite has no FTS5: {e}")
+    if conn.execute('SELECT 1 FROM files LIMIT 1').fetchone() is None:
+        # First start with an existing uploads/ folder: index it once
+        for entry in os.scandir(UPLOAD_FOLDER):
+            if entry.is_file() and entry.name.lower().endswith('.pdf'):
+                stat = entry.stat()
+                record_upload(entry.name, stat.st_size, stat.st_mtime, page_count(entry.name) or None)
+
+def record_upload(filename, size, uploaded_at=None, pages=None):
+    get_db(METADATA_DB).execute(
+        'INSERT OR REPLACE INTO files (name, display_name, doc_key, size, pages, uploaded_at) VALUES (?, ?, ?, ?, ?, ?)',
+        (filename, display_name_for(filename), doc_key(filename), size, pages,
+         time.time() if uploaded_at is None else uploaded_at)
+    )
+
+def record_page_count(filename, pages):
+    # Every alias of the same content shares the page count
+    get_db(METADATA_DB).execute('UPDATE files SET pages = ? WHERE doc_key = ?', (pages, doc_key(filename)))
+
+def recent_uploads(limit=RECENT_FILES_LIMIT):
+    rows = get_db(METADATA_DB).execute(
+        'SELECT name, display_name, size, pages, uploaded_at FROM files ORDER BY uploaded_at DESC LIMIT ?', (limit,)
+    ).fetchall()
+    return [{'name': name, 'display_name': display_name, 'size': size, 'pages': pages, 'date': uploaded_at}
+            for name, display_name, size, pages, uploaded_at in rows]
+
+def format_file_size(size):
+    for unit in ('Bytes', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'Bytes' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+# Cross-document search: every extracted page is a row of an FTS5 table in the
+# metadata index, added when a document's extraction finishes and removed before it
+# is re-extracted. FTS5's rank recounts every query term over the whole table on
+# each call, so pages are ranked from search_terms instead: one row per term and
+# document listing the pages it occurs on and how often, with the token count of
+# each page in search_docs. /search scores the pages holding every term with BM25
+# in NumPy and ranks documents by their best page; FTS5, unranked and within one
+# document's rowids, only confirms phrases and cuts snippets, and documents are
+# visited best first until none left can beat the k-th result.
+SEARCH_TOP_K = 10          # Documents returned by default
+SEARCH_PAGES_PER_DOC = 5   # Page hits listed per document
+SEARCH_QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+SEARCH_TOKEN_RE = re.compile(r'[^\W_]+')
+search_available = False   # FTS5 is missing from some SQLite builds
+
+def search_tokens(text):
+    # Terms as FTS5's unicode61 tokenizer (remove_diacritics 2) splits and folds them
+    text = text.lower()
+    if not text.isascii():
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return SEARCH_TOKEN_RE.findall(text)
+
+def index_search(filename):
+    # Replace the document's pages in the search index with its current page store
+    key = doc_key(filename)
+    texts = [text for _, text in iter_pages(filename)]
+    page_tokens = array('I')
+    postings = {}  # term -> (pages, term frequencies)
+    for page_num, text in enumerate(texts, 1):
+        tokens = search_tokens(text)
+        page_tokens.append(len(tokens))
+        counts = {}
+        for term in tokens:
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            pages, tfs = postings.setdefault(term, (array('I'), array('I')))
+            pages.append(page_num)
+            tfs.append(tf)
+    conn = get_db(METADATA_DB)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        remove_search_rows(conn, key)
+        first = (conn.execute('SELECT max(rowid) FROM page_search').fetchone()[0] or 0) + 1
+        conn.executemany('INSERT INTO page_search (rowid, text, doc_key, page) VALUES (?, ?, ?, ?)',
+                         ((first + page_num - 1, text, key, page_num) for page_num, text in enumerate(texts, 1)))
+        if texts:
+            conn.execute('INSERT INTO search_docs (doc_key, first_rowid, last_rowid, tokens, page_tokens) '
+                         'VALUES (?, ?, ?, ?, ?)',
+                         (key, first, first + len(texts) - 1, sum(page_tokens), page_tokens.tobytes()))
+            conn.executemany('INSERT INTO search_terms (term, first_rowid, pages, tfs) VALUES (?, ?, ?, ?)',
+                             ((term, first, pages.tobytes(), tfs.tobytes())
+                              for term, (pages, tfs) in postings.items()))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return len(texts)
+
+def remove_search_rows(conn, key):
+    # Pages of a document have consecutive rowids, so removal is a rowid range delete
+    row = conn.execute('SELECT first_rowid, last_rowid FROM search_docs WHERE doc_key = ?', (key,)).fetchone()
+    if row:
+        conn.execute('DELETE FROM search_terms WHERE first_rowid = ?', (row[0],))
+        conn.execute('DELETE FROM page_search WHERE rowid BETWEEN ? AND ?', row)
+        conn.execute('DELETE FROM search_docs WHERE doc_key = ?', (key,))
+
+def unindex_search(filename):
+    if search_available:
+        conn = get_db(METADATA_DB)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            remove_search_rows(conn, doc_key(filename))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+def backfill_search_index():
+    # Documents extracted before the search index, or before its page statistics,
+    # existed are indexed (again) in the background
+    if not search_available:
+        return
+    for (name,) in get_db(METADATA_DB).execute(
+        'SELECT max(name) FROM files WHERE pages > 0 AND doc_key NOT IN ('
+        'SELECT doc_key FROM search_docs WHERE page_tokens IS NOT NULL) GROUP BY doc_key'
+    ).fetchall():
+        jobs.enqueue('search_index', name, rerun=True)
+
+def search_parts(query):
+    # Words must all match and "quoted text" matches as a phrase
+    parts = []
+    for phrase, word in SEARCH_QUERY_RE.findall(query):
+        terms = search_tokens(phrase or word)
+        if terms:
+            parts.append(terms)
+    return parts
+
+def search_expression(parts):
+    # Every part goes to FTS5 as a quoted string, so user input never reaches its query syntax
+    return ' '.join('"' + ' '.join(terms) + '"' for terms in parts)
+
+def score_pages(conn, terms):
+    # BM25 of every page holding all the terms, as (rowids, first rowids of their
+    # documents, scores), or None when some term is on no page
+    placeholders = ','.join('?' * len(terms))
+    rows = {}
+    for term, first, pages, tfs in conn.execute(
+        f'SELECT term, first_rowid, pages, tfs FROM search_terms WHERE term IN ({placeholders}) '
+        'ORDER BY term, first_rowid', terms
+    ):
+        rows.setdefault(term, []).append((first, pages, tfs))
+    if len(rows) < len(terms):
+        return None
+    total_pages, total_tokens = conn.execute(
+        'SELECT sum(last_rowid - first_rowid + 1), sum(tokens) FROM search_docs WHERE tokens IS NOT NULL'
+    ).fetchone()
+
+    # Rowids come out ascending, so each document's pages stay contiguous
+    rowids = docs = None
+    columns = []  # (idf, term frequencies) per term, aligned with rowids
+    for term in sorted(rows, key=lambda term: len(rows[term])):
+        firsts = np.array([first for first, _, _ in rows[term]], np.int64)
+        counts = [len(pages) // 4 for _, pages, _ in rows[term]]
+        term_docs = np.repeat(firsts, counts)
+        term_rowids = term_docs - 1 + np.frombuffer(b''.join(pages for _, pages, _ in rows[term]), np.uint32)
+        tfs = np.frombuffer(b''.join(tfs for _, _, tfs in rows[term]), np.uint32).astype(np.float32)
+        idf = math.log(1 + (total_pages - len(term_rowids) + 0.5) / (len(term_rowids) + 0.5))
+        if rowids is None:
+            rowids, docs = term_rowids, term_docs
+            columns.append((idf, tfs))
+        else:
+            # Terms are taken rarest first, so the pages left are looked up in the longer list
+            matched = np.minimum(np.searchsorted(term_rowids, rowids), len(term_rowids) - 1)
+            kept = term_rowids[matched] == rowids
+            rowids, docs, matched = rowids[kept], docs[kept], matched[kept]
+            columns = [(column_idf, column[kept]) for column_idf, column in columns] + [(idf, tfs[matched])]
+
+    # Page lengths of the documents holding the rarest term, a superset of those left
+    firsts, page_tokens = zip(*conn.execute(
+        'SELECT search_docs.first_rowid, page_tokens FROM search_terms '
+        'JOIN search_docs ON search_docs.first_rowid = search_terms.first_rowid WHERE term = ? '
+        'ORDER BY search_docs.first_rowid',
+        (min(rows, key=lambda term: len(rows[term])),)
+    ))
+    firsts = np.array(firsts, np.int64)
+    offsets = np.cumsum([0] + [len(lengths) // 4 for lengths in page_tokens[:-1]])
+    page_lengths = np.frombuffer(b''.join(page_tokens), np.uint32).astype(np.float32)
+    page_lengths = page_lengths[offsets[np.searchsorted(firsts, docs)] + (rowids - docs)]
+    norms = BM25_K1 * (1 - BM25_B + BM25_B * page_lengths / ((total_tokens / total_pages) or 1))
+    scores = np.zeros(len(rowids), np.float32)
+    for idf, tfs in columns:
+        scores += idf * tfs * (BM25_K1 + 1) / (tfs + norms)
+    return rowids, docs, scores
+
+def search_documents(query, k=SEARCH_TOP_K):
+    parts = search_parts(query)
+    if not parts:
+        return []
+    conn = get_db(METADATA_DB)
+    scored = score_pages(conn, sorted({term for terms in parts for term in terms}))
+    if scored is None or not len(scored[0]):
+        return []
+    rowids, docs, scores = scored
+    # Documents by their best page; only the pages of documents visited get sorted
+    starts = np.flatnonzero(np.r_[True, docs[1:] != docs[:-1]])
+    ends = np.r_[starts[1:], len(docs)]
+    best = np.maximum.reduceat(scores, starts)
+    expression = search_expression(parts)
+    results = []  # (score, result), best first
+    for doc in np.argsort(-best, kind='stable').tolist():
+        # A document's best page bounds its score, so nothing after this can make the top k
+        if len(results) >= k and best[doc] <= results[k - 1][0]:
+            break
+        start, end = int(starts[doc]), int(ends[doc])
+        order = np.argsort(-scores[start:end], kind='stable')
+        hit = search_hit(conn, expression, int(docs[start]), rowids[start:end][order], scores[start:end][order])
+        if hit is not None:
+            results.append(hit)
+            results.sort(key=lambda entry: -entry[0])
+    return [result for _, result in results[:k]]
+
+def search_hit(conn, expression, first, rowids, scores):
+    # (score of its best matching page, result) for one document, named after its
+    # most recent upload, or None when none of its pages match
+    upload = conn.execute(
+        'SELECT name, display_name, pages FROM search_docs JOIN files ON files.doc_key = search_docs.doc_key '
+        'WHERE first_rowid = ? ORDER BY uploaded_at DESC LIMIT 1', (first,)
+    ).fetchone()
+    if upload is None:
+        return None
+    # FTS5 has the final say on which pages match: a phrase's words on one page may not be adjacent
+    matched = {rowid for (rowid,) in conn.execute(
+        'SELECT rowid FROM page_search WHERE page_search MATCH ? AND rowid BETWEEN ? AND ?',
+        (expression, int(rowids.min()), int(rowids.max()))
+    )}
+    hits = [(rowid, score) for rowid, score in zip(rowids.tolist(), scores.tolist())
+            if rowid in matched][:SEARCH_PAGES_PER_DOC]
+    if not hits:
+        return None
+    snippets = dict(conn.execute(
+        "SELECT rowid, snippet(page_search, 0, char(2), char(3), '…', 12) FROM page_search "
+        f"WHERE page_search MATCH ? AND rowid IN ({','.join('?' * len(hits))})",
+        [expression] + [rowid for rowid, _ in hits]
+    ))
+    name, display_name, pages = upload
+    result = {'filename': name, 'display_name': display_name, 'pages': pages, 'score': round(hits[0][1], 4), 'hits': [
+        {'page': rowid - first + 1, 'score': round(score, 4),
+         'snippet': html.escape(snippets[rowid]).replace('\x02', '<mark>').replace('\x03', '</mark>')}
+        for rowid, score in hits
+    ]}
+    return hits[0][1], result
+
+# Text extraction (poppler's pdftotext, see README)
+PDFTOTEXT = shutil.which('pdftotext')
+PAGE_CONTEXT_CHARS = 4000  # Max characters of page text injected into the chat prompt
+
+def artifact_path(filename, suffix):
+    # Derived files live next to the PDF they were built from, keyed by content
+    return os.path.join(UPLOAD_FOLDER, f"{doc_key(filename)}.{suffix}")
+
+# Page store: `<name>.pages` holds the UTF-8 text of every page back to back,
+# `<name>.pidx` holds the end offset of each page as uint64. Pages are appended
+# as they come out of the extractor, so a reader only ever sees whole pages.
+def page_offsets(filename):
+    offsets = array('Q')
+    try:
+        with open(artifact_path(filename, 'pidx'), 'rb') as f:
+            data = f.read()
+        offsets.frombytes(data[:len(data) - len(data) % offsets.itemsize])
+    except FileNotFoundError:
+        pass
+    return offsets
+
+def page_count(filename):
+    return len(page_offsets(filename))
+
+def extraction_complete(filename):
+    # Pages are readable while they are extracted; `<name>.extracted` marks a full run
+    return os.path.exists(artifact_path(filename, 'extracted'))
+
+def read_page(filename, page_num):
+    offsets = page_offsets(filename)
+    if page_num < 1 or page_num > len(offsets):
+        return None
+    start = offsets[page_num - 2] if page_num > 1 else 0
+    with open(artifact_path(filename, 'pages'), 'rb') as f:
+        f.seek(start)
+        return f.read(offsets[page_num - 1] - start).decode('utf-8', errors='replace')
+
+def iter_pages(filename):
+    offsets = page_offsets(filename)
+    if not offsets:
+        return
+    with open(artifact_path(filename, 'pages'), 'rb') as f:
+        start = 0
+        for page_num, end in enumerate(offsets, 1):
+            yield page_num, f.read(end - start).decode('utf-8', errors='replace')
+            start = end
+
+# Extraction is sharded by page range over a process pool: each worker runs pdftotext
+# on its range and tokenizes the passages, and the shards are appended to the page
+# store in page order, so the first pages are readable while later ones are extracted.
+PDFINFO = shutil.which('pdfinfo')
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', str(os.cpu_count() or 1)))  # Processes in the pool
+EXTRACT_SHARD_PAGES = int(os.getenv('EXTRACT_SHARD_PAGES', '25'))  # Pages per pdftotext run
+PARTIAL_INDEX_INTERVAL = 5.0  # Seconds between saves of the BM25 index while extraction runs
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+def get_extract_pool():
+    # Spawned rather than forked: the server process runs threads
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            _extract_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return _extract_pool
+
+def pdf_page_total(pdf_path):
+    if not PDFINFO:
+        return None
+    result = subprocess.run([PDFINFO, pdf_path], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    match = re.search(rb'^Pages:\s+(\d+)', result.stdout, re.M)
+    return int(match.group(1)) if match else None
+
+def extract_page_range(pdf_path, first=None, last=None, tokenizer=None):
+    # Runs in the pool: the text of each page in first..last with its tokenized passages,
+    # chunked with the tokenizer the server chose
+    if tokenizer:
+        load_tokenizer(tokenizer)
+    args = [PDFTOTEXT, '-enc', 'UTF-8']
+    if first:
+        args += ['-f', str(first), '-l', str(last)]
+    result = subprocess.run(args + [pdf_path, '-'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    # pdftotext ends every page with a form feed
+    pages = result.stdout.split(b'\f')[:-1]
+    if first and len(pages) < last - first + 1:
+        # Keep page numbers aligned when pdftotext stops early
+        pages += [b''] * (last - first + 1 - len(pages))
+    shard = []
+    for page in pages:
+        text = page.decode('utf-8', errors='replace')
+        shard.append((page, [(start, end, tokenize(text[start:end])) for start, end in chunk_page(text)]))
+    return result.returncode, shard
+
+def extract_pages(filename):
+    pdf_path = os.path.join(UPLOAD_FOLDER, filename)
+    if not PDFTOTEXT:
+        print("pdftotext not found, skipping text extraction")
+        return 0
+
+    # Start from an empty store so a retried extraction never duplicates pages
+    unindex_search(filename)
+    # Dense indexes of the previous run would no longer line up with the new passages
+    for suffix in ('extracted', 'pages', 'pidx', *(f"{backend}.npy" for backend in EMBEDDING_BACKENDS)):
+        if os.path.exists(artifact_path(filename, suffix)):
+            os.remove(artifact_path(filename, suffix))
+
+    # Without a page count (no pdfinfo) the whole document is a single shard
+    total = pdf_page_total(pdf_path)
+    if total:
+        shards = [(first, min(first + EXTRACT_SHARD_PAGES - 1, total))
+                  for first in range(1, total + 1, EXTRACT_SHARD_PAGES)]
+    else:
+        shards = [(None, None)]
+    tokenizer = tokenizer_name()
+    futures = [get_extract_pool().submit(extract_page_range, pdf_path, first, last, tokenizer)
+               for first, last in shards]
+
+    pages = 0
+    offset = 0
+    failed = False
+    index = BM25Index()
+    # An index exists from the start, so /chat never builds its own from a partial store
+    index.save(artifact_path(filename, 'bm25'))
+    saved_at = time.monotonic()
+    try:
+        with open(artifact_path(filename, 'pages'), 'ab') as text_file, \
+             open(artifact_path(filename, 'pidx'), 'ab') as index_file:
+            for future in futures:
+                returncode, shard = future.result()
+                if returncode != 0:
+                    print(f"pdftotext failed for {filename} (exit code {returncode})")
+                    failed = True
+                for page, passages in shard:
+                    text_file.write(page)
+                    text_file.flush()
+                    offset += len(page)
+                    index_file.write(array('Q', [offset]).tobytes())
+                    index_file.flush()
+                    pages += 1
+                    for start, end, tokens in passages:
+                        index.add_tokens(pages, start, end, tokens)
+                if time.monotonic() - saved_at > PARTIAL_INDEX_INTERVAL:
+                    index.save(artifact_path(filename, 'bm25'))
+                    saved_at = time.monotonic()
+    finally:
+        for future in futures:
+            future.cancel()
+    index.save(artifact_path(filename, 'bm25'))
+    record_page_count(filename, pages)
+    if failed:
+        # The pages so far stay readable; the job is retried and starts over
+        raise RuntimeError(f"pdftotext failed for {filename}")
+    with open(artifact_path(filename, 'extracted'), 'w') as f:
+        f.write(str(pages))
+    try:
+        build_vector_index(filename, index)
+    except Exception as e:
+        print(f"Error building vector index for {filename}: {e}")
+    if search_available:
+        try:
+            index_search(filename)
+        except Exception as e:
+            print(f"Error adding {filename} to the search index: {e}")
+    if pages:
+        start_summaries(filename)
+    return pages
+
+def start_extraction(filename):
+    # Extract each upload once, off the request thread (see JobQueue)
+    if extraction_complete(filename):
+        return None
+    return jobs.enqueue('extract', filename)
+
+# Web optimization: non-linearized uploads get a linearized, object-stream compressed
+# copy `<name>.web` (via qpdf) served as /pdf/<name>?v=web, so PDF.js can paint page 1
+# from the first ranges of the file. The original upload is kept untouched.
+QPDF = shutil.which('qpdf')
+LINEARIZE_PDFS = os.getenv('LINEARIZE_PDFS', '1').lower() in ('1', 'true', 'yes')
+
+def is_linearized(path):
+    # The linearization dictionary must be the first object in the file
+    with open(path, 'rb') as f:
+        return b'/Linearized' in f.read(1024)
+
+def web_pdf_path(filename):
+    path = artifact_path(filename, 'web')
+    return path if os.path.exists(path) else None
+
+def linearize_pdf(filename):
+    pdf_path = os.path.join(UPLOAD_FOLDER, filename)
+    out_path = artifact_path(filename, 'web')
+    if os.path.exists(out_path) or is_linearized(pdf_path):
+        return False
+    tmp_path = f"{out_path}.tmp"
+    result = subprocess.run(
+        [QPDF, '--linearize', '--object-streams=generate', '--compress-streams=y', pdf_path, tmp_path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    # qpdf exits with 3 when it succeeded with warnings
+    if result.returncode not in (0, 3) or not os.path.exists(tmp_path):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        print(f"qpdf failed for {filename}: {result.stderr.decode('utf-8', errors='replace').strip()}")
+        return False
+    os.replace(tmp_path, out_path)
+    return True
+
+def start_linearization(filename):
+    if not (LINEARIZE_PDFS and QPDF):
+        return None
+    return jobs.enqueue('linearize', filename)
+
+# Page thumbnails: small PNG rasters (poppler's pdftoppm) rendered lazily on first
+# request into THUMB_FOLDER, with bounded concurrency and LRU eviction by total bytes
+PDFTOPPM = shutil.which('pdftoppm')
+THUMB_FOLDER = os.path.join(UPLOAD_FOLDER, 'thumbs')
+THUMB_WIDTHS = (200, 400, 800)  # Requested widths snap to one of these to keep the cache small
+THUMB_CACHE_MAX_BYTES = int(os.getenv('THUMB_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+THUMB_CONCURRENCY = int(os.getenv('THUMB_CONCURRENCY', '2'))  # pdftoppm processes at a time
+
+_thumb_slots = threading.BoundedSemaphore(THUMB_CONCURRENCY)
+_thumb_sizes = None  # path -> bytes, least recently used first
+_thumb_bytes = 0     # Sum of _thumb_sizes
+_thumb_locks = {}    # path -> lock, so concurrent requests render a thumbnail once
+_thumb_lock = threading.Lock()
+
+def _load_thumb_sizes():
+    global _thumb_sizes, _thumb_bytes
+    if _thumb_sizes is None:
+        entries = [e for e in os.scandir(THUMB_FOLDER) if e.is_file() and e.name.endswith('.png')]
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        _thumb_sizes = OrderedDict((e.path, e.stat().st_size) for e in entries)
+        _thumb_bytes = sum(_thumb_sizes.values())
+    return _thumb_sizes
+
+def _touch_thumb(path, size=None):
+    global _thumb_bytes
+    with _thumb_lock:
+        sizes = _load_thumb_sizes()
+        if size is None:
+            if path in sizes:
+                sizes.move_to_end(path)
+            return
+        _thumb_bytes += size - sizes.get(path, 0)
+        sizes[path] = size
+        sizes.move_to_end(path)
+        while _thumb_bytes > THUMB_CACHE_MAX_BYTES and len(sizes) > 1:
+            old_path, old_size = sizes.popitem(last=False)
+            _thumb_bytes -= old_size
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+
+def thumbnail_path(filename, page_num, width):
+    return os.path.join(THUMB_FOLDER, f"{doc_key(filename)}-p{page_num}-w{width}.png")
+
+def render_thumbnail(filename, page_num, width):
+    path = thumbnail_path(filename, page_num, width)
+    if os.path.exists(path):
+        _touch_thumb(path)
+        return path
+
+    with _thumb_lock:
+        lock = _thumb_locks.setdefault(path, threading.Lock())
+    try:
+        with lock:
+            if not os.path.exists(path):
+                with _thumb_slots:
+                    prefix = f"{path[:-len('.png')]}.{uuid.uuid4().hex}"
+                    try:
+                        subprocess.run(
+                            [PDFTOPPM, '-png', '-singlefile', '-f', str(page_num), '-l', str(page_num),
+                             '-scale-to-x', str(width), '-scale-to-y', '-1',
+                             os.path.join(UPLOAD_FOLDER, filename), prefix],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+                        )
+                        os.replace(f"{prefix}.png", path)
+                    finally:
+                        # A failed run (e.g. a page past the end of the document) may leave partial output
+                        if os.path.exists(f"{prefix}.png"):
+                            os.remove(f"{prefix}.png")
+                _touch_thumb(path, os.path.getsize(path))
+    finally:
+        # Also on failure, so requests for pages that do not exist leave no lock behind
+        with _thumb_lock:
+            _thumb_locks.pop(path, None)
+    return path
+
+# Background jobs: post-upload work is queued in a durable SQLite table and run by a
+# pool of worker threads, so uploads return at once. Each job type has its own
+# concurrency limit across all processes, and failed jobs are retried with exponential backoff.
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))  # Worker threads per process
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_DELAY = 2.0    # Seconds before the first retry, doubled for every further attempt
+JOB_POLL_INTERVAL = 1.0  # Idle workers re-check the table for retries and jobs queued by other processes
+JOB_HEARTBEAT_INTERVAL = 5.0  # Seconds between heartbeats of a process's running jobs
+JOB_STALE_AFTER = 30.0        # Running jobs without a heartbeat for this long are taken back
+
+class JobQueue:
+    # Job states: queued -> running -> done, or back to queued for a retry, or failed.
+    # A running job records the token of the queue that claimed it and a heartbeat; PIDs
+    # are reused after a restart and differ between containers, tokens and clocks are not.
+    def __init__(self, db_path, job_types, workers=JOB_WORKERS, max_attempts=JOB_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.job_types = job_types
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.token = f"{os.getpid()}-{uuid.uuid4().hex}"
+        self._wakeup = threading.Condition()
+        self._started = False
+        self._ready = False  # Tables are created on first use, not at import
+
+    def _create_tables(self, conn):
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, type TEXT NOT NULL, filename TEXT NOT NULL, doc_key TEXT NOT NULL, '
+            'state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT, worker TEXT, '
+            'heartbeat REAL, run_after REAL NOT NULL, created_at REAL NOT NULL, updated_at REAL NOT NULL)'
+        )
+        # Tables created before heartbeats existed get the column; their running jobs look stale
+        if 'heartbeat' not in {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}:
+            try:
+                conn.execute('ALTER TABLE jobs ADD COLUMN heartbeat REAL')
+            except sqlite3.OperationalError as e:
+                if 'duplicate column' not in str(e):  # Another process added it first
+                    raise
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (state, run_after)')
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_doc_key ON jobs (doc_key, type)')
+
+    def _db(self):
+        conn = get_db(self.db_path)
+        if not self._ready:
+            self._create_tables(conn)
+            self._ready = True
+        return conn
+
+    def start(self):
+        with self._wakeup:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True).start()
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True).start()
+
+    def _heartbeat(self):
+        while True:
+            self.beat()
+            if self.reclaim_stale():
+                with self._wakeup:
+                    self._wakeup.notify_all()
+            time.sleep(JOB_HEARTBEAT_INTERVAL)
+
+    def beat(self):
+        self._db().execute(
+            "UPDATE jobs SET heartbeat = ? WHERE state = 'running' AND worker = ?", (time.time(), self.token)
+        )
+
+    def reclaim_stale(self):
+        # Jobs whose process stopped beating go back to the queue, or fail once they have
+        # used up their attempts (a job that kills its process is not retried forever)
+        now = time.time()
+        return self._db().execute(
+            "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+            "error = coalesce(error, 'worker stopped'), run_after = ?, updated_at = ? "
+            "WHERE state = 'running' AND worker != ? AND coalesce(heartbeat, 0) < ?",
+            (self.max_attempts, now, now, self.token, now - JOB_STALE_AFTER)
+        ).rowcount
+
+    def enqueue(self, job_type, filename, rerun=False):
+        # One job per document and type: repeat uploads get the queued, running or finished
+        # job. With rerun, a finished job is run again (its output has gone stale since).
+        key = doc_key(filename)
+        now = time.time()
+        reuse = "state IN ('queued', 'running')" if rerun else "state != 'failed'"
+        conn = self._db()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                f"SELECT id FROM jobs WHERE doc_key = ? AND type = ? AND {reuse} "
+                "ORDER BY created_at DESC LIMIT 1", (key, job_type)
+            ).fetchone()
+            if row:
+                job_id = row[0]
+            else:
+                job_id = uuid.uuid4().hex
+                conn.execute(
+                    'INSERT INTO jobs (id, type, filename, doc_key, state, run_after, created_at, updated_at) '
+                    "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)", (job_id, job_type, filename, key, now, now, now)
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        row = self._db().execute(
+            'SELECT id, type, filename, state, attempts, result, error, created_at, updated_at FROM jobs WHERE id = ?',
+            (job_id,)
+        ).fetchone()
+        return self._as_dict(row) if row else None
+
+    def for_document(self, filename):
+        # Latest job of each type for the document
+        rows = self._db().execute(
+            'SELECT id, type, filename, state, attempts, result, error, created_at, updated_at FROM jobs '
+            'WHERE doc_key = ? ORDER BY created_at', (doc_key(filename),)
+        ).fetchall()
+        return list({row[1]: self._as_dict(row) for row in rows}.values())
+
+    def _as_dict(self, row):
+        job_id, job_type, filename, state, attempts, result, error, created_at, updated_at = row
+        return {'id': job_id, 'type': job_type, 'filename': filename, 'state': state, 'attempts': attempts,
+                'result': json.loads(result) if result else None, 'error': error,
+                'created_at': created_at, 'updated_at': updated_at}
+
+    def _claim(self):
+        # Called with self._wakeup held. Running jobs are counted in the table inside a write
+        # transaction, so the per-type limits hold across every process sharing the database.
+        conn = self._db()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            running = dict(conn.execute(
+                "SELECT type, count(*) FROM jobs WHERE state = 'running' GROUP BY type"
+            ).fetchall())
+            free = [name for name, (_, limit) in self.job_types.items() if running.get(name, 0) < limit]
+            row = None
+            if free:
+                row = conn.execute(
+                    "SELECT id, type, filename, attempts FROM jobs WHERE state = 'queued' AND run_after <= ? "
+                    f"AND type IN ({','.join('?' * len(free))}) ORDER BY run_after LIMIT 1", (now, *free)
+                ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE jobs SET state = 'running', attempts = attempts + 1, worker = ?, heartbeat = ?, "
+                    'updated_at = ? WHERE id = ?', (self.token, now, now, row[0])
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return row[0], row[1], row[2], row[3] + 1
+
+    def _work(self):
+        while True:
+            with self._wakeup:
+                job = self._claim()
+                if job is None:
+                    self._wakeup.wait(JOB_POLL_INTERVAL)
+                    continue
+            job_id, job_type, filename, attempt = job
+            try:
+                result = self.job_types[job_type][0](filename)
+                self._update(job_id, 'done', result=json.dumps(result))
+            except Exception as e:
+                print(f"Job {job_type} for {filename} failed (attempt {attempt}): {e}")
+                if attempt < self.max_attempts:
+                    self._update(job_id, 'queued', error=str(e),
+                                 run_after=time.time() + JOB_RETRY_DELAY * 2 ** (attempt - 1))
+                else:
+                    self._update(job_id, 'failed', error=str(e))
+            finally:
+                with self._wakeup:
+                    self._wakeup.notify_all()
+
+    def _update(self, job_id, state, result=None, error=None, run_after=None):
+        # Only while the job is still ours: a job taken back and claimed again belongs to its new worker
+        now = time.time()
+        self._db().execute(
+            'UPDATE jobs SET state = ?, result = ?, error = ?, run_after = ?, updated_at = ? '
+            'WHERE id = ? AND worker = ?',
+            (state, result, error, run_after or now, now, job_id, self.token)
+        )
+
+# Text-layer geometry: the viewer's selectable text is built from line boxes that
+# pdftotext -bbox-layout extracts once per page and keeps as JSON in GEOMETRY_FOLDER,
+# instead of PDF.js laying out one span per text run in the browser
+GEOMETRY_FOLDER = os.path.join(UPLOAD_FOLDER, 'geometry')
+BBOX_PAGE_RE = re.compile(r'<page width="([\d.]+)" height="([\d.]+)">')
+BBOX_LINE_RE = re.compile(
+    r'<line xMin="([\d.]+)" yMin="([\d.]+)" xMax="([\d.]+)" yMax="([\d.]+)">(.*?)</line>', re.S
+)
+BBOX_WORD_RE = re.compile(r'<word[^>]*>(.*?)</word>', re.S)
+
+def geometry_path(filename, page_num):
+    return os.path.join(GEOMETRY_FOLDER, f"{doc_key(filename)}-p{page_num}.json")
+
+def parse_bbox_layout(xhtml):
+    page = BBOX_PAGE_RE.search(xhtml)
+    lines = []
+    for x_min, y_min, x_max, y_max, body in BBOX_LINE_RE.findall(xhtml):
+        text = ' '.join(html.unescape(word) for word in BBOX_WORD_RE.findall(body))
+        if text.strip():
+            # Points from the top-left corner, rounded to keep the JSON small
+            lines.append([round(float(x_min), 2), round(float(y_min), 2),
+                          round(float(x_max), 2), round(float(y_max), 2), text])
+    return {
+        'width': float(page.group(1)) if page else None,
+        'height': float(page.group(2)) if page else None,
+        'lines': lines,
+    }
+
+def text_geometry(filename, page_num):
+    path = geometry_path(filename, page_num)
+    if not os.path.exists(path):
+        result = subprocess.run(
+            [PDFTOTEXT, '-bbox-layout', '-enc', 'UTF-8', '-f', str(page_num), '-l', str(page_num),
+             os.path.join(UPLOAD_FOLDER, filename), '-'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+        )
+        geometry = parse_bbox_layout(result.stdout.decode('utf-8', errors='replace'))
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(geometry, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    return path
+
+# Semantic chunking: page text is split into blocks (paragraphs, with headings as
+# their own units), long blocks into sentences and overlong sentences into word runs.
+# Units are packed into chunks of at most CHUNK_TOKENS; a heading always starts a new
+# chunk and the trailing sentences of a chunk (up to CHUNK_OVERLAP_TOKENS) are
+# repeated at the start of the next. Chunks are the passages BM25 and the dense
+# index rank, and a ChunkTable records where each one came from.
+CHUNK_TOKENS = int(os.getenv('CHUNK_TOKENS', '200'))                 # Max tokens per chunk
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '40'))  # Tokens repeated from the previous chunk
+HEADING_MAX_CHARS = 80
+
+BLOCK_RE = re.compile(r'(?:[^\S\n]*\S[^\n]*(?:\n|$))+')  # Runs of non-blank lines
+SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+NUMBERED_HEADING_RE = re.compile(r'^(?:\d+(?:\.\d+)*\.?|[IVXLC]+\.|(?:chapter|section|part|appendix)\b)\s*\S', re.I)
+
+def is_heading(line):
+    line = line.strip()
+    if not line or len(line) > HEADING_MAX_CHARS or line[-1] in '.,;:!?':
+        return False
+    if NUMBERED_HEADING_RE.match(line):
+        return True
+    words = [word for word in line.split() if word[0].isalpha()]
+    # Title Case or ALL CAPS lines
+    return bool(words) and sum(word[0].isupper() for word in words) >= 0.6 * len(words)
+
+def text_units(text, start, end):
+    # (start, end, tokens) of the sentences in text[start:end], splitting overlong ones by words
+    units = []
+    position = start
+    for boundary in [m.start() for m in SENTENCE_RE.finditer(text, start, end)] + [end]:
+        tokens = count_tokens(text[position:boundary])
+        if tokens <= CHUNK_TOKENS:
+            units.append((position, boundary, tokens))
+        else:
+            run_start = run_end = None
+            run_tokens = 0
+            for word in WORD_RE.finditer(text, position, boundary):
+                word_tokens = count_tokens(word.group())
+                if run_start is not None and run_tokens + word_tokens > CHUNK_TOKENS:
+                    units.append((run_start, run_end, run_tokens))
+                    run_start, run_tokens = None, 0
+                if run_start is None:
+                    run_start = word.start()
+                run_end = word.end()
+                run_tokens += word_tokens
+            if run_start is not None:
+                units.append((run_start, run_end, run_tokens))
+        position = boundary
+        while position < end and text[position].isspace():
+            position += 1
+    return units
+
+def page_units(text):
+    # (start, end, tokens, is_heading) for every unit of a page, in order
+    units = []
+    for block in BLOCK_RE.finditer(text):
+        start, end = block.start(), block.end()
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        while start < end and text[start].isspace():
+            start += 1
+        first_line_end = text.find('\n', start, end)
+        if first_line_end == -1:
+            first_line_end = end
+        if is_heading(text[start:first_line_end]):
+            units.append((start, first_line_end, count_tokens(text[start:first_line_end]), True))
+            start = first_line_end
+            while start < end and text[start].isspace():
+                start += 1
+        if start >= end:
+            continue
+        tokens = count_tokens(text[start:end])
+        if tokens <= CHUNK_TOKENS:
+            units.append((start, end, tokens, False))
+        else:
+            units.extend((unit_start, unit_end, unit_tokens, False)
+                         for unit_start, unit_end, unit_tokens in text_units(text, start, end))
+    return units
+
+def chunk_page(text):
+    # Yield (start, end) character offsets of the chunks of one page
+    current = []
+    size = 0
+    for unit in page_units(text):
+        if current and (unit[3] or size + unit[2] > CHUNK_TOKENS):
+            yield current[0][0], current[-1][1]
+            # Carry trailing units into the next chunk, never a heading or the whole chunk
+            carry = []
+            carried = 0
+            if not unit[3]:
+                for previous in reversed(current[1:]):
+                    if previous[3] or carried + previous[2] > CHUNK_OVERLAP_TOKENS \
+                            or carried + previous[2] + unit[2] > CHUNK_TOKENS:
+                        break
+                    carry.insert(0, previous)
+                    carried += previous[2]
+            current, size = carry, carried
+        current.append(unit)
+        size += unit[2]
+    if current:
+        yield current[0][0], current[-1][1]
+
+class ChunkTable:
+    # Chunk provenance (page number and character offsets into that page's text) as
+    # three parallel uint32 arrays, 12 bytes per chunk, saved as `<name>.chunks`
+    def __init__(self):
+        self.pages = array('I')
+        self.starts = array('I')
+        self.ends = array('I')
+
+    def append(self, page_num, start, end):
+        self.pages.append(page_num)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __getitem__(self, chunk_id):
+        if isinstance(chunk_id, slice):
+            return list(zip(self.pages[chunk_id], self.starts[chunk_id], self.ends[chunk_id]))
+        return self.pages[chunk_id], self.starts[chunk_id], self.ends[chunk_id]
+
+    def __iter__(self):
+        return zip(self.pages, self.starts, self.ends)
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(array('Q', [len(self)]).tobytes())
+            for column in (self.pages, self.starts, self.ends):
+                column.tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        table = cls()
+        with open(path, 'rb') as f:
+            count = array('Q', f.read(8))[0]
+            for column in (table.pages, table.starts, table.ends):
+                column.fromfile(f, count)
+        return table
+
+# Lexical retrieval: a per-document BM25 index over the chunks of each page,
+# persisted as `<name>.bm25` and used to pick passages for /chat
+RETRIEVAL_TOP_K = 4    # Passages injected into the chat prompt
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_CACHE_SIZE = 32   # Loaded indexes kept in memory
+
+TOKEN_RE = re.compile(r"\w+")
+WORD_RE = re.compile(r"\S+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in into is it its "
+    "me my no not of on or our she so than that the their them then there these they "
+    "this to was we were what when where which who why will with you your".split()
+)
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+def chunks_path(index_path):
+    return f"{os.path.splitext(index_path)[0]}.chunks"
+
+class BM25Index:
+    def __init__(self):
+        self.passages = ChunkTable()  # (page, start, end) per passage id
+        self.lengths = []    # token count per passage id
+        self.postings = {}   # term -> {passage id: term frequency}
+        self._norms = None
+        self._arrays = {}    # term -> (passage ids, term frequencies) as arrays, built on first query
+
+    def add_page(self, page_num, text):
+        for start, end in chunk_page(text):
+            self.add_passage(page_num, start, end, text[start:end])
+
+    def add_passage(self, page_num, start, end, text):
+        self.add_tokens(page_num, start, end, tokenize(text))
+
+    def add_tokens(self, page_num, start, end, tokens):
+        passage_id = len(self.passages)
+        self.passages.append(page_num, start, end)
+        self.lengths.append(len(tokens))
+        for token in tokens:
+            postings = self.postings.setdefault(token, {})
+            postings[passage_id] = postings.get(passage_id, 0) + 1
+        self._norms = None
+        self._arrays = {}
+
+    def term_arrays(self, term):
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            postings = self.postings.get(term, {})
+            arrays = self._arrays[term] = (np.fromiter(postings.keys(), np.int64, len(postings)),
+                                           np.fromiter(postings.values(), np.float32, len(postings)))
+        return arrays
+
+    def search(self, query, k=RETRIEVAL_TOP_K):
+        if not self.passages:
+            return []
+        if self._norms is None:
+            # Per-passage length normalisation only changes when passages are added
+            lengths = np.asarray(self.lengths, dtype=np.float32)
+            avg_length = float(lengths.mean()) or 1
+            self._norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length)
+        total = len(self.passages)
+        # Scored a term at a time over NumPy arrays: common terms have thousands of postings
+        scores = np.zeros(total, dtype=np.float32)
+        for term in set(tokenize(query)):
+            ids, tfs = self.term_arrays(term)
+            if not len(ids):
+                continue
+            idf = math.log(1 + (total - len(ids) + 0.5) / (len(ids) + 0.5))
+            scores[ids] += idf * tfs * (BM25_K1 + 1) / (tfs + self._norms[ids])
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind='stable')]
+        return [(int(i), float(scores[i])) for i in matched]
+
+    def save(self, path):
+        # The chunk table goes first: a reader never sees postings for chunks it lacks
+        self.passages.save(chunks_path(path))
+        data = {
+            'lengths': self.lengths,
+            'postings': {term: [list(p.keys()), list(p.values())] for term, p in self.postings.items()},
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        index = cls()
+        if 'passages' in data:
+            # Indexes written before the chunk table kept passages inline
+            for page_num, start, end in data['passages']:
+                index.passages.append(page_num, start, end)
+        else:
+            index.passages = ChunkTable.load(chunks_path(path))
+        index.lengths = data['lengths']
+        index.postings = {term: dict(zip(ids, tfs)) for term, (ids, tfs) in data['postings'].items()}
+        return index
+
+_bm25_cache = OrderedDict()
+_bm25_cache_lock = threading.Lock()
+
+def get_bm25_index(filename):
+    path = artifact_path(filename, 'bm25')
+    try:
+        mtime = os.path.getmtime(path)
+    except FileNotFoundError:
+        # Uploads extracted before indexing existed: the index job builds it from the
+        # page store, and chat goes without retrieval meanwhile
+        if page_count(filename):
+            start_indexing(filename)
+        return None
+
+    key = doc_key(filename)
+    with _bm25_cache_lock:
+        cached = _bm25_cache.get(key)
+        if cached and cached[0] == mtime:
+            _bm25_cache.move_to_end(key)
+            return cached[1]
+
+    index = BM25Index.load(path)
+    with _bm25_cache_lock:
+        _bm25_cache[key] = (mtime, index)
+        _bm25_cache.move_to_end(key)
+        while len(_bm25_cache) > BM25_CACHE_SIZE:
+            _bm25_cache.popitem(last=False)
+    return index
+
+# Dense retrieval: one embedding per BM25 passage, stored as a float32 matrix
+# `<name>.<backend>.npy` and memory-mapped at query time
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'hashed')
+EMBEDDING_DIM = 512    # Dimensions of the hashed n-gram vectors
+RRF_K = 60             # Reciprocal rank fusion constant for merging BM25 and dense results
+RETRIEVAL_CANDIDATES = 8        # Passages taken from each ranking into the fusion
+BM25_CONFIDENT_RATIO = 1.5      # k-th BM25 score over the next one above which the dense pass is skipped
+
+def embed_hashed(texts):
+    # Deterministic offline embedding: signed feature hashing of words and character trigrams
+    vectors = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        features = []
+        for token in tokenize(text):
+            padded = f"#{token}#"
+            features.append(token)
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        if not features:
+            continue
+        hashes = np.array([zlib.crc32(f.encode('utf-8')) for f in features], dtype=np.uint32)
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+        vectors[row] = np.bincount(hashes % EMBEDDING_DIM, weights=signs, minlength=EMBEDDING_DIM)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def embed_openai(texts):
+    response = get_openai_client().embeddings.create(model=os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small'), input=texts)
+    vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+# Embedding backends by name; EMBEDDING_BACKEND selects the one used for new and queried indexes
+EMBEDDING_BACKENDS = {
+    'hashed': embed_hashed,
+    'openai': embed_openai,
+}
+
+def embed(texts):
+    return EMBEDDING_BACKENDS[EMBEDDING_BACKEND](texts)
+
+def passage_texts(filename, passages):
+    # Passages are stored in page order, so the page store is read once, a page at a time
+    pages = iter_pages(filename)
+    page_num, text = 0, ''
+    for passage_page, start, end in passages:
+        while page_num < passage_page:
+            page_num, text = next(pages, (passage_page, ''))
+        if page_num != passage_page:
+            yield (read_page(filename, passage_page) or '')[start:end]
+        else:
+            yield text[start:end]
+
+def build_vector_index(filename, index=None, batch_size=256):
+    index = index or get_bm25_index(filename)
+    if index is None or not index.passages:
+        return None
+    path = artifact_path(filename, f"{EMBEDDING_BACKEND}.npy")
+    # A unique temporary name per build: concurrent builds never write into the same file
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    texts = passage_texts(filename, index.passages)
+    matrix = None
+    try:
+        for i in range(0, len(index.passages), batch_size):
+            batch = list(itertools.islice(texts, batch_size))
+            vectors = embed(batch)
+            if matrix is None:
+                # Write straight into the on-disk matrix so large documents never sit in memory
+                matrix = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                                   shape=(len(index.passages), vectors.shape[1]))
+            matrix[i:i + len(batch)] = vectors
+        matrix.flush()
+        del matrix
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+def build_indexes(filename):
+    # Index job: the BM25 index of uploads extracted before indexing existed, and the
+    # dense matrix when it is missing or left over from another extraction run
+    path = artifact_path(filename, 'bm25')
+    if os.path.exists(path):
+        index = BM25Index.load(path)
+    else:
+        index = BM25Index()
+        for page_num, text in iter_pages(filename):
+            index.add_page(page_num, text)
+        index.save(path)
+    if extraction_complete(filename) and index.passages:
+        matrix_path = artifact_path(filename, f"{EMBEDDING_BACKEND}.npy")
+        if not os.path.exists(matrix_path) or len(np.load(matrix_path, mmap_mode='r')) != len(index.passages):
+            build_vector_index(filename, index)
+    return len(index.passages)
+
+def start_indexing(filename):
+    # Called from /chat when an index is missing or stale, also after an earlier index job
+    # finished (e.g. EMBEDDING_BACKEND changed since). A pending job is found with a read,
+    # so requests do not take the queue's write lock every time.
+    if any(job['type'] == 'index' and job['state'] in ('queued', 'running') for job in jobs.for_document(filename)):
+        return None
+    return jobs.enqueue('index', filename, rerun=True)
+
+def vector_search(filename, query, k=RETRIEVAL_TOP_K, index=None):
+    index = index or get_bm25_index(filename)
+    if index is None:
+        return []
+    path = artifact_path(filename, f"{EMBEDDING_BACKEND}.npy")
+    matrix = np.load(path, mmap_mode='r') if os.path.exists(path) else None
+    # One row per passage; anything else is a matrix of another extraction run. While
+    # extraction runs the index is partial, and a missing or stale matrix is rebuilt by
+    # the index job: lexical retrieval only until then.
+    if matrix is None or len(matrix) != len(index.passages):
+        if extraction_complete(filename):
+            start_indexing(filename)
+        return []
+    if not len(matrix):
+        return []
+    scores = matrix @ embed([query])[0]
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(i), float(scores[i])) for i in top]
+
+def bm25_confident(ranking, k):
+    # The top k lexical hits stand well clear of the next one: fusing in the dense
+    # ranking would not change which passages are picked, so it is skipped
+    return len(ranking) > k and ranking[k - 1][1] >= BM25_CONFIDENT_RATIO * ranking[k][1]
+
+def retrieve_passages(filename, query, k=RETRIEVAL_TOP_K):
+    index = get_bm25_index(filename)
+    if index is None:
+        return []
+
+    # Merge lexical and dense rankings with reciprocal rank fusion, over a capped
+    # candidate pool from each
+    fused = {}
+    candidates = max(k, RETRIEVAL_CANDIDATES)
+    rankings = [index.search(query, candidates)]
+    if not bm25_confident(rankings[0], k):
+        try:
+            rankings.append(vector_search(filename, query, candidates, index))
+        except Exception as e:
+            print(f"Dense retrieval unavailable for {filename}: {e}")
+    for ranking in rankings:
+        for rank, (passage_id, _) in enumerate(ranking):
+            fused[passage_id] = fused.get(passage_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+
+    passages = []
+    page_texts = {}
+    for passage_id, score in heapq.nlargest(k, fused.items(), key=lambda item: item[1]):
+        page_num, start, end = index.passages[passage_id]
+        if page_num not in page_texts:
+            page_texts[page_num] = read_page(filename, page_num) or ''
+        passages.append({'page': page_num, 'start': start, 'end': end,
+                         'text': page_texts[page_num][start:end], 'score': score})
+    return passages
+
+# Hierarchical summaries: after extraction a map-reduce pass summarizes every page,
+# then each run of SUMMARY_SECTION_PAGES pages, then the sections into one document
+# summary, stored as `<name>.summaries.json`. /chat answers summary requests from it
+# and adds the document and section summaries to other prompts as compact context.
+SUMMARY_BACKEND = os.getenv('SUMMARY_BACKEND', 'auto')  # 'auto', 'openai' or 'extractive'
+SUMMARIZE_DOCUMENTS = os.getenv('SUMMARIZE_DOCUMENTS', '1').lower() in ('1', 'true', 'yes')
+SUMMARY_CONCURRENCY = int(os.getenv('SUMMARY_CONCURRENCY', '4'))  # Summarization calls in flight per document
+SUMMARY_SECTION_PAGES = 10   # Pages per section summary
+SUMMARY_FAN_IN = 10          # Summaries merged per reduce call
+SUMMARY_INPUT_TOKENS = 2000  # Max tokens of text per summarization call
+SUMMARY_SENTENCES = 3        # Sentences kept by the extractive backend
+SUMMARY_CACHE_SIZE = 32
+SUMMARY_PROMPT = """Summarize the following {kind} of a PDF document in at most three sentences. Keep names, numbers and key terms. Reply with the summary only.
+
+{text}"""
+# Only a whole message that asks for a summary is answered from the cache; questions
+# that merely mention one ("what does the executive summary say ...") go to the model
+SUMMARY_INTENT_RE = re.compile(
+    r'^\s*(?:please\s+)?(?:summari[sz]e|give me a summary of|tl;?dr(?: of)?)\s+'
+    r'(?:(?:the|this|current)\s+(?P<scope>document|pdf|paper|page|section|chapter)|page\s+(?P<page>\d+))'
+    r'(?:\s+please)?\s*[.!?]*\s*$', re.I
+)
+SUMMARY_LABEL_RE = re.compile(r'\[Page \d+\]\s*')  # Page labels added to section inputs
+
+def summarize_openai(text, kind):
+    # temperature 0 keeps summaries reproducible (and testable against a local stub)
+    completion = get_openai_client().chat.completions.create(
+        model=CHAT_MODEL,
+        messages=[{'role': 'user', 'content': SUMMARY_PROMPT.format(kind=kind, text=text)}],
+        max_tokens=200,
+        temperature=0
+    )
+    return completion.choices[0].message.content.strip()
+
+def summarize_extractive(text, kind):
+    # Offline backend: the sentences with the most frequent content words, in document order
+    text = SUMMARY_LABEL_RE.sub('', text)
+    sentences = [' '.join(sentence.split()) for sentence in SENTENCE_RE.split(text) if sentence.strip()]
+    frequencies = {}
+    for token in tokenize(text):
+        frequencies[token] = frequencies.get(token, 0) + 1
+    def score(sentence):
+        tokens = tokenize(sentence)
+        return sum(frequencies.get(token, 0) for token in tokens) / (len(tokens) or 1)
+    best = sorted(heapq.nlargest(SUMMARY_SENTENCES, range(len(sentences)), key=lambda i: score(sentences[i])))
+    return ' '.join(sentences[i] for i in best)
+
+# Summarization backends by name; 'auto' uses OpenAI when a key is configured
+SUMMARY_BACKENDS = {
+    'openai': summarize_openai,
+    'extractive': summarize_extractive,
+}
+
+def summary_backend():
+    if SUMMARY_BACKEND == 'auto':
+        return 'openai' if os.getenv('OPENAI_API_KEY') else 'extractive'
+    return SUMMARY_BACKEND
+
+def load_summary_progress(path, backend):
+    # Summaries made by an earlier, interrupted run, keyed by a hash of their input
+    done = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Last line of a run that died mid-write
+                if record.get('backend') == backend:
+                    done[record['key']] = record['summary']
+    except FileNotFoundError:
+        pass
+    return done
+
+def build_summaries(filename):
+    backend = summary_backend()
+    pages = {page_num: text for page_num, text in iter_pages(filename) if text.strip()}
+    if not pages:
+        return None
+
+    # Every summary is appended to `<name>.summaries.progress` as soon as it is made,
+    # so a retried job only summarizes what is still missing
+    progress_path = artifact_path(filename, 'summaries.progress')
+    done = load_summary_progress(progress_path, backend)
+    progress_lock = threading.Lock()
+    progress = open(progress_path, 'a', encoding='utf-8')
+
+    def summarize(text, kind):
+        key = hashlib.sha256(f"{kind}\0{text}".encode('utf-8')).hexdigest()
+        if key in done:
+            return done[key]
+        summary = SUMMARY_BACKENDS[backend](text, kind)
+        with progress_lock:
+            progress.write(json.dumps({'backend': backend, 'key': key, 'summary': summary}) + '\n')
+            progress.flush()
+        return summary
+
+    with progress, ThreadPoolExecutor(max_workers=SUMMARY_CONCURRENCY) as pool:
+        # Map: one summary per page
+        page_nums = sorted(pages)
+        page_summaries = dict(zip(page_nums, pool.map(
+            lambda page_num: summarize(truncate_tokens(pages[page_num], SUMMARY_INPUT_TOKENS), 'page'), page_nums
+        )))
+
+        # Reduce: page summaries into sections, sections into the document
+        sections = []
+        for first in range(1, max(page_nums) + 1, SUMMARY_SECTION_PAGES):
+            last = min(first + SUMMARY_SECTION_PAGES - 1, max(page_nums))
+            parts = [f"[Page {n}] {page_summaries[n]}" for n in range(first, last + 1) if n in page_summaries]
+            if parts:
+                sections.append({'first': first, 'last': last, 'text': '\n'.join(parts)})
+        level = list(pool.map(
+            lambda section: summarize(truncate_tokens(section['text'], SUMMARY_INPUT_TOKENS), 'section'), sections
+        ))
+        section_summaries = list(level)
+        while len(level) > 1:
+            groups = ['\n\n'.join(level[i:i + SUMMARY_FAN_IN]) for i in range(0, len(level), SUMMARY_FAN_IN)]
+            level = list(pool.map(
+                lambda group: summarize(truncate_tokens(group, SUMMARY_INPUT_TOKENS), 'set of section summaries'), groups
+            ))
+
+    summaries = {
+        'backend': backend,
+        'pages': {str(page_num): summary for page_num, summary in page_summaries.items()},
+        'sections': [{'first': section['first'], 'last': section['last'], 'summary': summary}
+                     for section, summary in zip(sections, section_summaries)],
+        'document': level[0],
+    }
+    path = artifact_path(filename, 'summaries.json')
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(summaries, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    os.remove(progress_path)
+    return len(page_summaries)
+
+def start_summaries(filename):
+    if not SUMMARIZE_DOCUMENTS or os.path.exists(artifact_path(filename, 'summaries.json')):
+        return None
+    return jobs.enqueue('summarize', filename)
+
+_summary_cache = OrderedDict()  # doc key -> (mtime, summaries)
+_summary_cache_lock = threading.Lock()
+
+def load_summaries(filename):
+    path = artifact_path(filename, 'summaries.json')
+    try:
+        mtime = os.path.getmtime(path)
+    except FileNotFoundError:
+        return None
+    key = doc_key(filename)
+    with _summary_cache_lock:
+        cached = _summary_cache.get(key)
+        if cached and cached[0] == mtime:
+            _summary_cache.move_to_end(key)
+            return cached[1]
+    with open(path, encoding='utf-8') as f:
+        summaries = json.load(f)
+    with _summary_cache_lock:
+        _summary_cache[key] = (mtime, summaries)
+        _summary_cache.move_to_end(key)
+        while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+    return summaries
+
+def section_summary(summaries, page_num):
+    for section in summaries['sections']:
+        if section['first'] <= page_num <= section['last']:
+            return section
+    return None
+
+def context_page(context):
+    try:
+        return int(context.get('currentPage') or 1)
+    except (TypeError, ValueError):
+        return 1
+
+def summary_answer(message, context):
+    # Plain "summarize this page / section / document" requests are answered from the cache;
+    # with text selected, "summarize this" is about the selection and goes to the model
+    if context.get('selectedText'):
+        return None
+    match = SUMMARY_INTENT_RE.match(message or '')
+    if not match:
+        return None
+    filename = secure_filename(context.get('filename') or '')
+    summaries = load_summaries(filename) if filename else None
+    if summaries is None:
+        return None
+    current_page = context_page(context)
+    scope = (match.group('scope') or 'page').lower()
+    if scope == 'page':
+        page_num = int(match.group('page') or current_page)
+        summary = summaries['pages'].get(str(page_num))
+        return f"Summary of page {page_num}:\n\n{summary}" if summary else None
+    if scope in ('section', 'chapter'):
+        section = section_summary(summaries, current_page)
+        return f"Summary of pages {section['first']}–{section['last']}:\n\n{section['summary']}" if section else None
+    return f"Summary of the document:\n\n{summaries['document']}" if summaries['document'] else None
+
+def summary_events(answer, started, session_id=None):
+    # SSE form of a cached summary answer, same events as stream_chat()
+    return [
+        sse_event({'delta': answer}),
+        sse_event({'done': True, 'cached': True, 'session_id': session_id,
+                   'ttft': round(time.perf_counter() - started, 3)}),
+    ]
+
+# Job types: name -> (handler(filename), max jobs of that type running at once across all processes)
+JOB_TYPES = {
+    'extract': (extract_pages, int(os.getenv('EXTRACT_CONCURRENCY', '2'))),
+    'linearize': (linearize_pdf, 2),
+    'summarize': (build_summaries, 1),
+    'index': (build_indexes, 1),
+    'search_index': (index_search, 1),
+}
+
+jobs = JobQueue(METADATA_DB, JOB_TYPES)
+
 # HTML Templates
 UPLOAD_TEMPLATE = """
 <!DOCTYPE html>
@@ -203,10 +2102,26 @@ UPLOAD_TEMPLATE = """
             display: flex;
             justify-content: space-between;
             align-items: center;
+            gap: 0.75rem;
             padding: 0.5rem;
             border-bottom: 1px solid #eee;
         }
         
+        .file-thumb {
+            width: 32px;
+            height: 42px;
+            object-fit: cover;
+            object-position: top;
+            border: 1px solid #eee;
+            border-radius: 3px;
+            flex-shrink: 0;
+        }
+        
+        .recent-file .file-link {
+            flex: 1;
+            text-align: left;
+        }
+        
         .recent-file:last-child {
             border-bottom: none;
         }
@@ -225,6 +2140,57 @@ UPLOAD_TEMPLATE = """
             color: #999;
             font-size: 0.8rem;
         }
+        
+        .search-box {
+            margin-top: 2rem;
+            text-align: left;
+        }
+        
+        .search-box input {
+            width: 100%;
+            padding: 10px 15px;
+            border: 2px solid #eee;
+            border-radius: 20px;
+            font-size: 1rem;
+            outline: none;
+        }
+        
+        .search-box input:focus {
+            border-color: #667eea;
+        }
+        
+        .search-result {
+            padding: 0.5rem;
+            border-bottom: 1px solid #eee;
+        }
+        
+        .search-result > a {
+            color: #667eea;
+            text-decoration: none;
+            font-weight: 500;
+        }
+        
+        .search-hit {
+            display: block;
+            color: #555;
+            font-size: 0.85rem;
+            text-decoration: none;
+            margin-top: 0.25rem;
+        }
+        
+        .search-hit:hover {
+            background: #f8f9ff;
+        }
+        
+        .search-hit mark {
+            background: #fff3a0;
+        }
+        
+        .search-empty {
+            color: #999;
+            font-size: 0.9rem;
+            padding: 0.5rem;
+        }
     </style>
 </head>
 <body>
@@ -259,12 +2225,18 @@ UPLOAD_TEMPLATE = """
         </form>
         
         {% if recent_files %}
+        <div class="search-box">
+            <input type="search" id="searchInput" placeholder="Search all documents" autocomplete="off">
+            <div id="searchResults"></div>
+        </div>
+        
         <div class="recent-files">
             <h3>Recent Files</h3>
             {% for file in recent_files %}
             <div class="recent-file">
-                <a href="{{ url_for('view_pdf', filename=file.name) }}">{{ file.display_name }}</a>
-                <span class="file-date">{{ file.date }}</span>
+                <img class="file-thumb" src="{{ url_for('thumbnail', filename=file.name, page=1) }}" alt="" loading="lazy" onerror="this.style.visibility='hidden'">
+                <a class="file-link" href="{{ url_for('view_pdf', filename=file.name) }}">{{ file.display_name }}</a>
+                <span class="file-date">{{ file.size }}{% if file.pages %} · {{ file.pages }} pages{% endif %} · {{ file.date }}</span>
             </div>
             {% endfor %}
         </div>
@@ -328,6 +2300,134 @@ UPLOAD_TEMPLATE = """
             uploadBtn.disabled = false;
         }
         
+        // Files over the form size limit go through the resumable chunked upload API;
+        // the upload id is remembered per file, so retrying or reloading resumes it
+        const MAX_FORM_SIZE = {{ max_form_size }};
+        
+        document.getElementById('uploadForm').addEventListener('submit', function(e) {
+            const file = fileInput.files[0];
+            if (!file || file.size <= MAX_FORM_SIZE) return;
+            e.preventDefault();
+            uploadBtn.disabled = true;
+            chunkedUpload(file).then(function(result) {
+                window.location.href = result.url;
+            }).catch(function(error) {
+                uploadBtn.disabled = false;
+                uploadBtn.textContent = 'Retry upload';
+                alert('Upload failed: ' + error.message);
+            });
+        });
+        
+        function uploadJson(url, options) {
+            return fetch(url, options).then(function(response) {
+                return response.json().then(function(data) {
+                    return {status: response.status, ok: response.ok, data: data};
+                });
+            });
+        }
+        
+        function chunkedUpload(file) {
+            const resumeKey = 'upload:' + file.name + ':' + file.size + ':' + file.lastModified;
+            const savedId = localStorage.getItem(resumeKey);
+            const resumed = savedId ? uploadJson('/uploads/' + savedId).catch(() => null) : Promise.resolve(null);
+            return resumed.then(function(existing) {
+                if (existing && existing.ok) return existing.data;
+                return uploadJson('/uploads', {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({filename: file.name, size: file.size})
+                }).then(function(created) {
+                    if (!created.ok) throw new Error(created.data.error || 'Upload failed');
+                    localStorage.setItem(resumeKey, created.data.upload_id);
+                    return created.data;
+                });
+            }).then(function(session) {
+                return sendChunks(file, session, session.offset, 0).then(function(result) {
+                    localStorage.removeItem(resumeKey);
+                    return result;
+                }, function(error) {
+                    if (error.final) localStorage.removeItem(resumeKey);
+                    throw error;
+                });
+            });
+        }
+        
+        function sendChunks(file, session, offset, failures) {
+            uploadBtn.textContent = 'Uploading… ' + Math.floor(offset / file.size * 100) + '%';
+            const url = '/uploads/' + session.upload_id;
+            return uploadJson(url + '?offset=' + offset, {
+                method: 'PUT',
+                body: file.slice(offset, offset + session.chunk_size)
+            }).then(function(result) {
+                if (result.data.complete) return result.data;
+                // 409: the server has a different offset (e.g. a chunk landed before a timeout)
+                if (result.ok || result.status === 409) return sendChunks(file, session, result.data.offset, 0);
+                const error = new Error(result.data.error || 'Upload failed');
+                error.final = true;
+                throw error;
+            }, function(error) {
+                // Network error: back off, then resume from the offset the server has
+                if (failures >= 5) throw error;
+                return new Promise(resolve => setTimeout(resolve, 1000 * (failures + 1))).then(function() {
+                    return uploadJson(url).then(status => status.ok ? status.data.offset : offset, () => offset);
+                }).then(next => sendChunks(file, session, next, failures + 1));
+            });
+        }
+        
+        // Search across all uploads; each hit opens the viewer at its page
+        const searchInput = document.getElementById('searchInput');
+        const searchResults = document.getElementById('searchResults');
+        let searchTimer = null;
+        let searchSeq = 0;
+        
+        if (searchInput) {
+            searchInput.addEventListener('input', function() {
+                clearTimeout(searchTimer);
+                searchTimer = setTimeout(runSearch, 250);
+            });
+        }
+        
+        function runSearch() {
+            const query = searchInput.value.trim();
+            const seq = ++searchSeq;
+            if (!query) {
+                searchResults.innerHTML = '';
+                return;
+            }
+            fetch('/search?q=' + encodeURIComponent(query)).then(r => r.json()).then(function(data) {
+                // A slower response to an older query must not replace newer results
+                if (seq === searchSeq) renderSearchResults(data.results || []);
+            }).catch(() => {});
+        }
+        
+        function renderSearchResults(results) {
+            searchResults.innerHTML = '';
+            if (!results.length) {
+                const empty = document.createElement('div');
+                empty.className = 'search-empty';
+                empty.textContent = 'No matches';
+                searchResults.appendChild(empty);
+                return;
+            }
+            results.forEach(function(result) {
+                const item = document.createElement('div');
+                item.className = 'search-result';
+                const link = document.createElement('a');
+                link.href = '/view/' + encodeURIComponent(result.filename);
+                link.textContent = result.display_name;
+                item.appendChild(link);
+                result.hits.forEach(function(hit) {
+                    const hitLink = document.createElement('a');
+                    hitLink.className = 'search-hit';
+                    hitLink.href = link.href + '#page=' + hit.page;
+                    // Snippets are escaped server-side, only <mark> is markup
+                    hitLink.innerHTML = 'p. ' + hit.page + ': ' + hit.snippet;
+                    item.appendChild(hitLink);
+                });
+                searchResults.appendChild(item);
+            });
+        }
+        
         function formatFileSize(bytes) {
             if (bytes === 0) return '0 Bytes';
             const k = 1024;
@@ -474,6 +2574,35 @@ VIEWER_TEMPLATE = """
             display: inline-block;
         }
         
+        .tile-canvas {
+            position: absolute;
+            display: none;
+            pointer-events: none;
+        }
+        
+        .scroll-view {
+            position: relative;
+            width: 100%;
+            height: calc(100vh - 80px);
+            overflow: auto;
+        }
+        
+        .scroll-spacer {
+            position: relative;
+            margin: 0 auto;
+        }
+        
+        .scroll-page {
+            position: absolute;
+            left: 0;
+            top: 0;
+            background: white;
+        }
+        
+        .scroll-page canvas {
+            display: block;
+        }
+        
         .text-layer {
             position: absolute;
             left: 0;
@@ -485,11 +2614,13 @@ VIEWER_TEMPLATE = """
             pointer-events: none;
         }
         
-        .text-layer > span {
+        .text-layer-content > span {
             color: transparent;
             position: absolute;
             white-space: pre;
             cursor: text;
+            font-family: sans-serif;
+            line-height: 1;
             transform-origin: 0% 0%;
             pointer-events: auto;
             user-select: text;
@@ -513,6 +2644,13 @@ VIEWER_TEMPLATE = """
             padding: 3rem;
         }
         
+        .loading img {
+            display: block;
+            max-width: min(800px, 90vw);
+            margin: 1rem auto 0;
+            box-shadow: 0 4px 20px rgba(0,0,0,0.3);
+        }
+        
         .scroll-indicator {
             position: fixed;
             right: 2rem;
@@ -613,6 +2751,24 @@ VIEWER_TEMPLATE = """
             align-self: flex-start;
         }
 
+        .message-sources {
+            align-self: flex-start;
+            font-size: 0.75rem;
+            color: #aaa;
+            margin-top: -0.3rem;
+        }
+
+        .source-link {
+            background: none;
+            border: 1px solid #555;
+            border-radius: 10px;
+            color: #9ab4ff;
+            cursor: pointer;
+            font-size: 0.75rem;
+            margin-left: 0.3rem;
+            padding: 0 0.4rem;
+        }
+
         .message.system {
             background: #2a4a2a;
             color: #90ee90;
@@ -683,6 +2839,7 @@ VIEWER_TEMPLATE = """
             <div class="title">📄 {{ filename }}</div>
         </div>
         <div class="header-right">
+            <div class="page-info" id="jobStatus" style="display: none;"></div>
             <div class="page-info">
                 Page <span id="currentPage">1</span> of <span id="totalPages">-</span>
             </div>
@@ -691,6 +2848,7 @@ VIEWER_TEMPLATE = """
                 <span class="zoom-btn" id="zoomLevel">100%</span>
                 <button class="zoom-btn" onclick="zoomIn()">+</button>
                 <button class="zoom-btn" onclick="resetZoom()">Fit</button>
+                <button class="zoom-btn" id="modeToggle" onclick="toggleViewMode()">Scroll</button>
             </div>
         </div>
     </div>
@@ -699,11 +2857,19 @@ VIEWER_TEMPLATE = """
     
     <div class="viewer-container">
         <div class="pdf-container">
-            <div class="loading" id="loading">Loading PDF...</div>
+            <div class="loading" id="loading">
+                Loading PDF...
+                <!-- Server-rendered preview of page 1 while PDF.js loads the document -->
+                <img src="{{ url_for('thumbnail', filename=filename, page=1, w=800) }}" alt="" onerror="this.remove()">
+            </div>
             <div class="pdf-page-container" id="pageContainer" style="display: none;">
                 <canvas id="pdfCanvas"></canvas>
+                <canvas class="tile-canvas" id="tileCanvas"></canvas>
                 <div class="text-layer" id="textLayer"></div>
             </div>
+            <div class="scroll-view" id="scrollView" style="display: none;">
+                <div class="scroll-spacer" id="scrollSpacer"></div>
+            </div>
         </div>
     </div>
     
@@ -737,148 +2903,624 @@ VIEWER_TEMPLATE = """
         // PDF.js setup
         pdfjsLib.GlobalWorkerOptions.workerSrc = 'https://cdnjs.cloudflare.com/ajax/libs/pdf.js/3.11.174/pdf.worker.min.js';
         
-        let pdfDoc = null;
-        let currentPage = 1;
-        let scale = 1.2;
-        let canvas = document.getElementById('pdfCanvas');
-        let ctx = canvas.getContext('2d');
-        let isRendering = false;
+        let pdfDoc = null;
+        let currentPage = 1;
+        let scale = 1.2;
+        let canvas = document.getElementById('pdfCanvas');
+        let ctx = canvas.getContext('2d');
+        let isRendering = false;
+        
+        // Load PDF with byte-range requests: only the parts needed for the visible
+        // page are fetched instead of streaming the whole file up front
+        const url = {{ pdf_url|tojson }};
+        
+        pdfjsLib.getDocument({
+            url: url,
+            disableStream: true,
+            disableAutoFetch: true,
+            rangeChunkSize: 256 * 1024
+        }).promise.then(function(pdf) {
+            pdfDoc = pdf;
+            document.getElementById('totalPages').textContent = pdf.numPages;
+            document.getElementById('loading').style.display = 'none';
+            
+            // Search results link to a page as /view/<file>#page=N
+            const linkedPage = parseInt(new URLSearchParams(location.hash.slice(1)).get('page'));
+            if (linkedPage >= 1 && linkedPage <= pdf.numPages) currentPage = linkedPage;
+
+            // Render the first (or linked) page in the last used view mode
+            setViewMode(continuousMode);
+            
+            // Show scroll indicator briefly
+            showScrollIndicator();
+        }).catch(function(error) {
+            console.error('Error loading PDF:', error);
+            document.getElementById('loading').textContent = 'Error loading PDF';
+        });
+        
+        // Rendered pages are kept as offscreen canvases keyed by page and zoom level
+        // (least recently used evicted first), and the neighbours of the current page
+        // are pre-rendered while the reader is idle so flipping pages is a single blit
+        const PAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024;
+        const PREFETCH_OFFSETS = [1, -1, 2, -2];
+        const pageCache = new Map();
+        const renderJobs = new Map();
+        let pageCacheBytes = 0;
+        let pendingPage = null;
+        let requestedPage = null;
+        
+        function pageCacheKey(pageNum, atScale) {
+            return pageNum + '@' + atScale.toFixed(4) + 'x' + (window.devicePixelRatio || 1);
+        }
+        
+        // Render resolution follows the screen: zoom x devicePixelRatio, capped by a
+        // canvas pixel budget. A page over budget is drawn at the capped resolution and
+        // the region in view is overlaid with a sharp tile (single page mode).
+        const MAX_CANVAS_PIXELS = 16 * 1024 * 1024;
+        const PREVIEW_SCALE = 0.5;  // Fast first pass, in render pixels per CSS pixel
+        let tileTask = null;
+        let tileTimer = null;
+        let shownEntry = null;
+        let displayGeneration = 0;
+        
+        function targetRenderScale(atScale) {
+            return atScale * (window.devicePixelRatio || 1);
+        }
+        
+        function budgetRenderScale(baseViewport, atScale) {
+            const maxScale = Math.sqrt(MAX_CANVAS_PIXELS / (baseViewport.width * baseViewport.height));
+            return Math.min(targetRenderScale(atScale), maxScale);
+        }
+        
+        function cacheGet(key) {
+            const entry = pageCache.get(key);
+            if (entry) {
+                // Re-insert to mark as most recently used
+                pageCache.delete(key);
+                pageCache.set(key, entry);
+            }
+            return entry;
+        }
+        
+        function cachePut(key, entry) {
+            pageCache.set(key, entry);
+            pageCacheBytes += entry.bytes;
+            for (const [oldKey, oldEntry] of pageCache) {
+                if (pageCacheBytes <= PAGE_CACHE_MAX_BYTES || oldKey === key) break;
+                pageCache.delete(oldKey);
+                pageCacheBytes -= oldEntry.bytes;
+                // Release the backing store right away
+                oldEntry.canvas.width = 0;
+                oldEntry.canvas.height = 0;
+            }
+        }
+        
+        function renderOffscreen(pageNum, atScale) {
+            const key = pageCacheKey(pageNum, atScale);
+            const cached = cacheGet(key);
+            if (cached) return Promise.resolve(cached);
+            if (renderJobs.has(key)) return renderJobs.get(key);
+            
+            const job = pdfDoc.getPage(pageNum).then(function(page) {
+                // Get base viewport at scale 1.0 for consistent sizing
+                const baseViewport = page.getViewport({scale: 1.0});
+                
+                // Calculate render scale for quality
+                const renderScale = budgetRenderScale(baseViewport, atScale);
+                const renderViewport = page.getViewport({scale: renderScale});
+                
+                const offscreen = document.createElement('canvas');
+                offscreen.width = renderViewport.width;
+                offscreen.height = renderViewport.height;
+                
+                return page.render({
+                    canvasContext: offscreen.getContext('2d'),
+                    viewport: renderViewport
+                }).promise.then(function() {
+                    const entry = {
+                        canvas: offscreen,
+                        page: page,
+                        displayWidth: baseViewport.width * atScale,
+                        displayHeight: baseViewport.height * atScale,
+                        bytes: offscreen.width * offscreen.height * 4,
+                        capped: renderScale < targetRenderScale(atScale) - 1e-6
+                    };
+                    cachePut(key, entry);
+                    return entry;
+                });
+            }).finally(function() {
+                renderJobs.delete(key);
+            });
+            renderJobs.set(key, job);
+            return job;
+        }
+        
+        function renderPage(pageNum) {
+            if (continuousMode) {
+                scrollToPage(pageNum);
+                return;
+            }
+            
+            // Queue navigation while a page is being drawn; only the latest request matters
+            requestedPage = pageNum;
+            if (isRendering) {
+                pendingPage = pageNum;
+                return;
+            }
+            isRendering = true;
+            const atScale = scale;
+            const generation = ++displayGeneration;
+            hideTile();
+            
+            // Uncached pages get a quick low-resolution pass while the sharp one renders
+            if (!pageCache.has(pageCacheKey(pageNum, atScale))) {
+                renderPreview(pageNum, atScale, generation);
+            }
+            
+            renderOffscreen(pageNum, atScale).then(function(entry) {
+                displayGeneration++;
+                shownEntry = entry;
+                
+                // Set canvas internal size (for rendering quality)
+                canvas.width = entry.canvas.width;
+                canvas.height = entry.canvas.height;
+                
+                // Set canvas display size (for visual zoom)
+                canvas.style.width = entry.displayWidth + 'px';
+                canvas.style.height = entry.displayHeight + 'px';
+                
+                // Reset context transform and copy the pre-rendered page
+                ctx.setTransform(1, 0, 0, 1, 0, 0);
+                ctx.drawImage(entry.canvas, 0, 0);
+                
+                renderTextLayer(entry.page, atScale, entry.displayWidth, entry.displayHeight);
+                updatePageInfo(pageNum);
+                updateProgressBar();
+                
+                if (entry.capped) {
+                    renderVisibleTile(entry, atScale);
+                }
+            }).catch(function(error) {
+                console.error('Error rendering page:', error);
+            }).finally(function() {
+                isRendering = false;
+                if (pendingPage !== null) {
+                    const next = pendingPage;
+                    pendingPage = null;
+                    renderPage(next);
+                } else {
+                    prefetchAround(pageNum, atScale);
+                }
+            });
+        }
+        
+        function renderPreview(pageNum, atScale, generation) {
+            pdfDoc.getPage(pageNum).then(function(page) {
+                if (generation !== displayGeneration) return;
+                const baseViewport = page.getViewport({scale: 1.0});
+                const previewViewport = page.getViewport({scale: atScale * PREVIEW_SCALE});
+                const preview = document.createElement('canvas');
+                preview.width = previewViewport.width;
+                preview.height = previewViewport.height;
+                return page.render({
+                    canvasContext: preview.getContext('2d'),
+                    viewport: previewViewport
+                }).promise.then(function() {
+                    // Only draw if the sharp render has not landed yet
+                    if (generation !== displayGeneration) return;
+                    canvas.width = preview.width;
+                    canvas.height = preview.height;
+                    canvas.style.width = baseViewport.width * atScale + 'px';
+                    canvas.style.height = baseViewport.height * atScale + 'px';
+                    ctx.setTransform(1, 0, 0, 1, 0, 0);
+                    ctx.drawImage(preview, 0, 0);
+                });
+            }).catch(function(error) {
+                console.log('Preview render skipped:', error);
+            });
+        }
+        
+        function hideTile() {
+            clearTimeout(tileTimer);
+            if (tileTask) {
+                tileTask.cancel();
+                tileTask = null;
+            }
+            document.getElementById('tileCanvas').style.display = 'none';
+        }
+        
+        function renderVisibleTile(entry, atScale) {
+            // Sharp render of just the part of the page that is on screen
+            hideTile();
+            const tile = document.getElementById('tileCanvas');
+            const viewRect = canvas.parentElement.parentElement.getBoundingClientRect();
+            const pageRect = canvas.getBoundingClientRect();
+            const left = Math.max(pageRect.left, viewRect.left) - pageRect.left;
+            const top = Math.max(pageRect.top, viewRect.top) - pageRect.top;
+            const right = Math.min(pageRect.right, viewRect.right) - pageRect.left;
+            const bottom = Math.min(pageRect.bottom, viewRect.bottom) - pageRect.top;
+            if (right <= left || bottom <= top) return;
+            
+            const dpr = window.devicePixelRatio || 1;
+            const tileCanvas = document.createElement('canvas');
+            tileCanvas.width = Math.ceil((right - left) * dpr);
+            tileCanvas.height = Math.ceil((bottom - top) * dpr);
+            const task = entry.page.render({
+                canvasContext: tileCanvas.getContext('2d'),
+                viewport: entry.page.getViewport({scale: targetRenderScale(atScale)}),
+                transform: [1, 0, 0, 1, -left * dpr, -top * dpr]
+            });
+            tileTask = task;
+            task.promise.then(function() {
+                if (tileTask !== task || shownEntry !== entry) return;
+                tileTask = null;
+                tile.width = tileCanvas.width;
+                tile.height = tileCanvas.height;
+                tile.getContext('2d').drawImage(tileCanvas, 0, 0);
+                tile.style.left = left + 'px';
+                tile.style.top = top + 'px';
+                tile.style.width = (right - left) + 'px';
+                tile.style.height = (bottom - top) + 'px';
+                tile.style.display = 'block';
+            }).catch(function() {
+                // Cancelled because the view moved on
+            });
+        }
+        
+        // Panning a large page re-renders the sharp tile once scrolling settles
+        canvas.parentElement.parentElement.addEventListener('scroll', function() {
+            if (continuousMode || !shownEntry || !shownEntry.capped) return;
+            const entry = shownEntry;
+            const atScale = scale;
+            hideTile();
+            tileTimer = setTimeout(function() {
+                if (shownEntry === entry && scale === atScale) {
+                    renderVisibleTile(entry, atScale);
+                }
+            }, 120);
+        }, { passive: true });
+        
+        function prefetchAround(pageNum, atScale) {
+            const idle = window.requestIdleCallback || function(callback) { return setTimeout(callback, 50); };
+            const targets = PREFETCH_OFFSETS
+                .map(offset => pageNum + offset)
+                .filter(target => target >= 1 && target <= pdfDoc.numPages);
+            
+            // One page at a time, and stop as soon as the reader navigates or zooms
+            (function next() {
+                if (!targets.length || isRendering || scale !== atScale || requestedPage !== pageNum) return;
+                const target = targets.shift();
+                idle(function() {
+                    renderOffscreen(target, atScale).then(next, next);
+                });
+            })();
+        }
+        
+        // Text layers are built lazily: showing a page only sizes its layer, and the spans
+        // are created when the pointer reaches the page, i.e. right before a selection can
+        // start. They come from the line boxes the server extracted (/text), go into the
+        // DOM with a single insert and the built layer is kept per page and zoom level.
+        const TEXT_LAYER_CACHE_SIZE = 40;  // Built layers kept for reuse
+        const textLayerCache = new Map();   // "page@scale" -> layer element, least recently used first
+        const pageGeometry = new Map();     // page number -> promise of the server line boxes
+        const measureContext = document.createElement('canvas').getContext('2d');
+        
+        function renderTextLayer(page, atScale, displayWidth, displayHeight, textLayerDiv) {
+            textLayerDiv = textLayerDiv || document.getElementById('textLayer');
+            textLayerDiv.generation = (textLayerDiv.generation || 0) + 1;
+            textLayerDiv.replaceChildren();
+            textLayerDiv.style.width = displayWidth + 'px';
+            textLayerDiv.style.height = displayHeight + 'px';
+            textLayerDiv.pending = {page: page, atScale: atScale};
+        }
+        
+        function ensureTextLayer(textLayerDiv) {
+            const pending = textLayerDiv.pending;
+            if (!pending) return;
+            textLayerDiv.pending = null;
+            const generation = textLayerDiv.generation;
+            const pageNum = pending.page.pageNumber;
+            const key = pageNum + '@' + pending.atScale.toFixed(4);
+            
+            const cached = textLayerCache.get(key);
+            if (cached) {
+                textLayerCache.delete(key);
+                textLayerCache.set(key, cached);
+                textLayerDiv.replaceChildren(cached);
+                return;
+            }
+            
+            loadPageGeometry(pageNum).then(function(geometry) {
+                // A newer page was shown while the geometry was loading
+                if (generation !== textLayerDiv.generation) return;
+                if (!geometry) {
+                    renderPdfjsTextLayer(pending.page, pending.atScale, textLayerDiv, generation);
+                    return;
+                }
+                const layer = buildTextLayer(geometry, pending.atScale);
+                textLayerCache.set(key, layer);
+                while (textLayerCache.size > TEXT_LAYER_CACHE_SIZE) {
+                    textLayerCache.delete(textLayerCache.keys().next().value);
+                }
+                textLayerDiv.replaceChildren(layer);
+            });
+        }
+        
+        function loadPageGeometry(pageNum) {
+            if (!pageGeometry.has(pageNum)) {
+                pageGeometry.set(pageNum, fetch('/text/{{ filename }}/' + pageNum)
+                    .then(function(response) { return response.ok ? response.json() : null; })
+                    .catch(function() { return null; }));
+            }
+            return pageGeometry.get(pageNum);
+        }
+        
+        function buildTextLayer(geometry, atScale) {
+            // Spans are sized from the line boxes and canvas text metrics, so building the
+            // layer never reads layout; the fragment is attached to a detached element
+            const layer = document.createElement('div');
+            layer.className = 'text-layer-content';
+            const fragment = document.createDocumentFragment();
+            geometry.lines.forEach(function(line) {
+                const fontSize = (line[3] - line[1]) * atScale;
+                const width = (line[2] - line[0]) * atScale;
+                measureContext.font = fontSize + 'px sans-serif';
+                const measured = measureContext.measureText(line[4]).width;
+                const span = document.createElement('span');
+                span.textContent = line[4];
+                span.style.cssText = 'left:' + (line[0] * atScale) + 'px;top:' + (line[1] * atScale) +
+                    'px;font-size:' + fontSize + 'px;transform:scaleX(' + (measured ? width / measured : 1) + ')';
+                fragment.appendChild(span);
+            });
+            layer.appendChild(fragment);
+            return layer;
+        }
+        
+        function renderPdfjsTextLayer(page, atScale, textLayerDiv, generation) {
+            // Used when the server has no geometry for the page (e.g. pdftotext missing)
+            page.getTextContent().then(function(textContent) {
+                if (generation !== textLayerDiv.generation) return;
+                const layer = document.createElement('div');
+                layer.className = 'text-layer-content';
+                return pdfjsLib.renderTextLayer({
+                    textContent: textContent,
+                    container: layer,
+                    viewport: page.getViewport({scale: atScale}),
+                    textDivs: []
+                }).promise.then(function() {
+                    if (generation === textLayerDiv.generation) textLayerDiv.replaceChildren(layer);
+                });
+            }).catch(function(error) {
+                console.error('Error rendering text layer:', error);
+            });
+        }
+        
+        // Continuous scroll mode: pages are stacked at their own sizes and only pages near
+        // the viewport get a canvas and text layer. Page offsets are a prefix sum over the
+        // page sizes, which are read lazily as pages come near the viewport (until then a
+        // page is assumed to be the size of page 1). A small pool of page nodes is recycled
+        // while scrolling, so the DOM stays the same size for a 10-page or a 2,000-page document.
+        const SCROLL_OVERSCAN = 2;    // Pages materialized above and below the viewport
+        const SCROLL_PAGE_GAP = 12;   // Pixels between pages
+        const SCROLL_RENDER_DELAY = 60;  // Skip rendering pages that are only flown past
+        let continuousMode = localStorage.getItem('viewerMode') === 'continuous';
+        let layoutScale = null;
+        let pageWidths = null;     // Page sizes at scale 1, index 0 is page 1
+        let pageHeights = null;
+        let pageMeasured = null;   // Whether the size was read from the page itself
+        let pageTops = null;       // pageTops[n - 1] is the top of page n at layoutScale
+        let spacerWidth = 0;
+        let scrollSlots = [];
+        let scrollFrame = null;
+        
+        const scrollView = document.getElementById('scrollView');
+        const scrollSpacer = document.getElementById('scrollSpacer');
+        
+        function toggleViewMode() {
+            setViewMode(!continuousMode);
+        }
+        
+        function setViewMode(continuous) {
+            const target = currentPage;
+            continuousMode = continuous;
+            localStorage.setItem('viewerMode', continuous ? 'continuous' : 'single');
+            document.getElementById('modeToggle').textContent = continuous ? 'Single' : 'Scroll';
+            document.getElementById('pageContainer').style.display = continuous ? 'none' : 'block';
+            scrollView.style.display = continuous ? 'block' : 'none';
+            
+            if (continuous) {
+                scrollToPage(target);
+            } else {
+                requestedPage = null;
+                renderPage(target);
+            }
+        }
+        
+        function layoutScrollView() {
+            return pdfDoc.getPage(1).then(function(page) {
+                if (!pageHeights || pageHeights.length !== pdfDoc.numPages) {
+                    const viewport = page.getViewport({scale: 1});
+                    pageWidths = new Float64Array(pdfDoc.numPages).fill(viewport.width);
+                    pageHeights = new Float64Array(pdfDoc.numPages).fill(viewport.height);
+                    pageMeasured = new Uint8Array(pdfDoc.numPages);
+                    pageMeasured[0] = 1;
+                }
+                layoutScale = scale;
+                computePageTops();
+                scrollSlots.forEach(releaseSlot);
+            });
+        }
+        
+        function computePageTops() {
+            const count = pdfDoc.numPages;
+            pageTops = new Float64Array(count + 1);
+            let width = 0;
+            for (let i = 0; i < count; i++) {
+                pageTops[i + 1] = pageTops[i] + pageHeights[i] * layoutScale + SCROLL_PAGE_GAP;
+                width = Math.max(width, pageWidths[i]);
+            }
+            spacerWidth = width * layoutScale;
+            scrollSpacer.style.width = spacerWidth + 'px';
+            scrollSpacer.style.height = (pageTops[count] - SCROLL_PAGE_GAP) + 'px';
+        }
+        
+        function pageAt(y) {
+            // The last page whose top is at or above y
+            let low = 1;
+            let high = pdfDoc.numPages;
+            while (low < high) {
+                const mid = (low + high + 1) >> 1;
+                if (pageTops[mid - 1] <= y) {
+                    low = mid;
+                } else {
+                    high = mid - 1;
+                }
+            }
+            return low;
+        }
+        
+        function measurePage(pageNum) {
+            if (pageMeasured[pageNum - 1]) return;
+            pageMeasured[pageNum - 1] = 1;
+            pdfDoc.getPage(pageNum).then(function(page) {
+                const viewport = page.getViewport({scale: 1});
+                const index = pageNum - 1;
+                if (viewport.width === pageWidths[index] && viewport.height === pageHeights[index]) return;
+                const grown = (viewport.height - pageHeights[index]) * layoutScale;
+                pageWidths[index] = viewport.width;
+                pageHeights[index] = viewport.height;
+                // A page starting above the viewport pushes everything below it, so scroll
+                // along with it and what is on screen stays put
+                const above = pageTops[index] < scrollView.scrollTop;
+                computePageTops();
+                if (above) scrollView.scrollTop += grown;
+                scrollSlots.forEach(function(slot) {
+                    if (slot.page) placeSlot(slot);
+                });
+                if (!scrollFrame) {
+                    scrollFrame = requestAnimationFrame(updateScrollView);
+                }
+            }).catch(function(error) {
+                console.error('Error loading page size:', error);
+            });
+        }
+        
+        function scrollToPage(pageNum) {
+            // Zoom changes every offset, so lay the pages out again before jumping
+            const ready = layoutScale === scale ? Promise.resolve() : layoutScrollView();
+            ready.then(function() {
+                scrollView.scrollTop = pageTops[pageNum - 1];
+                updateScrollView();
+            });
+        }
         
-        // Load PDF
-        const url = '/pdf/{{ filename }}';
+        function createSlot() {
+            const el = document.createElement('div');
+            el.className = 'scroll-page';
+            const slotCanvas = document.createElement('canvas');
+            const textLayer = document.createElement('div');
+            textLayer.className = 'text-layer';
+            el.appendChild(slotCanvas);
+            el.appendChild(textLayer);
+            scrollSpacer.appendChild(el);
+            el.addEventListener('pointermove', function() { ensureTextLayer(textLayer); });
+            el.addEventListener('pointerdown', function() { ensureTextLayer(textLayer); });
+            const slot = {el: el, canvas: slotCanvas, textLayer: textLayer, page: 0, scale: null, timer: null};
+            scrollSlots.push(slot);
+            return slot;
+        }
         
-        pdfjsLib.getDocument(url).promise.then(function(pdf) {
-            pdfDoc = pdf;
-            document.getElementById('totalPages').textContent = pdf.numPages;
-            document.getElementById('loading').style.display = 'none';
-            document.getElementById('pageContainer').style.display = 'block';
-            
-            // Render first page
-            renderPage(1);
-            
-            // Show scroll indicator briefly
-            showScrollIndicator();
-        }).catch(function(error) {
-            console.error('Error loading PDF:', error);
-            document.getElementById('loading').textContent = 'Error loading PDF';
-        });
+        function releaseSlot(slot) {
+            clearTimeout(slot.timer);
+            slot.page = 0;
+            slot.el.style.display = 'none';
+        }
         
-        function renderPage(pageNum) {
-            if (isRendering) return;
-            isRendering = true;
+        function placeSlot(slot) {
+            const index = slot.page - 1;
+            const width = pageWidths[index] * layoutScale;
+            slot.el.style.width = width + 'px';
+            slot.el.style.height = pageHeights[index] * layoutScale + 'px';
+            slot.el.style.transform = 'translate(' + ((spacerWidth - width) / 2) + 'px, ' + pageTops[index] + 'px)';
+        }
+        
+        function assignSlot(slot, pageNum) {
+            const atScale = scale;
+            clearTimeout(slot.timer);
+            slot.page = pageNum;
+            slot.scale = atScale;
+            slot.el.style.display = 'block';
+            placeSlot(slot);
+            measurePage(pageNum);
+            slot.canvas.width = 0;
+            slot.canvas.height = 0;
+            slot.textLayer.replaceChildren();
+            slot.textLayer.pending = null;
             
-            pdfDoc.getPage(pageNum).then(function(page) {
-                // Clear canvas first
-                ctx.clearRect(0, 0, canvas.width, canvas.height);
-                
-                // Get base viewport at scale 1.0 for consistent sizing
-                const baseViewport = page.getViewport({scale: 1.0});
-                
-                // Calculate render scale for quality
-                const devicePixelRatio = window.devicePixelRatio || 1;
-                const renderScale = scale * 2; // Higher resolution for crisp rendering
-                
-                // Get viewport for rendering (high resolution)
-                const renderViewport = page.getViewport({scale: renderScale});
-                
-                // Set canvas internal size (for rendering quality)
-                canvas.height = renderViewport.height;
-                canvas.width = renderViewport.width;
-                
-                // Set canvas display size (for visual zoom)
-                const displayWidth = baseViewport.width * scale;
-                const displayHeight = baseViewport.height * scale;
-                
-                canvas.style.width = displayWidth + 'px';
-                canvas.style.height = displayHeight + 'px';
-                
-                // Reset context transform
-                ctx.setTransform(1, 0, 0, 1, 0, 0);
-                
-                const renderContext = {
-                    canvasContext: ctx,
-                    viewport: renderViewport
-                };
-                
-                // Render canvas
-                const renderTask = page.render(renderContext);
-                
-                // Render text layer for selection
-                const textLayerDiv = document.getElementById('textLayer');
-                textLayerDiv.innerHTML = ''; // Clear previous text
-                
-                // Set text layer size to match canvas display size
-                textLayerDiv.style.width = displayWidth + 'px';
-                textLayerDiv.style.height = displayHeight + 'px';
-                
-                // Render text layer using PDF.js renderTextLayer function
-                page.getTextContent().then(function(textContent) {
-                    const viewport = page.getViewport({scale: scale});
-                    
-                    // Clear previous text layer
-                    textLayerDiv.innerHTML = '';
-                    
-                    // Use PDF.js built-in text layer rendering
-                    pdfjsLib.renderTextLayer({
-                        textContent: textContent,
-                        container: textLayerDiv,
-                        viewport: viewport,
-                        textDivs: []
-                    }).promise.then(function() {
-                        // After rendering, make all text spans selectable
-                        const textSpans = textLayerDiv.querySelectorAll('span');
-                        textSpans.forEach(function(span) {
-                            span.style.color = 'transparent';
-                            span.style.userSelect = 'text';
-                            span.style.cursor = 'text';
-                            span.style.pointerEvents = 'auto';
-                        });
-                    }).catch(function(error) {
-                        console.log('Text layer rendering failed, falling back to manual method');
-                        
-                        // Fallback to manual text positioning
-                        textContent.items.forEach(function(textItem) {
-                            if (textItem.str.trim() === '') return;
-                            
-                            const span = document.createElement('span');
-                            span.textContent = textItem.str;
-                            span.style.position = 'absolute';
-                            span.style.color = 'transparent';
-                            span.style.cursor = 'text';
-                            span.style.userSelect = 'text';
-                            span.style.pointerEvents = 'auto';
-                            span.style.whiteSpace = 'pre';
-                            span.style.margin = '0';
-                            span.style.padding = '0';
-                            span.style.lineHeight = '1';
-                            
-                            // Simple positioning based on viewport scale
-                            const transform = textItem.transform;
-                            const fontSize = Math.abs(transform[3]);
-                            const x = transform[4];
-                            const y = viewport.height - transform[5];
-                            
-                            span.style.left = x + 'px';
-                            span.style.top = (y - fontSize) + 'px';
-                            span.style.fontSize = fontSize + 'px';
-                            
-                            if (textItem.width) {
-                                span.style.width = textItem.width + 'px';
-                            }
-                            
-                            textLayerDiv.appendChild(span);
-                        });
-                    });
-                });
-                
-                renderTask.promise.then(function() {
-                    isRendering = false;
-                    updatePageInfo(pageNum);
-                    updateProgressBar();
+            slot.timer = setTimeout(function() {
+                renderOffscreen(pageNum, atScale).then(function(entry) {
+                    // The slot may have been recycled for another page meanwhile
+                    if (slot.page !== pageNum || slot.scale !== atScale) return;
+                    slot.canvas.width = entry.canvas.width;
+                    slot.canvas.height = entry.canvas.height;
+                    slot.canvas.style.width = entry.displayWidth + 'px';
+                    slot.canvas.style.height = entry.displayHeight + 'px';
+                    slot.canvas.getContext('2d').drawImage(entry.canvas, 0, 0);
+                    renderTextLayer(entry.page, atScale, entry.displayWidth, entry.displayHeight, slot.textLayer);
+                }).catch(function(error) {
+                    console.error('Error rendering page:', error);
                 });
+            }, SCROLL_RENDER_DELAY);
+        }
+        
+        function updateScrollView() {
+            scrollFrame = null;
+            if (!continuousMode || !pdfDoc || layoutScale !== scale) return;
+            
+            const top = scrollView.scrollTop;
+            const topPage = pageAt(top);
+            const first = Math.max(1, topPage - SCROLL_OVERSCAN);
+            const last = Math.min(pdfDoc.numPages, pageAt(top + scrollView.clientHeight) + SCROLL_OVERSCAN);
+            
+            // The page covering the upper middle of the viewport is the current page
+            const stride = pageTops[topPage] - pageTops[topPage - 1];
+            const anchor = top + Math.min(scrollView.clientHeight, stride) / 2;
+            const visiblePage = pageAt(anchor);
+            if (visiblePage !== currentPage) {
+                updatePageInfo(visiblePage);
+                updateProgressBar();
+            }
+            
+            // Keep slots that still show a page in range, recycle the rest
+            const free = [];
+            const shown = new Set();
+            scrollSlots.forEach(function(slot) {
+                if (slot.page >= first && slot.page <= last && slot.scale === scale) {
+                    shown.add(slot.page);
+                } else {
+                    free.push(slot);
+                }
             });
+            for (let pageNum = first; pageNum <= last; pageNum++) {
+                if (!shown.has(pageNum)) {
+                    assignSlot(free.pop() || createSlot(), pageNum);
+                }
+            }
+            free.forEach(releaseSlot);
         }
         
+        scrollView.addEventListener('scroll', function() {
+            if (!scrollFrame) {
+                scrollFrame = requestAnimationFrame(updateScrollView);
+            }
+        }, { passive: true });
+        
+        window.addEventListener('resize', function() {
+            if (continuousMode && !scrollFrame) {
+                scrollFrame = requestAnimationFrame(updateScrollView);
+            }
+        });
+        
         function updatePageInfo(pageNum) {
             currentPage = pageNum;
             document.getElementById('currentPage').textContent = pageNum;
@@ -917,14 +3559,16 @@ VIEWER_TEMPLATE = """
         }
         
         function nextPage() {
-            if (currentPage < pdfDoc.numPages) {
-                renderPage(currentPage + 1);
+            const fromPage = continuousMode ? currentPage : (requestedPage || currentPage);
+            if (fromPage < pdfDoc.numPages) {
+                renderPage(fromPage + 1);
             }
         }
         
         function prevPage() {
-            if (currentPage > 1) {
-                renderPage(currentPage - 1);
+            const fromPage = continuousMode ? currentPage : (requestedPage || currentPage);
+            if (fromPage > 1) {
+                renderPage(fromPage - 1);
             }
         }
         
@@ -943,6 +3587,7 @@ VIEWER_TEMPLATE = """
         let isScrollNavigating = false;
         
         window.addEventListener('wheel', function(e) {
+            if (continuousMode) return; // The scroll view scrolls natively
             e.preventDefault(); // Prevent default page scrolling
             
             // Accumulate scroll delta for more responsive navigation
@@ -980,6 +3625,7 @@ VIEWER_TEMPLATE = """
         
         // Fallback for touch devices and other scroll events
         window.addEventListener('scroll', function() {
+            if (continuousMode) return;
             const scrollTop = window.pageYOffset || document.documentElement.scrollTop;
             const scrollDelta = scrollTop - lastScrollTop;
             
@@ -1049,6 +3695,10 @@ VIEWER_TEMPLATE = """
         let scrollStartY = 0;
         
         const pageContainer = document.getElementById('pageContainer');
+        const textLayerEl = document.getElementById('textLayer');
+        
+        pageContainer.addEventListener('pointermove', function() { ensureTextLayer(textLayerEl); });
+        pageContainer.addEventListener('pointerdown', function() { ensureTextLayer(textLayerEl); });
         
         pageContainer.addEventListener('mousedown', function(e) {
             // Only enable dragging when zoomed in and not selecting text
@@ -1164,8 +3814,44 @@ VIEWER_TEMPLATE = """
             }
         }
 
-        // Chatbot functionality
-        let chatHistory = [];
+        // Post-upload jobs (text extraction, web optimization, summaries) run in the background;
+        // poll their status with backoff and show what is still in progress
+        const JOB_LABELS = {extract: 'Indexing text…', linearize: 'Optimizing for web…', summarize: 'Summarizing…'};
+        const JOB_FAILED_LABELS = {extract: 'Text extraction failed', linearize: 'Web optimization failed',
+                                   summarize: 'Summarizing failed'};
+        const pendingJobs = {{ pending_jobs | tojson }};
+        
+        function updateJobStatus() {
+            const status = document.getElementById('jobStatus');
+            const failed = pendingJobs.find(job => job.state === 'failed' && JOB_LABELS[job.type]);
+            const running = pendingJobs.find(job => job.state !== 'done' && job.state !== 'failed' && JOB_LABELS[job.type]);
+            if (failed) {
+                status.textContent = JOB_FAILED_LABELS[failed.type];
+            } else if (running) {
+                status.textContent = JOB_LABELS[running.type];
+            }
+            status.style.display = failed || running ? 'block' : 'none';
+        }
+        
+        function pollJob(job, delay) {
+            fetch('/jobs/' + job.id)
+                .then(response => response.ok ? response.json() : null)
+                .then(function(data) {
+                    if (!data) return;
+                    job.state = data.state;
+                    updateJobStatus();
+                    if (data.state !== 'done' && data.state !== 'failed') {
+                        setTimeout(() => pollJob(job, Math.min(delay * 1.5, 5000)), delay);
+                    }
+                })
+                .catch(() => setTimeout(() => pollJob(job, Math.min(delay * 1.5, 5000)), delay));
+        }
+        
+        pendingJobs.forEach(job => pollJob(job, 1000));
+        updateJobStatus();
+
+        // Chatbot functionality (history is kept server-side under chatSessionId)
+        let chatSessionId = null;
         let isChatCollapsed = false;
 
         function toggleChat() {
@@ -1182,7 +3868,10 @@ VIEWER_TEMPLATE = """
         function clearChat() {
             const chatMessages = document.getElementById('chatMessages');
             chatMessages.innerHTML = '<div class="message system">Hi! I can help you understand this PDF. Ask me questions about the content, request summaries, or discuss specific sections.</div>';
-            chatHistory = [];
+            if (chatSessionId) {
+                fetch('/chat/session/' + chatSessionId, {method: 'DELETE'}).catch(() => {});
+            }
+            chatSessionId = null;
         }
 
         function addMessage(content, type) {
@@ -1194,6 +3883,23 @@ VIEWER_TEMPLATE = """
             chatMessages.scrollTop = chatMessages.scrollHeight;
         }
 
+        function addSources(sources) {
+            // Pages of the passages the answer was grounded on; clicking one jumps there
+            const sourcesDiv = document.createElement('div');
+            sourcesDiv.className = 'message-sources';
+            sourcesDiv.textContent = 'Sources:';
+            [...new Set(sources.map(source => source.page))].forEach(function(pageNum) {
+                const link = document.createElement('button');
+                link.className = 'source-link';
+                link.textContent = 'p. ' + pageNum;
+                link.onclick = () => renderPage(pageNum);
+                sourcesDiv.appendChild(link);
+            });
+            const chatMessages = document.getElementById('chatMessages');
+            chatMessages.appendChild(sourcesDiv);
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+        }
+
         function sendMessage() {
             const chatInput = document.getElementById('chatInput');
             const chatSend = document.getElementById('chatSend');
@@ -1203,7 +3909,6 @@ VIEWER_TEMPLATE = """
             
             // Add user message
             addMessage(message, 'user');
-            chatHistory.push({role: 'user', content: message});
             
             // Clear input and disable send button
             chatInput.value = '';
@@ -1218,7 +3923,11 @@ VIEWER_TEMPLATE = """
                 selectedText: window.getSelection().toString()
             };
             
-            // Send to backend
+            // Send to backend and render the answer as tokens stream in
+            let assistantDiv = null;
+            let answer = '';
+            let sources = null;
+            
             fetch('/chat', {
                 method: 'POST',
                 headers: {
@@ -1226,17 +3935,61 @@ VIEWER_TEMPLATE = """
                 },
                 body: JSON.stringify({
                     message: message,
-                    history: chatHistory,
-                    context: pdfContext
+                    session_id: chatSessionId,
+                    context: pdfContext,
+                    stream: true
                 })
             })
-            .then(response => response.json())
-            .then(data => {
-                if (data.response) {
-                    addMessage(data.response, 'assistant');
-                    chatHistory.push({role: 'assistant', content: data.response});
-                } else {
+            .then(response => {
+                const contentType = response.headers.get('Content-Type') || '';
+                if (!response.ok || !response.body || !contentType.startsWith('text/event-stream')) {
+                    return response.json().then(data => {
+                        if (!data.response) throw new Error(data.error || 'Empty response');
+                        if (data.session_id) chatSessionId = data.session_id;
+                        sources = data.sources;
+                        answer = data.response;
+                        addMessage(answer, 'assistant');
+                    });
+                }
+                
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                
+                function handleEvent(rawEvent) {
+                    const dataLines = rawEvent.split('\\n').filter(line => line.startsWith('data:'));
+                    if (!dataLines.length) return;
+                    const payload = JSON.parse(dataLines.map(line => line.slice(5).trim()).join('\\n'));
+                    if (payload.session_id) chatSessionId = payload.session_id;
+                    if (payload.sources) sources = payload.sources;
+                    if (!payload.delta) return;
+                    if (!assistantDiv) {
+                        addMessage('', 'assistant');
+                        assistantDiv = document.getElementById('chatMessages').lastElementChild;
+                    }
+                    answer += payload.delta;
+                    assistantDiv.textContent = answer;
+                    const chatMessages = document.getElementById('chatMessages');
+                    chatMessages.scrollTop = chatMessages.scrollHeight;
+                }
+                
+                function pump() {
+                    return reader.read().then(({done, value}) => {
+                        if (done) return;
+                        buffer += decoder.decode(value, {stream: true});
+                        const events = buffer.split('\\n\\n');
+                        buffer = events.pop();
+                        events.forEach(handleEvent);
+                        return pump();
+                    });
+                }
+                return pump();
+            })
+            .then(() => {
+                if (!answer) {
                     addMessage('Sorry, I encountered an error. Please try again.', 'system');
+                } else if (sources && sources.length) {
+                    addSources(sources);
                 }
             })
             .catch(error => {
@@ -1263,33 +4016,23 @@ VIEWER_TEMPLATE = """
 
 @app.route('/')
 def index():
-    # Get list of uploaded files
-    recent_files = []
-    if os.path.exists(UPLOAD_FOLDER):
-        files = os.listdir(UPLOAD_FOLDER)
-        pdf_files = [f for f in files if f.lower().endswith('.pdf')]
-        
-        for filename in sorted(pdf_files, key=lambda x: os.path.getmtime(os.path.join(UPLOAD_FOLDER, x)), reverse=True)[:5]:
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            file_stat = os.stat(file_path)
-            
-            # Create display name (remove UUID prefix if present)
-            display_name = filename
-            if '_' in filename and len(filename.split('_')[0]) == 36:  # UUID length
-                display_name = '_'.join(filename.split('_')[1:])
-            
-            recent_files.append({
-                'name': filename,
-                'display_name': display_name,
-                'date': os.path.getmtime(file_path)
-            })
+    # Get list of uploaded files from the metadata index
+    recent_files = recent_uploads()
+    for file in recent_files:
+        file['date'] = time.strftime('%Y-%m-%d %H:%M', time.localtime(file['date']))
+        file['size'] = format_file_size(file['size'])
     
-    return render_template_string(UPLOAD_TEMPLATE, recent_files=recent_files)
+    return render_template_string(UPLOAD_TEMPLATE, recent_files=recent_files, max_form_size=MAX_CONTENT_LENGTH)
 
 @app.route('/', methods=['POST'])
 def upload_file():
-    if 'file' not in request.files:
-        flash('No file selected')
+    try:
+        # Parsing the form streams the file part into an UploadSpool
+        if 'file' not in request.files:
+            flash('No file selected')
+            return redirect(request.url)
+    except UnsupportedMediaType:
+        flash('Invalid file. Please upload a PDF file.')
         return redirect(request.url)
     
     file = request.files['file']
@@ -1298,14 +4041,16 @@ def upload_file():
         return redirect(request.url)
     
     if file and allowed_file(file.filename):
-        # Generate unique filename to prevent conflicts
         original_filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{original_filename}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
         
         try:
-            file.save(file_path)
+            # Store under the content hash; repeat uploads reuse the stored copy and its artifacts
+            unique_filename = save_upload(file, original_filename)
+            process_upload(unique_filename)
             return redirect(url_for('view_pdf', filename=unique_filename))
+        except UnsupportedMediaType:
+            flash('Invalid file. Please upload a PDF file.')
+            return redirect(request.url)
         except Exception as e:
             flash(f'Error uploading file: {str(e)}')
             return redirect(request.url)
@@ -1313,6 +4058,131 @@ def upload_file():
         flash('Invalid file type. Please upload a PDF file.')
         return redirect(request.url)
 
+def process_upload(unique_filename):
+    record_upload(unique_filename, os.path.getsize(os.path.join(UPLOAD_FOLDER, unique_filename)),
+                  pages=page_count(unique_filename) or None)
+    # Post-upload work runs in the job queue; the viewer polls /jobs for readiness
+    start_extraction(unique_filename)
+    start_linearization(unique_filename)
+    if extraction_complete(unique_filename):
+        start_summaries(unique_filename)
+
+def upload_session(upload_id):
+    row = get_db(METADATA_DB).execute(
+        'SELECT filename, size FROM upload_sessions WHERE id = ?', (upload_id,)
+    ).fetchone()
+    if row is None or not os.path.exists(partial_path(upload_id)):
+        return None
+    return {'upload_id': upload_id, 'filename': row[0], 'size': row[1],
+            'offset': os.path.getsize(partial_path(upload_id)), 'chunk_size': UPLOAD_PART_SIZE}
+
+def drop_upload_session(upload_id):
+    get_db(METADATA_DB).execute('DELETE FROM upload_sessions WHERE id = ?', (upload_id,))
+    _upload_hashers.pop(upload_id, None)
+    if os.path.exists(partial_path(upload_id)):
+        os.remove(partial_path(upload_id))
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get('filename', '')))
+    size = data.get('size')
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'Invalid file type. Please upload a PDF file.'}), 400
+    if not isinstance(size, int) or size < len(PDF_MAGIC):
+        return jsonify({'error': 'Invalid file size'}), 400
+    if size > MAX_CHUNKED_UPLOAD_SIZE:
+        return jsonify({'error': 'File too large'}), 413
+    
+    # Unfinished uploads past their TTL are discarded whenever a new one starts
+    expired = get_db(METADATA_DB).execute(
+        'SELECT id FROM upload_sessions WHERE created_at < ?', (time.time() - UPLOAD_SESSION_TTL,)
+    ).fetchall()
+    for (expired_id,) in expired:
+        drop_upload_session(expired_id)
+    # Hash state of uploads another worker completed or cancelled
+    for stale_id in list(_upload_hashers):
+        if not os.path.exists(partial_path(stale_id)):
+            _upload_hashers.pop(stale_id, None)
+    
+    upload_id = uuid.uuid4().hex
+    open(partial_path(upload_id), 'wb').close()
+    get_db(METADATA_DB).execute(
+        'INSERT INTO upload_sessions (id, filename, size, created_at) VALUES (?, ?, ?, ?)',
+        (upload_id, filename, size, time.time())
+    )
+    return jsonify(upload_session(upload_id)), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    session = upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(session)
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    with locked_part(upload_id):
+        drop_upload_session(upload_id)
+    return '', 204
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    with locked_part(upload_id) as part:
+        # The offset is checked while holding the lock, so two PUTs for the same offset
+        # (a retry racing the original, possibly in another worker) never both append
+        session = upload_session(upload_id) if part else None
+        if session is None:
+            return jsonify({'error': 'Upload not found'}), 404
+        offset = request.args.get('offset', type=int)
+        if offset != session['offset']:
+            # Out of order or repeated chunk: tell the client where to resume
+            return jsonify({**session, 'error': 'Offset mismatch'}), 409
+        
+        sha256, hashed = _upload_hashers.pop(upload_id, (None, None))
+        if hashed != offset:
+            sha256 = hashlib.sha256() if offset == 0 else None
+        # The PDF header is checked on the first bytes of the file, however the
+        # client split them across chunks; later chunks find it already checked
+        head = PDF_MAGIC
+        if offset < len(PDF_MAGIC):
+            with open(partial_path(upload_id), 'rb') as f:
+                head = f.read(offset)
+        received_from, started = offset, time.perf_counter()
+        while True:
+            chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if len(head) < len(PDF_MAGIC):
+                head += chunk[:len(PDF_MAGIC) - len(head)]
+                if not PDF_MAGIC.startswith(head):
+                    drop_upload_session(upload_id)
+                    return jsonify({'error': 'The uploaded file is not a PDF.'}), 415
+            if offset + len(chunk) > session['size']:
+                drop_upload_session(upload_id)
+                return jsonify({'error': 'Upload is larger than announced'}), 400
+            if sha256:
+                sha256.update(chunk)
+            part.write(chunk)
+            offset += len(chunk)
+        part.flush()
+        upload_bytes.inc(offset - received_from, method='chunked')
+        upload_throughput.observe((offset - received_from) / max(time.perf_counter() - started, 1e-6), method='chunked')
+        
+        if offset < session['size']:
+            if sha256:
+                _upload_hashers[upload_id] = (sha256, offset)
+            return jsonify({**session, 'offset': offset})
+        
+        # Last chunk: the part file becomes the stored object
+        digest = (sha256 or file_sha256(partial_path(upload_id))).hexdigest()
+        object_path = store_object(partial_path(upload_id), digest)
+        unique_filename = link_alias(object_path, digest, session['filename'])
+        drop_upload_session(upload_id)
+    process_upload(unique_filename)
+    return jsonify({**session, 'offset': offset, 'complete': True, 'filename': unique_filename,
+                    'url': url_for('view_pdf', filename=unique_filename)})
+
 @app.route('/view/<filename>')
 def view_pdf(filename):
     file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
@@ -1320,42 +4190,367 @@ def view_pdf(filename):
         flash('File not found')
         return redirect(url_for('index'))
     
-    # Create display name (remove UUID prefix if present)
-    display_name = filename
-    if '_' in filename and len(filename.split('_')[0]) == 36:  # UUID length
-        display_name = '_'.join(filename.split('_')[1:])
-    
-    return render_template_string(VIEWER_TEMPLATE, filename=filename, display_name=display_name)
+    pending_jobs = [{'id': job['id'], 'type': job['type']} for job in jobs.for_document(filename)
+                    if job['state'] in ('queued', 'running')]
+    # The variant is fixed for the whole viewer session: a linearized copy that appears
+    # later gets its own URL, so range requests never mix bytes of two files
+    if web_pdf_path(filename):
+        pdf_url = url_for('serve_pdf', filename=filename, v='web')
+    else:
+        pdf_url = url_for('serve_pdf', filename=filename)
+    return render_template_string(VIEWER_TEMPLATE, filename=filename, display_name=display_name_for(filename),
+                                  pending_jobs=pending_jobs, pdf_url=pdf_url)
 
 @app.route('/pdf/<filename>')
 def serve_pdf(filename):
     try:
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        if not os.path.exists(file_path):
-            print(f"PDF file not found: {file_path}")
+        file_path = upload_pdf_path(filename)
+        if not file_path:
+            print(f"PDF file not found: {filename}")
             return "PDF file not found", 404
         
-        print(f"Serving PDF: {file_path}")
-        return send_from_directory(UPLOAD_FOLDER, filename, mimetype='application/pdf')
+        # The bytes behind each URL never change, so the content hash is a strong ETag and
+        # clients may cache forever. conditional=True answers Range requests with 206 and
+        # If-None-Match with 304.
+        key = doc_key(filename)
+        etag = key if is_digest(key) else True
+        
+        # ?v=web is the linearized copy, with its own ETag; the plain URL is always the upload
+        if request.args.get('v') == 'web':
+            web_path = web_pdf_path(filename)
+            if not web_path:
+                return "PDF file not found", 404
+            file_path = os.path.abspath(web_path)
+            etag = f"{key}-web" if is_digest(key) else True
+        
+        response = send_file(file_path, mimetype='application/pdf', conditional=True,
+                             etag=etag, max_age=PDF_CACHE_MAX_AGE, download_name=filename)
+        response.headers['Cache-Control'] = f'public, max-age={PDF_CACHE_MAX_AGE}, immutable'
+        pdf_response_bytes.observe(response.content_length or 0, status=response.status_code)
+        return response
+    except HTTPException:
+        # e.g. 416 for a range outside the file
+        raise
     except Exception as e:
         print(f"Error serving PDF {filename}: {e}")
         return f"Error serving PDF: {str(e)}", 500
 
-@app.route('/chat', methods=['POST'])
-def chat():
+# Response cache for repeated questions: in-memory LRU with TTL, optionally
+# backed by a SQLite file shared by all workers and kept across restarts
+CHAT_CACHE_SIZE = int(os.getenv('CHAT_CACHE_SIZE', '512'))  # Entries kept in memory (0 disables)
+CHAT_CACHE_TTL = float(os.getenv('CHAT_CACHE_TTL', '3600'))  # Seconds
+CHAT_CACHE_DB = os.getenv('CHAT_CACHE_DB')  # Path to the shared SQLite cache (optional)
+CHAT_CACHE_DB_MAX_ENTRIES = int(os.getenv('CHAT_CACHE_DB_MAX_ENTRIES', '10000'))
+
+class ResponseCache:
+    def __init__(self, max_entries, ttl, db_path=None, db_max_entries=10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.db_max_entries = db_max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, response)
+        self._lock = threading.Lock()
+        self._ready = False  # The table is created on first use, not at import
+
+    def _db(self):
+        conn = get_db(self.db_path)
+        if not self._ready:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS chat_cache ('
+                'key TEXT PRIMARY KEY, response TEXT NOT NULL, expires_at REAL NOT NULL, last_used REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS chat_cache_last_used ON chat_cache (last_used)')
+            self._ready = True
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+
+        if self.db_path:
+            try:
+                row = self._db().execute(
+                    'SELECT response, expires_at FROM chat_cache WHERE key = ? AND expires_at > ?', (key, now)
+                ).fetchone()
+                if row:
+                    self._db().execute('UPDATE chat_cache SET last_used = ? WHERE key = ?', (now, key))
+                    self._remember(key, row[1], row[0])
+                    with self._lock:
+                        self.hits += 1
+                    return row[0]
+            except sqlite3.Error as e:
+                print(f"Chat cache read error: {e}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, response):
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at, response)
+        if self.db_path:
+            try:
+                conn = self._db()
+                conn.execute('INSERT OR REPLACE INTO chat_cache VALUES (?, ?, ?, ?)',
+                             (key, response, expires_at, time.time()))
+                # Keep the shared table bounded: drop expired rows, then the least recently used
+                conn.execute('DELETE FROM chat_cache WHERE expires_at <= ?', (time.time(),))
+                conn.execute('DELETE FROM chat_cache WHERE key IN (SELECT key FROM chat_cache '
+                             'ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.db_max_entries,))
+            except sqlite3.Error as e:
+                print(f"Chat cache write error: {e}")
+
+    def _remember(self, key, expires_at, response):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (expires_at, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+chat_cache = ResponseCache(CHAT_CACHE_SIZE, CHAT_CACHE_TTL, CHAT_CACHE_DB, CHAT_CACHE_DB_MAX_ENTRIES)
+
+def normalize_text(text):
+    return ' '.join(str(text or '').lower().split())
+
+def chat_cache_key(messages, context):
+    # Same document, page, selection, question and (trimmed) history -> same answer, as long
+    # as the prompt is the same too: the system prompt carries the page text, passages and
+    # summaries, and the extraction state is keyed explicitly, so answers given from a
+    # partial extraction or an older index are not served once it has moved on
+    filename = secure_filename(context.get('filename') or '')
+    payload = {
+        'model': CHAT_MODEL,
+        'document': doc_key(filename) if filename else '',
+        'extraction': [page_count(filename), extraction_complete(filename)] if filename else None,
+        'system': hashlib.sha256(str(messages[0].get('content')).encode('utf-8')).hexdigest(),
+        'page': str(context.get('currentPage') or 1),
+        'selected': normalize_text(context.get('selectedText')),
+        'turns': [[m.get('role'), normalize_text(m.get('content'))] for m in messages[1:]],
+    }
+    return hashlib.sha256(json.dumps(payload, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+# Server-held chat sessions: clients send a session id and only the new message.
+# Memory store by default (per process); CHAT_SESSION_DB shares sessions via SQLite.
+CHAT_SESSION_MAX_TURNS = int(os.getenv('CHAT_SESSION_MAX_TURNS', '50'))  # Messages kept per session
+CHAT_SESSION_MAX_SESSIONS = int(os.getenv('CHAT_SESSION_MAX_SESSIONS', '10000'))  # Memory store only
+CHAT_SESSION_TTL = float(os.getenv('CHAT_SESSION_TTL', str(24 * 3600)))  # Idle seconds before eviction
+CHAT_SESSION_DB = os.getenv('CHAT_SESSION_DB')
+SESSION_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+class MemorySessionStore:
+    def __init__(self, max_turns, max_sessions, ttl):
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # session id -> (last used, deque of turns)
+        self._lock = threading.Lock()
+
+    def history(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if not entry:
+                return []
+            if entry[0] + self.ttl < time.time():
+                del self._sessions[session_id]
+                return []
+            return list(entry[1])
+
+    def append(self, session_id, *turns):
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            history = entry[1] if entry else deque(maxlen=self.max_turns)
+            history.extend(turns)
+            self._sessions[session_id] = (now, history)
+            # Least recently used sessions go first once the store is full
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+class SQLiteSessionStore:
+    def __init__(self, db_path, max_turns, ttl):
+        self.db_path = db_path
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self._last_prune = 0
+        self._ready = False  # The table is created on first use, not at import
+
+    def _db(self):
+        conn = get_db(self.db_path)
+        if not self._ready:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS chat_turns ('
+                'seq INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, '
+                'role TEXT NOT NULL, content TEXT NOT NULL, created REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS chat_turns_session ON chat_turns (session_id, seq)')
+            conn.execute('CREATE INDEX IF NOT EXISTS chat_turns_created ON chat_turns (created)')
+            self._ready = True
+        return conn
+
+    def history(self, session_id):
+        rows = self._db().execute(
+            'SELECT role, content FROM (SELECT seq, role, content FROM chat_turns '
+            'WHERE session_id = ? AND created > ? ORDER BY seq DESC LIMIT ?) ORDER BY seq',
+            (session_id, time.time() - self.ttl, self.max_turns)
+        ).fetchall()
+        return [{'role': role, 'content': content} for role, content in rows]
+
+    def append(self, session_id, *turns):
+        now = time.time()
+        conn = self._db()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('INSERT INTO chat_turns (session_id, role, content, created) VALUES (?, ?, ?, ?)',
+                             [(session_id, t['role'], t['content'], now) for t in turns])
+            # Keep only the newest turns of this session
+            conn.execute('DELETE FROM chat_turns WHERE session_id = ? AND seq <= ('
+                         'SELECT seq FROM chat_turns WHERE session_id = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)',
+                         (session_id, session_id, self.max_turns))
+            if now - self._last_prune > 60:
+                # Drop idle sessions at most once a minute
+                self._last_prune = now
+                conn.execute('DELETE FROM chat_turns WHERE created <= ?', (now - self.ttl,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def clear(self, session_id):
+        self._db().execute('DELETE FROM chat_turns WHERE session_id = ?', (session_id,))
+
+if CHAT_SESSION_DB:
+    chat_sessions = SQLiteSessionStore(CHAT_SESSION_DB, CHAT_SESSION_MAX_TURNS, CHAT_SESSION_TTL)
+else:
+    chat_sessions = MemorySessionStore(CHAT_SESSION_MAX_TURNS, CHAT_SESSION_MAX_SESSIONS, CHAT_SESSION_TTL)
+
+def resolve_chat_history(data):
+    # Session clients send only the new message; legacy clients still post the full history
+    session_id = data.get('session_id')
+    if session_id and SESSION_ID_RE.match(str(session_id)):
+        return session_id, chat_sessions.history(session_id)
+    if 'history' in data:
+        return None, data.get('history') or []
+    return uuid.uuid4().hex, []
+
+def record_chat_turn(session_id, message, response):
+    if not session_id:
+        return
     try:
-        data = request.get_json()
-        message = data.get('message', '')
-        history = data.get('history', [])
-        context = data.get('context', {})
-        
-        # Build context-aware prompt
-        system_prompt = f"""You are a helpful PDF assistant. You're helping the user understand a PDF document.
+        chat_sessions.append(session_id, {'role': 'user', 'content': message},
+                             {'role': 'assistant', 'content': response})
+    except Exception as e:
+        print(f"Error saving chat session {session_id}: {e}")
+
+CHAT_MODEL = "gpt-3.5-turbo"
+MISSING_KEY_RESPONSE = "⚠️ OpenAI API key not found. Please set OPENAI_API_KEY in your .env file to enable AI chat."
+
+# Token-budgeted prompt assembly. The budget is filled in order: system prompt and
+# the new message, retrieved page context, document summaries, selected text, then
+# history newest first.
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '3000'))
+MESSAGE_TOKEN_OVERHEAD = 4  # Role and separator tokens the chat format adds per message
+TOKENIZER = os.getenv('TOKENIZER', 'auto')  # 'auto', 'tiktoken' or 'approx'
+PROMPT_PROFILE = os.getenv('PROMPT_PROFILE', '').lower() in ('1', 'true', 'yes')
+
+def approx_count_tokens(text):
+    # Roughly four characters per token for English text
+    return (len(text) + 3) // 4
+
+def approx_truncate_tokens(text, max_tokens):
+    return text[:max(0, max_tokens) * 4]
+
+_tiktoken_encoding = None
+
+def tiktoken_encoding():
+    global _tiktoken_encoding
+    if _tiktoken_encoding is None:
+        import tiktoken
+        _tiktoken_encoding = tiktoken.get_encoding('cl100k_base')
+    return _tiktoken_encoding
+
+def tiktoken_count_tokens(text):
+    return len(tiktoken_encoding().encode(text, disallowed_special=()))
+
+def tiktoken_truncate_tokens(text, max_tokens):
+    tokens = tiktoken_encoding().encode(text, disallowed_special=())
+    return tiktoken_encoding().decode(tokens[:max(0, max_tokens)])
+
+# Tokenizers by name: (count_tokens, truncate_tokens)
+TOKENIZERS = {
+    'approx': (approx_count_tokens, approx_truncate_tokens),
+    'tiktoken': (tiktoken_count_tokens, tiktoken_truncate_tokens),
+}
+
+_tokenizer = None
+_tokenizer_name = None
+_tokenizer_lock = threading.Lock()
+
+def load_tokenizer(name=None):
+    # The server picks the tokenizer once at startup, before it serves anything, and
+    # extraction passes that choice to its workers: chunk sizes written at extraction
+    # and prompt budgets counted in requests always use the same counter.
+    global _tokenizer, _tokenizer_name
+    with _tokenizer_lock:
+        if _tokenizer is None or (name and name != _tokenizer_name):
+            name = name or TOKENIZER
+            if name == 'auto':
+                try:
+                    tiktoken_encoding()  # May download the encoding on first use
+                    name = 'tiktoken'
+                except Exception as e:
+                    print(f"tiktoken unavailable, estimating token counts: {e}")
+                    name = 'approx'
+            _tokenizer = TOKENIZERS[name]
+            _tokenizer_name = name
+    return _tokenizer
+
+def get_tokenizer():
+    return _tokenizer or load_tokenizer()
+
+def tokenizer_name():
+    get_tokenizer()
+    return _tokenizer_name
+
+def count_tokens(text):
+    return get_tokenizer()[0](text)
+
+def truncate_tokens(text, max_tokens):
+    return get_tokenizer()[1](text, max_tokens)
+
+SYSTEM_PROMPT_TEMPLATE = """You are a helpful PDF assistant. You're helping the user understand a PDF document.
 
 Current PDF Context:
-- Filename: {context.get('filename', 'Unknown')}
-- Current Page: {context.get('currentPage', 1)} of {context.get('totalPages', 'Unknown')}
-- Selected Text: {context.get('selectedText', 'None')}
+- Filename: {filename}
+- Current Page: {current_page} of {total_pages}
+- Selected Text: {selected_text}
+
+Current Page Text:
+{page_text}
+
+Relevant Passages From The Document:
+{passages}
+
+Document Overview:
+{overview}
 
 You can help with:
 - Explaining content and concepts
@@ -1364,17 +4559,301 @@ You can help with:
 - Discussing selected text
 - Providing context and analysis
 
-Be concise, helpful, and focus on the PDF content. If the user asks about specific pages or sections, acknowledge the current page context."""
+Be concise, helpful, and focus on the PDF content. If the user asks about specific pages or sections, acknowledge the current page context. When you use the relevant passages, cite their pages like (p. 12)."""
+
+def build_chat_messages(message, history, context, budget=None):
+    started = time.perf_counter()
+    budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+    
+    # Pull the real text of the current page from the page store
+    page_text = None
+    filename = secure_filename(context.get('filename') or '')
+    if filename:
+        try:
+            page_text = read_page(filename, int(context.get('currentPage') or 1))
+        except (OSError, ValueError) as e:
+            print(f"Error reading page text for {filename}: {e}")
+    if page_text:
+        page_text = page_text.strip()[:PAGE_CONTEXT_CHARS]
+    
+    # Retrieve the most relevant passages from the whole document
+    passages = []
+    retrieval_started = time.perf_counter()
+    if filename and message:
+        with chat_span('retrieval'):
+            try:
+                passages = retrieve_passages(filename, message)
+            except (OSError, ValueError) as e:
+                print(f"Error retrieving passages for {filename}: {e}")
+    retrieval_ms = (time.perf_counter() - retrieval_started) * 1000
+    
+    # Fixed cost first: the prompt skeleton and the new message are always sent
+    fields = {
+        'filename': context.get('filename', 'Unknown'),
+        'current_page': context.get('currentPage', 1),
+        'total_pages': context.get('totalPages', 'Unknown'),
+        'selected_text': 'None',
+        'page_text': 'Not available',
+        'passages': 'None found',
+        'overview': 'Not available',
+    }
+    used = count_tokens(SYSTEM_PROMPT_TEMPLATE.format(**fields)) + count_tokens(message) + 2 * MESSAGE_TOKEN_OVERHEAD
+    sections = {'fixed': used}
+    if used > budget:
+        raise RequestEntityTooLarge(f"Message is too long: the prompt budget is {budget} tokens")
+    
+    # Retrieved page context: the current page, then passages in rank order
+    if page_text and used < budget:
+        page_text = truncate_tokens(page_text, budget - used)
+        sections['page_text'] = count_tokens(page_text)
+        used += sections['page_text']
+        fields['page_text'] = page_text
+    passage_lines = []
+    sources = []
+    sections['passages'] = 0
+    for passage in passages:
+        line = f"[Page {passage['page']}] {' '.join(passage['text'].split())}"
+        tokens = count_tokens(line) + 1
+        if used + tokens > budget:
+            break
+        passage_lines.append(line)
+        sources.append({'page': passage['page'], 'start': passage['start'], 'end': passage['end']})
+        sections['passages'] += tokens
+        used += tokens
+    if passage_lines:
+        fields['passages'] = '\n\n'.join(passage_lines)
+    
+    # Precomputed summaries: the document, then the section around the current page
+    summaries = load_summaries(filename) if filename else None
+    if summaries and used < budget:
+        overview = [summaries['document']]
+        section = section_summary(summaries, context_page(context))
+        if section and len(summaries['sections']) > 1:
+            overview.append(f"Pages {section['first']}–{section['last']}: {section['summary']}")
+        overview = truncate_tokens('\n'.join(overview), budget - used)
+        sections['overview'] = count_tokens(overview)
+        used += sections['overview']
+        fields['overview'] = overview
+    
+    selected_text = context.get('selectedText')
+    if selected_text and used < budget:
+        selected_text = truncate_tokens(selected_text, budget - used)
+        sections['selected_text'] = count_tokens(selected_text)
+        used += sections['selected_text']
+        fields['selected_text'] = selected_text
+    
+    # Newest history turns until the budget runs out; each turn is counted once
+    kept = []
+    sections['history'] = 0
+    for turn in reversed(history):
+        # Posted history is client data: anything but a user or assistant turn is dropped
+        if not isinstance(turn, dict) or turn.get('role') not in ('user', 'assistant'):
+            continue
+        content = str(turn.get('content') or '')
+        tokens = count_tokens(content) + MESSAGE_TOKEN_OVERHEAD
+        if used + tokens > budget:
+            break
+        kept.append({'role': turn['role'], 'content': content})
+        sections['history'] += tokens
+        used += tokens
+    kept.reverse()
+    
+    messages = [{"role": "system", "content": SYSTEM_PROMPT_TEMPLATE.format(**fields)}]
+    messages.extend(kept)
+    messages.append({"role": "user", "content": message})
+    
+    stats = {
+        'tokens': used,
+        'budget': budget,
+        'sections': sections,
+        'history_turns': len(kept),
+        'sources': sources,
+        'retrieval_ms': round(retrieval_ms, 3),
+        'build_ms': round((time.perf_counter() - started) * 1000, 3),
+    }
+    prompt_tokens.observe(used)
+    if PROMPT_PROFILE:
+        print(f"Prompt assembly: {stats}")
+    return messages, stats
+
+def chat_error_response(openai_error, message, context):
+    print(f"OpenAI API error: {openai_error}")
+    error_msg = str(openai_error).lower()
+    
+    # Handle specific error types
+    if 'authentication' in error_msg or 'api key' in error_msg:
+        return "🔑 Invalid OpenAI API key. Please check your OPENAI_API_KEY in the .env file."
+    elif 'rate limit' in error_msg or 'quota' in error_msg:
+        return "⏱️ OpenAI API rate limit exceeded. Please try again in a moment."
+    elif 'connection' in error_msg or 'network' in error_msg:
+        return "🌐 Network connection issue. Please check your internet connection and try again."
+    
+    # Fallback to enhanced context-aware responses
+    if context.get('selectedText'):
+        selected = context['selectedText'][:200]
+        return f"I can see you've selected: \"{selected}{'...' if len(context['selectedText']) > 200 else ''}\"\n\nWhat would you like me to explain about this selection? (Note: AI chat temporarily unavailable)"
+    elif 'summary' in message.lower():
+        return f"I'd be happy to provide a summary of page {context.get('currentPage', 1)} of this document. What specific section interests you? (Note: AI chat temporarily unavailable)"
+    elif 'explain' in message.lower():
+        return "I can help explain concepts from this PDF. Could you point me to the specific section or concept you'd like me to clarify? (Note: AI chat temporarily unavailable)"
+    return f"I'm here to help you understand this PDF document. Currently viewing page {context.get('currentPage', 1)} of {context.get('totalPages', '?')}. What would you like to know? (Note: AI chat temporarily unavailable)"
+
+def sse_event(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+def stream_chat(messages, message, context, started, cache_key=None, session_id=None, sources=None):
+    # Relay completion deltas as Server-Sent Events as soon as they arrive
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        yield sse_event({'delta': MISSING_KEY_RESPONSE})
+        yield sse_event({'done': True, 'session_id': session_id})
+        return
+
+    cached = chat_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        record_chat_turn(session_id, message, cached)
+        yield sse_event({'delta': cached})
+        yield sse_event({'done': True, 'cached': True, 'session_id': session_id, 'sources': sources,
+                         'ttft': round(time.perf_counter() - started, 3)})
+        return
+
+    first_token_at = None
+    parts = []
+    requested_at = time.perf_counter()
+    try:
+        stream = get_openai_client().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            max_tokens=500,
+            temperature=0.7,
+            stream=True
+        )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+                llm_ttft_seconds.observe(first_token_at - requested_at)
+            parts.append(delta)
+            yield sse_event({'delta': delta})
+        if parts:
+            response = ''.join(parts).strip()
+            if cache_key:
+                chat_cache.set(cache_key, response)
+            record_chat_turn(session_id, message, response)
+    except Exception as openai_error:
+        # Tokens already shown stay; the error text is appended after them
+        prefix = '\n\n' if first_token_at is not None else ''
+        yield sse_event({'delta': prefix + chat_error_response(openai_error, message, context)})
+    chat_stage_seconds.observe(time.perf_counter() - requested_at, stage='completion')
+
+    yield sse_event({
+        'done': True,
+        'session_id': session_id,
+        'sources': sources,
+        'ttft': round(first_token_at - started, 3) if first_token_at is not None else None,
+    })
+
+@app.route('/thumb/<filename>/<int:page>')
+def thumbnail(filename, page):
+    if not upload_pdf_path(filename):
+        return "PDF file not found", 404
+    pages = page_count(filename)
+    if page < 1 or (pages and page > pages):
+        return "Page not found", 404
+    if not PDFTOPPM:
+        return "Thumbnails unavailable", 503
+    
+    requested = request.args.get('w', type=int) or THUMB_WIDTHS[0]
+    width = min(THUMB_WIDTHS, key=lambda w: abs(w - requested))
+    try:
+        path = render_thumbnail(filename, page, width)
+    except subprocess.CalledProcessError:
+        return "Page not found", 404
+    except Exception as e:
+        print(f"Error rendering thumbnail for {filename} page {page}: {e}")
+        return f"Error rendering thumbnail: {str(e)}", 500
+    
+    response = send_file(path, mimetype='image/png', conditional=True, max_age=PDF_CACHE_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={PDF_CACHE_MAX_AGE}, immutable'
+    return response
+
+@app.route('/text/<filename>/<int:page>')
+def text_layer(filename, page):
+    if not upload_pdf_path(filename):
+        return "PDF file not found", 404
+    pages = page_count(filename)
+    if page < 1 or (pages and page > pages):
+        return "Page not found", 404
+    if not PDFTOTEXT:
+        return "Text geometry unavailable", 503
+    
+    try:
+        path = text_geometry(filename, page)
+    except subprocess.CalledProcessError:
+        return "Page not found", 404
+    except Exception as e:
+        print(f"Error extracting text geometry for {filename} page {page}: {e}")
+        return f"Error extracting text geometry: {str(e)}", 500
+    
+    response = send_file(path, mimetype='application/json', conditional=True, max_age=PDF_CACHE_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={PDF_CACHE_MAX_AGE}, immutable'
+    return response
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
 
-        # Prepare messages for GPT
-        messages = [{"role": "system", "content": system_prompt}]
+@app.route('/search')
+def search():
+    if not search_available:
+        return jsonify({'error': 'Search is unavailable, SQLite was built without FTS5'}), 503
+    query = request.args.get('q', '').strip()
+    k = max(1, min(request.args.get('k', SEARCH_TOP_K, type=int), 50))
+    started = time.perf_counter()
+    results = search_documents(query, k)
+    return jsonify({'query': query, 'results': results,
+                    'took_ms': round((time.perf_counter() - started) * 1000, 1)})
+
+@app.route('/metrics')
+def metrics():
+    if not METRICS_ENABLED:
+        return "Metrics are disabled", 404
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    try:
+        started = time.perf_counter()
+        data = request.get_json()
+        message = data.get('message', '')
+        context = data.get('context', {})
+        session_id, history = resolve_chat_history(data)
         
-        # Add conversation history (limit to last 10 messages to avoid token limits)
-        recent_history = history[-10:] if len(history) > 10 else history
-        messages.extend(recent_history)
+        # Summary requests are served from the precomputed summaries
+        answer = summary_answer(message, context)
+        if answer is not None:
+            record_chat_turn(session_id, message, answer)
+            if data.get('stream'):
+                return Response(summary_events(answer, started, session_id), mimetype='text/event-stream',
+                                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+            return jsonify({'response': answer, 'session_id': session_id, 'cached': True})
         
-        # Add current message
-        messages.append({"role": "user", "content": message})
+        with chat_span('prompt_build'):
+            messages, prompt_stats = build_chat_messages(message, history, context)
+        cache_key = chat_cache_key(messages, context)
+        
+        if data.get('stream'):
+            return Response(stream_with_context(stream_chat(messages, message, context, started, cache_key, session_id,
+                                                                prompt_stats['sources'])),
+                            mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
         
         # Use OpenAI API for real GPT responses
         try:
@@ -1382,57 +4861,261 @@ Be concise, helpful, and focus on the PDF content. If the user asks about specif
             api_key = os.getenv('OPENAI_API_KEY')
             
             if not api_key:
-                response = "⚠️ OpenAI API key not found. Please set OPENAI_API_KEY in your .env file to enable AI chat."
+                response = MISSING_KEY_RESPONSE
+            elif (cached := chat_cache.get(cache_key)) is not None:
+                response = cached
+                record_chat_turn(session_id, message, response)
             else:
-                # Initialize OpenAI client with modern approach
-                from openai import OpenAI
-                client = OpenAI(api_key=api_key)
-                
-                # Make API call to OpenAI using new client
-                completion = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=messages,
-                    max_tokens=500,
-                    temperature=0.7
-                )
+                # Make API call to OpenAI using the shared pooled client
+                with chat_span('completion'):
+                    completion = get_openai_client().chat.completions.create(
+                        model=CHAT_MODEL,
+                        messages=messages,
+                        max_tokens=500,
+                        temperature=0.7
+                    )
                 
                 response = completion.choices[0].message.content.strip()
+                chat_cache.set(cache_key, response)
+                record_chat_turn(session_id, message, response)
                 
         except Exception as openai_error:
-            print(f"OpenAI API error: {openai_error}")
-            error_msg = str(openai_error).lower()
-            
-            # Handle specific error types
-            if 'authentication' in error_msg or 'api key' in error_msg:
-                response = "🔑 Invalid OpenAI API key. Please check your OPENAI_API_KEY in the .env file."
-            elif 'rate limit' in error_msg or 'quota' in error_msg:
-                response = "⏱️ OpenAI API rate limit exceeded. Please try again in a moment."
-            elif 'connection' in error_msg or 'network' in error_msg:
-                response = "🌐 Network connection issue. Please check your internet connection and try again."
-            else:
-                # Fallback to enhanced context-aware responses
-                if context.get('selectedText'):
-                    selected = context['selectedText'][:200]
-                    response = f"I can see you've selected: \"{selected}{'...' if len(context['selectedText']) > 200 else ''}\"\n\nWhat would you like me to explain about this selection? (Note: AI chat temporarily unavailable)"
-                elif 'summary' in message.lower():
-                    response = f"I'd be happy to provide a summary of page {context.get('currentPage', 1)} of this document. What specific section interests you? (Note: AI chat temporarily unavailable)"
-                elif 'explain' in message.lower():
-                    response = "I can help explain concepts from this PDF. Could you point me to the specific section or concept you'd like me to clarify? (Note: AI chat temporarily unavailable)"
-                else:
-                    response = f"I'm here to help you understand this PDF document. Currently viewing page {context.get('currentPage', 1)} of {context.get('totalPages', '?')}. What would you like to know? (Note: AI chat temporarily unavailable)"
+            response = chat_error_response(openai_error, message, context)
         
-        return jsonify({'response': response})
+        return jsonify({'response': response, 'session_id': session_id, 'sources': prompt_stats['sources']})
         
+    except RequestEntityTooLarge as e:
+        return jsonify({'error': e.description}), 413
     except Exception as e:
         print(f"Chat error: {e}")
         return jsonify({'error': 'Failed to process chat request'}), 500
 
+@app.route('/chat/session/<session_id>', methods=['DELETE'])
+def clear_chat_session(session_id):
+    if not SESSION_ID_RE.match(session_id):
+        return jsonify({'error': 'Invalid session id'}), 400
+    chat_sessions.clear(session_id)
+    return jsonify({'cleared': session_id})
+
+# ASGI entry point (`uvicorn --factory app:create_asgi_app`). POST /chat runs on the
+# event loop with AsyncOpenAI, so a chat waiting on the model holds no thread; every
+# other route is the Flask app running in a separate WSGI thread pool.
+ASGI_WSGI_WORKERS = int(os.getenv('ASGI_WSGI_WORKERS', '16'))  # Threads for the Flask routes
+
+async def read_asgi_body(scope, receive, limit=None):
+    # Same request size limit as the Flask routes
+    limit = MAX_CONTENT_LENGTH if limit is None else limit
+    for name, value in scope.get('headers', ()):
+        if name == b'content-length' and value.isdigit() and int(value) > limit:
+            raise RequestEntityTooLarge()
+    chunks = []
+    size = 0
+    while True:
+        event = await receive()
+        chunk = event.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            raise RequestEntityTooLarge()
+        chunks.append(chunk)
+        if not event.get('more_body'):
+            return b''.join(chunks)
+
+async def send_asgi_json(send, payload, status=200):
+    body = json.dumps(payload).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def astream_chat(messages, message, context, started, cache_key=None, session_id=None, sources=None):
+    # Async twin of stream_chat(): same events, no thread held while waiting for tokens
+    if not os.getenv('OPENAI_API_KEY'):
+        yield sse_event({'delta': MISSING_KEY_RESPONSE})
+        yield sse_event({'done': True, 'session_id': session_id})
+        return
+
+    # The response cache and the session store may be SQLite files (busy timeouts): off the loop
+    cached = await asyncio.to_thread(chat_cache.get, cache_key) if cache_key else None
+    if cached is not None:
+        await asyncio.to_thread(record_chat_turn, session_id, message, cached)
+        yield sse_event({'delta': cached})
+        yield sse_event({'done': True, 'cached': True, 'session_id': session_id, 'sources': sources,
+                         'ttft': round(time.perf_counter() - started, 3)})
+        return
+
+    first_token_at = None
+    parts = []
+    requested_at = time.perf_counter()
+    try:
+        stream = await get_async_openai_client().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            max_tokens=500,
+            temperature=0.7,
+            stream=True
+        )
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+                llm_ttft_seconds.observe(first_token_at - requested_at)
+            parts.append(delta)
+            yield sse_event({'delta': delta})
+        if parts:
+            response = ''.join(parts).strip()
+            if cache_key:
+                await asyncio.to_thread(chat_cache.set, cache_key, response)
+            await asyncio.to_thread(record_chat_turn, session_id, message, response)
+    except Exception as openai_error:
+        prefix = '\n\n' if first_token_at is not None else ''
+        yield sse_event({'delta': prefix + chat_error_response(openai_error, message, context)})
+    chat_stage_seconds.observe(time.perf_counter() - requested_at, stage='completion')
+
+    yield sse_event({
+        'done': True,
+        'session_id': session_id,
+        'sources': sources,
+        'ttft': round(first_token_at - started, 3) if first_token_at is not None else None,
+    })
+
+async def asgi_chat(scope, receive, send):
+    started = time.perf_counter()
+    try:
+        data = json.loads(await read_asgi_body(scope, receive) or b'{}')
+        message = data.get('message', '')
+        context = data.get('context', {})
+        session_id, history = await asyncio.to_thread(resolve_chat_history, data)
+        
+        answer = await asyncio.to_thread(summary_answer, message, context)
+        if answer is not None:
+            await asyncio.to_thread(record_chat_turn, session_id, message, answer)
+            if data.get('stream'):
+                await send({'type': 'http.response.start', 'status': 200,
+                            'headers': [(b'content-type', b'text/event-stream; charset=utf-8'),
+                                        (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]})
+                await send({'type': 'http.response.body', 'body': ''.join(summary_events(answer, started, session_id)).encode('utf-8')})
+            else:
+                await send_asgi_json(send, {'response': answer, 'session_id': session_id, 'cached': True})
+            return
+        
+        # Prompt assembly reads the page store and indexes from disk; keep it off the loop
+        with chat_span('prompt_build'):
+            messages, prompt_stats = await asyncio.to_thread(build_chat_messages, message, history, context)
+        cache_key = await asyncio.to_thread(chat_cache_key, messages, context)  # Reads the page index
+    except RequestEntityTooLarge as e:
+        await send_asgi_json(send, {'error': e.description}, 413)
+        return
+    except Exception as e:
+        print(f"Chat error: {e}")
+        await send_asgi_json(send, {'error': 'Failed to process chat request'}, 500)
+        return
+    
+    if data.get('stream'):
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream; charset=utf-8'),
+                                (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]})
+        async for event in astream_chat(messages, message, context, started, cache_key, session_id,
+                                        prompt_stats['sources']):
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    
+    # The response cache and the session store may be SQLite files (busy timeouts): off the loop
+    if not os.getenv('OPENAI_API_KEY'):
+        response = MISSING_KEY_RESPONSE
+    elif (cached := await asyncio.to_thread(chat_cache.get, cache_key)) is not None:
+        response = cached
+        await asyncio.to_thread(record_chat_turn, session_id, message, response)
+    else:
+        try:
+            with chat_span('completion'):
+                completion = await get_async_openai_client().chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=messages,
+                    max_tokens=500,
+                    temperature=0.7
+                )
+            response = completion.choices[0].message.content.strip()
+            await asyncio.to_thread(chat_cache.set, cache_key, response)
+            await asyncio.to_thread(record_chat_turn, session_id, message, response)
+        except Exception as openai_error:
+            response = chat_error_response(openai_error, message, context)
+    await send_asgi_json(send, {'response': response, 'session_id': session_id, 'sources': prompt_stats['sources']})
+
+def create_asgi_app():
+    # Optional dependencies: pip install uvicorn a2wsgi
+    from a2wsgi import WSGIMiddleware
+    start_app()
+    wsgi = WSGIMiddleware(app, workers=ASGI_WSGI_WORKERS)
+
+    async def asgi_app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                event = await receive()
+                if event['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif event['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        elif scope['type'] == 'http' and scope['path'] == '/chat' and scope['method'] == 'POST':
+            if not METRICS_ENABLED:
+                await asgi_chat(scope, receive, send)
+                return
+            # The Flask request hooks never see this route, so it is timed here
+            started = time.perf_counter()
+
+            async def timed_send(event):
+                if event['type'] == 'http.response.start':
+                    http_request_seconds.observe(time.perf_counter() - started, route='/chat',
+                                                 method='POST', status=event['status'])
+                await send(event)
+            await asgi_chat(scope, receive, timed_send)
+        else:
+            await wsgi(scope, receive, send)
+
+    return asgi_app
+
+# Startup of a serving process: folders, the metadata index, the tokenizer, job workers
+# and the search backfill. Importing the module does none of it (extraction pool workers,
+# tests and benchmarks import it too): main(), create_app() and create_asgi_app() start
+# the process, and so does the first request of a plain `gunicorn app:app` worker.
+_started = False
+_start_lock = threading.Lock()
+
+def start_app():
+    global _started
+    if _started:
+        return app
+    with _start_lock:
+        if not _started:
+            for folder in (UPLOAD_FOLDER, OBJECTS_FOLDER, PARTIAL_FOLDER, THUMB_FOLDER, GEOMETRY_FOLDER):
+                os.makedirs(folder, exist_ok=True)
+            sweep_upload_spools()
+            init_metadata_index()
+            load_tokenizer()
+            jobs.start()
+            backfill_search_index()
+            _started = True
+    return app
+
+@app.before_request
+def ensure_started():
+    start_app()
+
+def create_app():
+    # WSGI factory: `gunicorn 'app:create_app()'` starts each worker before its first request
+    return start_app()
+
 def main():
     print("🚀 Starting PDF Viewer Application...")
     print("📁 Upload folder:", os.path.abspath(UPLOAD_FOLDER))
     print("📖 Open your browser and go to: http://localhost:5000")
     print("✨ Features: File upload, scroll navigation, zoom controls")
     print("🔧 Press Ctrl+C to stop the server")
+    start_app()
     
     try:
         app.run(host='0.0.0.0', port=5000, debug=False)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Load test: /pdf latency while many /chat requests wait on the model
+
+Starts the OpenAI-compatible stub from tests/openai_stub.py, answering after a
+fixed delay, runs the app against it (uvicorn with create_asgi_app, or gunicorn
+with sync workers for comparison), then measures /pdf/<filename> latency idle
+and while --chats concurrent chats are in flight.
+
+    python benchmarks/chat_load.py document.pdf --server asgi --chats 200
+    python benchmarks/chat_load.py document.pdf --server gunicorn --chats 200
+
+Needs httpx plus uvicorn and a2wsgi (`pip install -e '.[asgi]'`) or gunicorn.
+"""
+import argparse
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+
+from openai_stub import free_port, serve_stub  # noqa: E402  (shared with the chat tests)
+
+
+def start_stub(port, delay):
+    # Its own process, so serving the stub never competes with the measuring client
+    process = multiprocessing.Process(target=serve_stub, args=(port, delay), daemon=True)
+    process.start()
+    return process
+
+
+def start_app(server, port, workdir, stub_port):
+    env = {**os.environ, 'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': f'http://127.0.0.1:{stub_port}/v1',
+           'OPENAI_POOL_SIZE': '1000', 'CHAT_CACHE_SIZE': '0', 'METRICS': '0', 'PYTHONPATH': ROOT}
+    if server == 'asgi':
+        args = [sys.executable, '-m', 'uvicorn', '--factory', 'app:create_asgi_app',
+                '--port', str(port), '--log-level', 'warning']
+    else:
+        args = [sys.executable, '-m', 'gunicorn', '--workers', '4', '--bind', f'127.0.0.1:{port}', 'app:app']
+    return subprocess.Popen(args, cwd=workdir, env=env)
+
+
+async def pdf_latencies(client, url, count):
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        response = await client.get(url, headers={'Range': 'bytes=0-65535'})
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def describe(latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return f"p50 {statistics.median(latencies) * 1000:7.1f}ms  p95 {p95 * 1000:7.1f}ms"
+
+
+async def run(base_url, pdf_url, chats, samples):
+    limits = httpx.Limits(max_connections=chats + 10)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        for _ in range(100):
+            try:
+                await client.get('/')
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+        # One chat first, so client setup in the app is not part of the measurement
+        await client.post('/chat', json={'message': 'warm up', 'history': [], 'context': {}})
+        idle = await pdf_latencies(client, pdf_url, samples)
+
+        async def chat(i):
+            started = time.perf_counter()
+            response = await client.post('/chat', json={'message': f'question {i}', 'history': [], 'context': {}})
+            response.raise_for_status()
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(chat(i)) for i in range(chats)]
+        await asyncio.sleep(0.2)  # Let the chats reach the model
+        loaded = await pdf_latencies(client, pdf_url, samples)
+        chat_latencies = await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    print(f"/pdf idle            {describe(idle)}")
+    print(f"/pdf during chats    {describe(loaded)}")
+    print(f"/chat x{chats:<4}         {describe(chat_latencies)}  (all done in {elapsed:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('pdf')
+    parser.add_argument('--server', choices=['asgi', 'gunicorn'], default='asgi')
+    parser.add_argument('--chats', type=int, default=200, help='concurrent /chat requests')
+    parser.add_argument('--delay', type=float, default=2.0, help='seconds the stub model takes per answer')
+    parser.add_argument('--samples', type=int, default=50, help='/pdf requests per measurement')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='chat-load-')
+    os.makedirs(os.path.join(workdir, 'uploads'))
+    with open(args.pdf, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    filename = f"{digest}_{os.path.basename(args.pdf)}"
+    shutil.copyfile(args.pdf, os.path.join(workdir, 'uploads', filename))
+
+    stub_port, app_port = free_port(), free_port()
+    stub = start_stub(stub_port, args.delay)
+    process = start_app(args.server, app_port, workdir, stub_port)
+    try:
+        asyncio.run(run(f'http://127.0.0.1:{app_port}', f'/pdf/{filename}', args.chats, args.samples))
+    finally:
+        process.terminate()
+        process.wait()
+        stub.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Text extraction throughput (pages/sec) on a synthetic multi-hundred-page PDF
+
+Writes a plain multi-page PDF (one text object per line, --pages pages), or
+uses the given PDF instead, and times app.extract_pages on it in a scratch
+directory: once as a single pdftotext run (how extraction worked before
+sharding) and once per requested pool size. Only the sharded pdftotext runs
+(with the chunking they do in the workers) and the page-store writes are
+timed: the BM25 index, dense index, search index and summaries are switched
+off for the extraction runs, and the BM25 and dense index builds are timed
+separately afterwards.
+
+    python benchmarks/extract_throughput.py --pages 500 --workers 1 2 4 8
+    python benchmarks/extract_throughput.py --pdf document.pdf
+
+Needs poppler's pdftotext and pdfinfo on PATH.
+"""
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = ('the', 'retrieval', 'document', 'page', 'index', 'section', 'figure', 'table', 'result', 'method',
+         'analysis', 'system', 'value', 'model', 'data', 'report', 'summary', 'process', 'level', 'range')
+
+
+def write_synthetic_pdf(path, pages, lines_per_page=45, seed=0):
+    # Catalog, page tree and font first, then a page object and a content stream per page
+    rng = random.Random(seed)
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None,
+               b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    page_ids = []
+    for page_num in range(1, pages + 1):
+        lines = [f'Page {page_num}'] + [' '.join(rng.choices(WORDS, k=12)) for _ in range(lines_per_page - 1)]
+        stream = ''.join(f'BT /F1 10 Tf 50 {770 - 16 * i} Td ({line}) Tj ET\n'
+                         for i, line in enumerate(lines)).encode('latin-1')
+        objects.append(b'<< /Length %d >>\nstream\n%sendstream' % (len(stream), stream))
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                       b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % (len(objects)))
+        page_ids.append(len(objects))
+    kids = b' '.join(b'%d 0 R' % page_id for page_id in page_ids)
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, pages)
+
+    with open(path, 'wb') as f:
+        f.write(b'%PDF-1.4\n')
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(f.tell())
+            f.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+        xref = f.tell()
+        f.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b'%010d 00000 n \n' % offset)
+        f.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+
+
+class NoIndex:
+    # Stands in for BM25Index while extraction is timed on its own
+    passages = ()
+
+    def add_tokens(self, page_num, start, end, tokens):
+        pass
+
+    def save(self, path):
+        pass
+
+
+def best_of(repeat, run):
+    best = result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pdf', help='measure this PDF instead of a synthetic one')
+    parser.add_argument('--pages', type=int, default=400, help='pages of the synthetic PDF')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--shard-pages', type=int, default=25)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per setting, the best is reported')
+    args = parser.parse_args()
+
+    # app.py keeps its state under ./uploads
+    workdir = tempfile.mkdtemp(prefix='extract-bench-')
+    if args.pdf:
+        pdf_path = os.path.abspath(args.pdf)
+    else:
+        pdf_path = os.path.join(workdir, f'synthetic-{args.pages}.pdf')
+        write_synthetic_pdf(pdf_path, args.pages)
+    with open(pdf_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    os.chdir(workdir)
+    os.environ['SUMMARIZE_DOCUMENTS'] = '0'
+    os.environ['JOB_WORKERS'] = '0'
+    sys.path.insert(0, ROOT)
+    import app
+    app.start_app()
+
+    if not app.PDFTOTEXT:
+        sys.exit('pdftotext not found on PATH')
+    filename = f"{digest}_{os.path.basename(pdf_path)}"
+    shutil.copyfile(pdf_path, os.path.join(app.UPLOAD_FOLDER, filename))
+
+    # Extraction only: no index is built or saved while it is timed
+    indexes = (app.BM25Index, app.build_vector_index, app.search_available)
+    app.BM25Index, app.build_vector_index, app.search_available = NoIndex, lambda filename, index: None, False
+
+    settings = [('single pdftotext run', 1, None)]
+    settings += [(f'{workers} workers, {args.shard_pages} pages/shard', workers, args.shard_pages)
+                 for workers in args.workers]
+    try:
+        for label, workers, shard_pages in settings:
+            if app._extract_pool is not None:
+                app._extract_pool.shutdown()
+                app._extract_pool = None
+            app.EXTRACT_WORKERS = workers
+            original_total = app.pdf_page_total
+            if shard_pages:
+                app.EXTRACT_SHARD_PAGES = shard_pages
+            else:
+                # Without a page total the document is extracted as one shard
+                app.pdf_page_total = lambda path: None
+            try:
+                app.get_extract_pool().submit(int).result()  # Start the workers outside the timing
+                best, pages = best_of(args.repeat, lambda: app.extract_pages(filename))
+            finally:
+                app.pdf_page_total = original_total
+            print(f"{label:32} {pages:6d} pages  {best:8.2f}s  {pages / best:8.1f} pages/s")
+
+        # The index builds that follow extraction, from the page store it wrote
+        app.BM25Index, app.build_vector_index, app.search_available = indexes
+
+        def build_bm25():
+            index = app.BM25Index()
+            for page_num, text in app.iter_pages(filename):
+                index.add_page(page_num, text)
+            index.save(app.artifact_path(filename, 'bm25'))
+            return index
+
+        best, index = best_of(args.repeat, build_bm25)
+        print(f"{'BM25 index build':32} {len(index.passages):6d} chunks {best:8.2f}s")
+        best, _ = best_of(args.repeat, lambda: app.build_vector_index(filename, index))
+        print(f"{'dense index build':32} {len(index.passages):6d} chunks {best:8.2f}s")
+    finally:
+        if app._extract_pool is not None:
+            app._extract_pool.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Passage retrieval latency for one large document
+
+Writes a synthetic 1000-page document (Zipf-distributed vocabulary, about five
+chunks per page) into a scratch page store, builds its BM25 and dense indexes
+the way the index job does, and times app.retrieve_passages, the BM25 pass
+alone and the dense pass alone for common, mid-frequency and rare queries.
+
+    python benchmarks/retrieval_latency.py --pages 1000 --repeat 200
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from array import array
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_document(app, filename, pages, vocabulary, weights, words_per_page, rng):
+    # Page store as extraction writes it, in sentences of twelve words
+    offsets = array('Q')
+    end = 0
+    with open(app.artifact_path(filename, 'pages'), 'wb') as f:
+        for _ in range(pages):
+            words = rng.choices(vocabulary, weights, k=words_per_page)
+            text = ' '.join(' '.join(words[i:i + 12]) + '.' for i in range(0, len(words), 12))
+            data = text.encode('utf-8')
+            f.write(data)
+            end += len(data)
+            offsets.append(end)
+    with open(app.artifact_path(filename, 'pidx'), 'wb') as f:
+        offsets.tofile(f)
+
+
+def describe(timings):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    return f"p50 {statistics.median(timings):6.2f}ms  p95 {p95:6.2f}ms"
+
+
+def measure(run, repeat):
+    run()  # Warm the caches outside the timing
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--words-per-page', type=int, default=600)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=200, help='runs per query')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='retrieval-bench-')
+    os.chdir(workdir)
+    os.environ['JOB_WORKERS'] = '0'
+    sys.path.insert(0, ROOT)
+    import app
+    app.start_app()
+
+    rng = random.Random(0)
+    # Prefixed so no word is a stopword and common words stay common after tokenizing
+    vocabulary = [f"term{rank}" for rank in range(1, args.vocabulary + 1)]
+    weights = [1 / rank for rank in range(1, args.vocabulary + 1)]
+    filename = f"{'e' * 64}_retrieval.pdf"
+    try:
+        write_document(app, filename, args.pages, vocabulary, weights, args.words_per_page, rng)
+        with open(app.artifact_path(filename, 'extracted'), 'w') as f:
+            f.write(str(args.pages))
+        started = time.perf_counter()
+        app.build_indexes(filename)
+        index = app.get_bm25_index(filename)
+        print(f"indexed {args.pages} pages, {len(index.passages)} passages "
+              f"in {time.perf_counter() - started:.1f}s")
+
+        queries = [
+            ('common words', 'term1 term2 term3'),
+            ('common question', 'what does term1 say about term4 and term7?'),
+            ('mid-frequency', 'term300 term450'),
+            ('rare word', f"term{args.vocabulary - 1}"),
+            ('mixed', f"term2 term{args.vocabulary // 2}"),
+        ]
+        for label, query in queries:
+            passages = app.retrieve_passages(filename, query)
+            print(f"{label:16} {len(passages)} passages  "
+                  f"retrieve {describe(measure(lambda: app.retrieve_passages(filename, query), args.repeat))}  "
+                  f"bm25 {describe(measure(lambda: index.search(query, app.RETRIEVAL_CANDIDATES), args.repeat))}  "
+                  f"dense {describe(measure(lambda: app.vector_search(filename, query, app.RETRIEVAL_CANDIDATES, index), args.repeat))}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
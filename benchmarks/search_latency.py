@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Full-text search latency on a synthetic library
+
+Builds a scratch library of documents with a Zipf-distributed vocabulary
+(100k pages by default), indexes it with app.index_search and times
+app.search_documents for common, mid-frequency, rare and phrase queries: the
+first (cold) run of each query, then p50 and p95 over --repeat further runs.
+
+    python benchmarks/search_latency.py --pages 100000 --pages-per-doc 200
+
+Needs an SQLite build with FTS5.
+"""
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from array import array
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_document(app, filename, pages, vocabulary, weights, words_per_page, rng):
+    # Page store as extraction writes it: page text back to back plus uint64 end offsets
+    offsets = array('Q')
+    end = 0
+    with open(app.artifact_path(filename, 'pages'), 'wb') as f:
+        for _ in range(pages):
+            data = ' '.join(rng.choices(vocabulary, weights, k=words_per_page)).encode('utf-8')
+            f.write(data)
+            end += len(data)
+            offsets.append(end)
+    with open(app.artifact_path(filename, 'pidx'), 'wb') as f:
+        offsets.tofile(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=100000)
+    parser.add_argument('--pages-per-doc', type=int, default=200)
+    parser.add_argument('--words-per-page', type=int, default=300)
+    parser.add_argument('--vocabulary', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=100, help='runs per query')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='search-bench-')
+    os.chdir(workdir)
+    os.environ['JOB_WORKERS'] = '0'
+    sys.path.insert(0, ROOT)
+    import app
+    app.start_app()
+
+    if not app.search_available:
+        sys.exit('this SQLite build has no FTS5')
+    rng = random.Random(0)
+    vocabulary = [f"w{rank}" for rank in range(1, args.vocabulary + 1)]
+    weights = [1 / rank for rank in range(1, args.vocabulary + 1)]
+    try:
+        started = time.perf_counter()
+        documents = (args.pages + args.pages_per_doc - 1) // args.pages_per_doc
+        for number in range(documents):
+            pages = min(args.pages_per_doc, args.pages - number * args.pages_per_doc)
+            digest = hashlib.sha256(str(number).encode()).hexdigest()
+            filename = f"{digest}_document-{number}.pdf"
+            write_document(app, filename, pages, vocabulary, weights, args.words_per_page, rng)
+            app.record_upload(filename, 0, uploaded_at=number, pages=pages)
+            app.index_search(filename)
+        print(f"indexed {args.pages} pages in {documents} documents in {time.perf_counter() - started:.1f}s")
+
+        queries = [
+            ('common word', 'w1'),
+            ('two common words', 'w2 w3'),
+            ('mid-frequency word', 'w500'),
+            ('rare word', f"w{args.vocabulary}"),
+            ('phrase', '"w1 w2"'),
+        ]
+        for label, query in queries:
+            # The first run reads the term's pages from disk; it is reported on its own
+            started = time.perf_counter()
+            app.search_documents(query)
+            first = (time.perf_counter() - started) * 1000
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                results = app.search_documents(query)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            print(f"{label:20} {query!r:14} {len(results):3d} docs  "
+                  f"first {first:8.1f}ms  p50 {statistics.median(timings):8.1f}ms  p95 {p95:8.1f}ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    # app.py keeps all of its state under ./uploads, so import it from an empty directory
+    os.chdir(tmp_path_factory.mktemp('chatpdf'))
+    os.environ.pop('OPENAI_API_KEY', None)
+    # Jobs stay queued: tests run the work they need directly
+    os.environ['JOB_WORKERS'] = '0'
+    module = importlib.import_module('app')
+    module.start_app()
+    return module
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def fake_openai(app_module, monkeypatch):
+    # Point the shared OpenAI clients at a local stub instead of api.openai.com
+    from openai_stub import STUB_DELTAS, start_stub_thread
+
+    monkeypatch.setenv('OPENAI_API_KEY', 'stub')
+    monkeypatch.setattr(app_module, 'OPENAI_BASE_URL', start_stub_thread())
+    monkeypatch.setattr(app_module, '_openai_client', None)
+    monkeypatch.setattr(app_module, '_async_openai_client', None)
+    return STUB_DELTAS
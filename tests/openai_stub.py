@@ -0,0 +1,74 @@
+"""
+Local OpenAI-compatible /v1/chat/completions stub
+
+Answers every completion with STUB_DELTAS after a fixed delay, as a single JSON
+body or, for stream=True requests, as one SSE chunk per delta. Used by the chat
+tests (see the fake_openai fixture) and by benchmarks/chat_load.py.
+"""
+import asyncio
+import json
+import socket
+import threading
+
+STUB_DELTAS = ('Stub', ' answer', '.')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def completion_body(request, deltas):
+    # One request per connection; the body is written whole, so the stub needs no chunked encoding
+    text = ''.join(deltas)
+    if request.get('stream'):
+        events = []
+        for delta in deltas:
+            chunk = {'id': 'stub', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'stub',
+                     'choices': [{'index': 0, 'delta': {'content': delta}, 'finish_reason': None}]}
+            events.append(f"data: {json.dumps(chunk)}\n\n")
+        done = {'id': 'stub', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'stub',
+                'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+        events.append(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n")
+        return ''.join(events).encode(), b'text/event-stream'
+    body = json.dumps({'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': 'stub',
+                       'choices': [{'index': 0, 'finish_reason': 'stop',
+                                    'message': {'role': 'assistant', 'content': text}}],
+                       'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}})
+    return body.encode(), b'application/json'
+
+
+def serve_stub(port, delay=0.0, deltas=STUB_DELTAS, started=None):
+    async def handle(reader, writer):
+        head = await reader.readuntil(b'\r\n\r\n')
+        length = 0
+        for line in head.split(b'\r\n'):
+            if line.lower().startswith(b'content-length:'):
+                length = int(line.split(b':', 1)[1])
+        request = json.loads(await reader.readexactly(length) or b'{}')
+        await asyncio.sleep(delay)
+        body, content_type = completion_body(request, deltas)
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: ' + content_type +
+                     b'\r\nContent-Length: ' + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+        await writer.drain()
+        writer.close()
+
+    async def serve():
+        server = await asyncio.start_server(handle, '127.0.0.1', port, backlog=4096)
+        if started is not None:
+            started.set()
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+def start_stub_thread(delay=0.0, deltas=STUB_DELTAS):
+    # In-process stub for tests: returns its base URL once it accepts connections
+    port = free_port()
+    started = threading.Event()
+    threading.Thread(target=serve_stub, args=(port, delay, deltas, started), daemon=True).start()
+    if not started.wait(10):
+        raise RuntimeError('OpenAI stub did not start')
+    return f'http://127.0.0.1:{port}/v1'
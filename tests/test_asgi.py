@@ -0,0 +1,41 @@
+import asyncio
+import json
+
+import pytest
+
+
+def call_asgi(asgi_app, body, chunk_size=None, headers=()):
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] if chunk_size else [body]
+    events = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+              for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return events.pop(0)
+
+    async def send(event):
+        sent.append(event)
+
+    scope = {'type': 'http', 'path': '/chat', 'method': 'POST', 'headers': list(headers)}
+    asyncio.run(asgi_app(scope, receive, send))
+    return sent[0]['status'], json.loads(b''.join(event.get('body', b'') for event in sent[1:]))
+
+
+@pytest.fixture
+def asgi_app(app_module):
+    pytest.importorskip('a2wsgi')
+    return app_module.create_asgi_app()
+
+
+def test_chat_body_in_chunks(asgi_app):
+    body = json.dumps({'message': 'hello', 'history': [], 'context': {}}).encode()
+    status, payload = call_asgi(asgi_app, body, chunk_size=7)
+    assert status == 200
+    assert 'response' in payload
+
+
+def test_oversized_body_is_rejected(app_module, asgi_app, monkeypatch):
+    monkeypatch.setattr(app_module, 'MAX_CONTENT_LENGTH', 1024)
+    body = json.dumps({'message': 'x' * 4096, 'history': [], 'context': {}}).encode()
+    assert call_asgi(asgi_app, body, chunk_size=512)[0] == 413
+    assert call_asgi(asgi_app, body, headers=[(b'content-length', str(len(body)).encode())])[0] == 413
@@ -0,0 +1,18 @@
+def test_cache_key_follows_the_prompt(app_module):
+    context = {'filename': f'{"a" * 64}_doc.pdf', 'currentPage': 1}
+    question = {'role': 'user', 'content': 'What is it about?'}
+
+    def key(system):
+        return app_module.chat_cache_key([{'role': 'system', 'content': system}, question], context)
+
+    assert key('page text: Not available') == key('page text: Not available')
+    # More of the document extracted -> different page text and passages -> a new answer
+    assert key('page text: Not available') != key('page text: Chapter 1')
+
+
+def test_cache_key_follows_extraction(app_module, monkeypatch):
+    context = {'filename': f'{"b" * 64}_doc.pdf', 'currentPage': 1}
+    messages = [{'role': 'system', 'content': 'prompt'}, {'role': 'user', 'content': 'question'}]
+    partial = app_module.chat_cache_key(messages, context)
+    monkeypatch.setattr(app_module, 'extraction_complete', lambda filename: True)
+    assert app_module.chat_cache_key(messages, context) != partial
@@ -0,0 +1,39 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+
+def read_events(response):
+    assert response.mimetype == 'text/event-stream'
+    return [json.loads(line[len('data: '):]) for line in response.get_data(as_text=True).split('\n\n') if line]
+
+
+def test_streamed_answer_is_relayed_cached_and_recorded(app_module, client, fake_openai):
+    question = 'What does the streaming test document say?'
+    events = read_events(client.post('/chat', json={'message': question, 'stream': True}))
+
+    # Deltas arrive in the order the model sent them, then one final event
+    assert [event['delta'] for event in events[:-1]] == list(fake_openai)
+    final = events[-1]
+    assert final['done'] and 'cached' not in final
+    assert final['sources'] == []
+    assert final['ttft'] >= 0
+
+    answer = ''.join(fake_openai)
+    assert app_module.chat_sessions.history(final['session_id']) == [
+        {'role': 'user', 'content': question},
+        {'role': 'assistant', 'content': answer},
+    ]
+
+    # The same prompt again is answered from the cache without the model
+    events = read_events(client.post('/chat', json={'message': question, 'history': [], 'stream': True}))
+    assert [event.get('delta') for event in events[:-1]] == [answer]
+    assert events[-1]['cached']
+
+
+def test_requests_share_one_pooled_client(app_module, client, fake_openai):
+    # Built once even when the first requests race for it
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        clients = list(pool.map(lambda _: app_module.get_openai_client(), range(8)))
+    assert all(shared is clients[0] for shared in clients)
+    assert client.post('/chat', json={'message': 'Is the client pooled?', 'history': []}).status_code == 200
+    assert app_module.get_openai_client() is clients[0]
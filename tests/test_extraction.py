@@ -0,0 +1,139 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+PDF_BYTES = b'%PDF-1.4\nextraction test\n%%EOF\n'
+
+
+@pytest.fixture
+def extraction(app_module, tmp_path, monkeypatch):
+    # Run extraction in threads with a scripted pdftotext instead of the process pool
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(app_module, 'get_extract_pool', lambda: pool)
+    monkeypatch.setattr(app_module, 'pdf_page_total', lambda path: None)
+    monkeypatch.setattr(app_module, 'SUMMARIZE_DOCUMENTS', False)
+
+    def use_pdftotext(output, exit_code=0):
+        script = tmp_path / 'pdftotext'
+        script.write_text(f"#!/bin/sh\nprintf '{output}'\nexit {exit_code}\n")
+        script.chmod(0o755)
+        monkeypatch.setattr(app_module, 'PDFTOTEXT', str(script))
+
+    yield use_pdftotext
+    pool.shutdown()
+
+
+@pytest.fixture
+def pdf_name(app_module):
+    name = f'{hashlib.sha256(PDF_BYTES).hexdigest()}_extract.pdf'
+    with open(os.path.join(app_module.UPLOAD_FOLDER, name), 'wb') as f:
+        f.write(PDF_BYTES)
+    return name
+
+
+def test_complete_extraction_is_recorded(app_module, extraction, pdf_name):
+    extraction('first page\\fsecond page\\f')
+    assert app_module.extract_pages(pdf_name) == 2
+    assert app_module.extraction_complete(pdf_name)
+    assert app_module.read_page(pdf_name, 2) == 'second page'
+
+
+def test_failed_extraction_is_not_recorded(app_module, extraction, pdf_name):
+    extraction('first page\\f', exit_code=1)
+    with pytest.raises(RuntimeError):
+        app_module.extract_pages(pdf_name)
+    # The partial text stays readable, but the document is extracted again
+    assert not app_module.extraction_complete(pdf_name)
+    assert app_module.read_page(pdf_name, 1) == 'first page'
+
+    extraction('first page\\fsecond page\\f')
+    assert app_module.extract_pages(pdf_name) == 2
+    assert app_module.extraction_complete(pdf_name)
+
+
+def clear_index_jobs(app_module):
+    app_module.get_db(app_module.METADATA_DB).execute("DELETE FROM jobs WHERE type = 'index'")
+
+
+def index_jobs(app_module, filename):
+    return [job for job in app_module.jobs.for_document(filename) if job['type'] == 'index']
+
+
+def test_stale_dense_index_is_rebuilt_by_the_index_job(app_module, extraction, pdf_name):
+    extraction('apples and pears\\fbananas\\fcherries\\f')
+    app_module.extract_pages(pdf_name)
+    clear_index_jobs(app_module)
+    path = app_module.artifact_path(pdf_name, f'{app_module.EMBEDDING_BACKEND}.npy')
+    rows = len(app_module.np.load(path))
+
+    # A matrix from another run has a different row count and is never indexed into
+    stale = app_module.np.zeros((rows + 5, app_module.EMBEDDING_DIM), dtype='float32')
+    app_module.np.save(path, stale)
+    passages = app_module.retrieve_passages(pdf_name, 'bananas')
+    assert passages and passages[0]['page'] == 2
+    # The request answered lexically and left the rebuild to a job
+    assert len(app_module.np.load(path)) == rows + 5
+    assert len(index_jobs(app_module, pdf_name)) == 1
+
+    job_id = index_jobs(app_module, pdf_name)[0]['id']
+    app_module.build_indexes(pdf_name)
+    app_module.get_db(app_module.METADATA_DB).execute("UPDATE jobs SET state = 'done' WHERE id = ?", (job_id,))
+    assert len(app_module.np.load(path)) == rows
+    assert app_module.vector_search(pdf_name, 'bananas')
+
+    # Stale again after the job finished: a new job is queued, not the finished one reused
+    app_module.np.save(path, stale)
+    assert app_module.vector_search(pdf_name, 'bananas') == []
+    assert index_jobs(app_module, pdf_name)[0]['id'] != job_id
+
+
+def test_missing_bm25_index_is_built_by_the_index_job(app_module, extraction, pdf_name):
+    extraction('apples and pears\\fbananas\\f')
+    app_module.extract_pages(pdf_name)
+    clear_index_jobs(app_module)
+    os.remove(app_module.artifact_path(pdf_name, 'bm25'))
+
+    assert app_module.retrieve_passages(pdf_name, 'bananas') == []
+    assert not os.path.exists(app_module.artifact_path(pdf_name, 'bm25'))
+    assert len(index_jobs(app_module, pdf_name)) == 1
+
+    assert app_module.build_indexes(pdf_name) == 2
+    assert app_module.retrieve_passages(pdf_name, 'bananas')[0]['page'] == 2
+
+
+def test_no_dense_index_from_a_partial_extraction(app_module, extraction, pdf_name):
+    extraction('apples and pears\\fbananas\\f')
+    app_module.extract_pages(pdf_name)
+    path = app_module.artifact_path(pdf_name, f'{app_module.EMBEDDING_BACKEND}.npy')
+    os.remove(path)
+    os.remove(app_module.artifact_path(pdf_name, 'extracted'))
+
+    assert app_module.vector_search(pdf_name, 'bananas') == []
+    assert not os.path.exists(path)
+    assert app_module.retrieve_passages(pdf_name, 'bananas')[0]['page'] == 2
+
+
+def test_passage_texts_streams_the_page_store(app_module, extraction, pdf_name):
+    extraction('apples and pears\\fbananas\\f\\fcherries\\f')
+    app_module.extract_pages(pdf_name)
+    passages = [(1, 0, 6), (1, 11, 16), (2, 0, 7), (4, 0, 8), (2, 2, 4), (9, 0, 3)]
+    assert list(app_module.passage_texts(pdf_name, passages)) == ['apples', 'pears', 'bananas', 'cherries', 'na', '']
+
+
+def test_workers_chunk_with_the_server_tokenizer(app_module, extraction, pdf_name, monkeypatch):
+    extraction('first page\\f')
+    monkeypatch.setattr(app_module, '_tokenizer', app_module.TOKENIZERS['approx'])
+    monkeypatch.setattr(app_module, '_tokenizer_name', 'approx')
+    extract_page_range = app_module.extract_page_range
+
+    def fresh_worker(*args):
+        # A spawned worker starts with nothing loaded; left to itself it would pick tiktoken
+        monkeypatch.setattr(app_module, '_tokenizer', None)
+        monkeypatch.setattr(app_module, 'TOKENIZER', 'tiktoken')
+        return extract_page_range(*args)
+
+    monkeypatch.setattr(app_module, 'extract_page_range', fresh_worker)
+    assert app_module.extract_pages(pdf_name) == 1
+    assert app_module.tokenizer_name() == 'approx'
@@ -0,0 +1,53 @@
+import time
+
+
+def make_queues(app_module, tmp_path, job_types, count=2):
+    # Queues sharing one database stand in for gunicorn workers; none of them start threads
+    path = str(tmp_path / 'jobs.db')
+    return [app_module.JobQueue(path, job_types, workers=0) for _ in range(count)]
+
+
+def test_type_limit_holds_across_processes(app_module, tmp_path):
+    first, second = make_queues(app_module, tmp_path, {'work': (str, 1), 'other': (str, 1)})
+    for name in ('a', 'b'):
+        first.enqueue('work', f'{name * 64}_{name}.pdf')
+    first.enqueue('other', f'{"c" * 64}_c.pdf')
+
+    assert first._claim()[1] == 'work'
+    # The second process may only start the other type while the first runs its job
+    assert second._claim()[1] == 'other'
+    assert second._claim() is None
+
+    job_id = first.for_document(f'{"a" * 64}_a.pdf')[0]['id']
+    first._update(job_id, 'done')
+    assert second._claim()[1] == 'work'
+
+
+def test_stale_jobs_are_reclaimed_by_heartbeat(app_module, tmp_path, monkeypatch):
+    crashed, alive, survivor = make_queues(app_module, tmp_path, {'work': (str, 5)}, count=3)
+    crashed_id = crashed.enqueue('work', f'{"a" * 64}_a.pdf')
+    alive_id = alive.enqueue('work', f'{"b" * 64}_b.pdf')
+    crashed._claim()
+    alive._claim()
+
+    # Well past the stale limit only the queue that kept beating still owns its job
+    monkeypatch.setattr(app_module.time, 'time', lambda now=time.time(): now + app_module.JOB_STALE_AFTER + 1)
+    alive.beat()
+    assert survivor.reclaim_stale() == 1
+    assert survivor.get(crashed_id)['state'] == 'queued'
+    assert survivor.get(alive_id)['state'] == 'running'
+
+    # The crashed worker finishing late does not overwrite a job claimed again elsewhere
+    assert survivor._claim()[0] == crashed_id
+    crashed._update(crashed_id, 'done')
+    assert survivor.get(crashed_id)['state'] == 'running'
+
+
+def test_job_that_keeps_dying_fails(app_module, tmp_path, monkeypatch):
+    crashed, survivor = make_queues(app_module, tmp_path, {'work': (str, 1)})
+    job_id = crashed.enqueue('work', f'{"a" * 64}_a.pdf')
+    crashed._claim()
+    survivor.max_attempts = 1
+    monkeypatch.setattr(app_module.time, 'time', lambda now=time.time(): now + app_module.JOB_STALE_AFTER + 1)
+    survivor.reclaim_stale()
+    assert survivor.get(job_id)['state'] == 'failed'
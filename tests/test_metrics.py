@@ -0,0 +1,35 @@
+def test_histogram_buckets_are_cumulative_and_labels_escaped(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'METRICS', [])
+    histogram = app_module.Histogram('test_seconds', 'Test latency.', ('route',), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 5):
+        histogram.observe(value, route='say "hi"\n')
+
+    labels = 'route="say \\"hi\\"\\n"'
+    assert histogram.render() == [
+        '# HELP test_seconds Test latency.',
+        '# TYPE test_seconds histogram',
+        f'test_seconds_bucket{{{labels},le="0.1"}} 2',
+        f'test_seconds_bucket{{{labels},le="1"}} 2',
+        f'test_seconds_bucket{{{labels},le="+Inf"}} 3',
+        f'test_seconds_sum{{{labels}}} 5.15',
+        f'test_seconds_count{{{labels}}} 3',
+    ]
+
+
+def test_requests_are_labelled_by_route_template(client):
+    client.get('/pdf/not-uploaded.pdf')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    # One series per route, not per file name
+    assert 'route="/pdf/<filename>",method="GET",status="404",le="+Inf"} ' in text
+    assert 'not-uploaded' not in text
+    assert '# TYPE chatpdf_cache_hit_ratio gauge' in text
+
+
+def test_chat_stages_are_timed(client, fake_openai):
+    client.post('/chat', json={'message': 'Which stages are timed?', 'history': []})
+    text = client.get('/metrics').get_data(as_text=True)
+    for stage in ('prompt_build', 'completion'):
+        assert f'chatpdf_chat_stage_duration_seconds_count{{stage="{stage}"}} ' in text
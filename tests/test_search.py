@@ -0,0 +1,103 @@
+import hashlib
+from array import array
+
+import pytest
+
+
+@pytest.fixture
+def library(app_module):
+    if not app_module.search_available:
+        pytest.skip('this SQLite build has no FTS5')
+
+    def add(name, pages, uploaded_at):
+        # Page store as extraction writes it, then indexed like a finished extraction
+        filename = f'{hashlib.sha256(name.encode()).hexdigest()}_{name}.pdf'
+        offsets = array('Q')
+        data = b''
+        for text in pages:
+            data += text.encode('utf-8')
+            offsets.append(len(data))
+        with open(app_module.artifact_path(filename, 'pages'), 'wb') as f:
+            f.write(data)
+        with open(app_module.artifact_path(filename, 'pidx'), 'wb') as f:
+            offsets.tofile(f)
+        app_module.record_upload(filename, len(data), uploaded_at=uploaded_at, pages=len(pages))
+        app_module.index_search(filename)
+        return filename
+
+    return add
+
+
+def test_best_match_wins_over_many_newer_matches(app_module, library):
+    filler = ' '.join(['filler'] * 200)
+    best = library('best', ['nothing here', 'okapi okapi okapi'], uploaded_at=1)
+    for number in range(30):
+        library(f'weak-{number}', [f'okapi {filler}'] * 10 + ['unrelated'] * 40, uploaded_at=2 + number)
+
+    results = app_module.search_documents('okapi', k=3)
+    assert [result['filename'] for result in results][0] == best
+    assert [hit['page'] for hit in results[0]['hits']] == [2]
+    assert '<mark>okapi</mark>' in results[0]['hits'][0]['snippet']
+    # Hits come only from the document itself, best pages first and capped per document
+    assert all(len(result['hits']) == app_module.SEARCH_PAGES_PER_DOC for result in results[1:])
+    assert results[0]['score'] > results[1]['score']
+
+
+def test_no_match(app_module, library):
+    library('lonely', ['aardvark'], uploaded_at=1)
+    assert app_module.search_documents('wombat') == []
+    assert app_module.search_documents('   ') == []
+
+
+def test_phrase_across_a_page_break_is_not_a_hit(app_module, library):
+    library('split', ['alpha beta gamma delta', 'epsilon'], uploaded_at=1)
+    assert app_module.search_documents('"delta epsilon"') == []
+
+
+def test_phrase_words_apart_on_a_page_are_not_a_hit(app_module, library):
+    # Ranked first on its words alone, so the next document must be checked too
+    library('apart', ['epsilon delta'], uploaded_at=1)
+    whole = library('whole', ['delta epsilon ' + ' '.join(['padding'] * 50)], uploaded_at=2)
+    results = app_module.search_documents('"delta epsilon"', k=1)
+    assert [result['filename'] for result in results] == [whole]
+    assert results[0]['hits'][0]['snippet'].startswith('<mark>delta epsilon</mark>')
+
+
+def test_reindexing_replaces_the_document_rows(app_module, library):
+    name = library('again', ['zebra crossing', 'zebra zebra'], uploaded_at=1)
+    app_module.index_search(name)
+    app_module.unindex_search(name)
+    app_module.index_search(name)
+    results = app_module.search_documents('zebra')
+    assert [result['filename'] for result in results] == [name]
+    assert [hit['page'] for hit in results[0]['hits']] == [2, 1]
+    conn = app_module.get_db(app_module.METADATA_DB)
+    first = conn.execute('SELECT first_rowid FROM search_docs WHERE doc_key = ?',
+                         (app_module.doc_key(name),)).fetchone()[0]
+    assert conn.execute('SELECT count(*) FROM search_terms WHERE first_rowid = ?', (first,)).fetchone()[0] == 2
+
+
+def test_terms_are_folded_like_the_fts_tokenizer(app_module, library):
+    name = library('accents', ['Café_au_lait CRÈME brûlée'], uploaded_at=1)
+    assert app_module.search_tokens('Café_au_lait CRÈME brûlée') == ['cafe', 'au', 'lait', 'creme', 'brulee']
+    assert [result['filename'] for result in app_module.search_documents('creme BRULEE')] == [name]
+
+
+def test_documents_that_cannot_make_the_top_k_are_not_visited(app_module, library, monkeypatch):
+    for number in range(20):
+        library(f'ibis-{number}', ['ibis ' * (number + 1) + 'padding ' * (20 - number)], uploaded_at=1)
+    visited = []
+    search_hit = app_module.search_hit
+    monkeypatch.setattr(app_module, 'search_hit', lambda *args: visited.append(args[2]) or search_hit(*args))
+    results = app_module.search_documents('ibis', k=3)
+    assert [result['display_name'] for result in results] == ['ibis-19.pdf', 'ibis-18.pdf', 'ibis-17.pdf']
+    assert len(visited) == 3
+
+
+def test_documents_without_page_statistics_are_reindexed(app_module, library):
+    name = library('legacy', ['indexed before page statistics'], uploaded_at=1)
+    conn = app_module.get_db(app_module.METADATA_DB)
+    conn.execute('UPDATE search_docs SET tokens = NULL, page_tokens = NULL WHERE doc_key = ?',
+                 (app_module.doc_key(name),))
+    app_module.backfill_search_index()
+    assert 'search_index' in [job['type'] for job in app_module.jobs.for_document(name) if job['state'] == 'queued']
@@ -0,0 +1,156 @@
+import hashlib
+import os
+
+import pytest
+
+PDF_BYTES = b'%PDF-1.4\n' + b'0123456789' * 100 + b'\n%%EOF\n'
+
+
+@pytest.fixture
+def pdf_name(app_module):
+    digest = hashlib.sha256(PDF_BYTES).hexdigest()
+    name = f'{digest}_sample.pdf'
+    with open(os.path.join(app_module.UPLOAD_FOLDER, name), 'wb') as f:
+        f.write(PDF_BYTES)
+    return name
+
+
+def test_full_response_is_immutable(client, pdf_name):
+    response = client.get(f'/pdf/{pdf_name}')
+    assert response.status_code == 200
+    assert response.data == PDF_BYTES
+    assert response.mimetype == 'application/pdf'
+    assert 'immutable' in response.headers['Cache-Control']
+
+
+def test_range_request_returns_partial_content(client, pdf_name):
+    response = client.get(f'/pdf/{pdf_name}', headers={'Range': 'bytes=0-99'})
+    assert response.status_code == 206
+    assert response.data == PDF_BYTES[:100]
+    assert response.headers['Content-Range'] == f'bytes 0-99/{len(PDF_BYTES)}'
+
+
+def test_if_none_match_returns_not_modified(client, pdf_name):
+    etag = client.get(f'/pdf/{pdf_name}').headers['ETag']
+    response = client.get(f'/pdf/{pdf_name}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_unsatisfiable_range(client, pdf_name):
+    size = len(PDF_BYTES)
+    response = client.get(f'/pdf/{pdf_name}', headers={'Range': f'bytes={size + 10}-{size + 20}'})
+    assert response.status_code == 416
+
+
+@pytest.mark.parametrize('name', ['metadata.db', '{key}.pages', '{key}.bm25', '{key}.summaries.json'])
+def test_artifacts_are_not_served(app_module, client, pdf_name, name):
+    name = name.format(key=app_module.doc_key(pdf_name))
+    with open(os.path.join(app_module.UPLOAD_FOLDER, name), 'ab'):
+        pass
+    assert client.get(f'/pdf/{name}').status_code == 404
+
+
+@pytest.mark.parametrize('path', [
+    '/pdf/..%2Fapp.pdf',
+    '/pdf/%2E%2E%2F%2E%2E%2Fetc%2Fpasswd.pdf',
+    '/pdf/objects%2F{key}.pdf',
+    '/pdf/missing.pdf',
+])
+def test_paths_outside_uploads_are_not_served(app_module, client, pdf_name, path):
+    assert client.get(path.format(key=app_module.doc_key(pdf_name))).status_code == 404
+
+
+def test_upload_pdf_path_rejects_traversal(app_module, pdf_name):
+    assert app_module.upload_pdf_path(pdf_name)
+    assert app_module.upload_pdf_path(f'../{pdf_name}') is None
+    assert app_module.upload_pdf_path(f'objects/{pdf_name}') is None
+
+
+def test_linearized_copy_has_its_own_url(app_module, client, pdf_name):
+    plain = client.get(f'/pdf/{pdf_name}')
+    assert client.get(f'/pdf/{pdf_name}?v=web').status_code == 404
+    assert f'"/pdf/{pdf_name}"' in client.get(f'/view/{pdf_name}').get_data(as_text=True)
+
+    web_bytes = PDF_BYTES.replace(b'1.4', b'1.7')
+    web_path = app_module.artifact_path(pdf_name, 'web')
+    with open(web_path, 'wb') as f:
+        f.write(web_bytes)
+    try:
+        # The plain URL keeps serving the original bytes once the copy exists
+        assert client.get(f'/pdf/{pdf_name}').data == PDF_BYTES
+        web = client.get(f'/pdf/{pdf_name}?v=web')
+        assert web.data == web_bytes
+        assert web.headers['ETag'] != plain.headers['ETag']
+        assert f'"/pdf/{pdf_name}?v=web"' in client.get(f'/view/{pdf_name}').get_data(as_text=True)
+    finally:
+        os.remove(web_path)
+
+
+@pytest.mark.parametrize('route', ['thumb', 'text'])
+@pytest.mark.parametrize('name', ['metadata.db', '.upload-0123.tmp', '{key}.pages'])
+def test_page_routes_only_accept_uploaded_pdfs(app_module, client, pdf_name, route, name):
+    path = os.path.join(app_module.UPLOAD_FOLDER, name.format(key=app_module.doc_key(pdf_name)))
+    existed = os.path.exists(path)
+    with open(path, 'ab'):
+        pass
+    try:
+        assert client.get(f'/{route}/{os.path.basename(path)}/1').status_code == 404
+    finally:
+        if not existed:
+            os.remove(path)
+
+
+@pytest.fixture
+def qpdf(app_module, tmp_path, monkeypatch):
+    # Scripted qpdf: writes a linearized-looking copy to its last argument, or fails
+    def use_qpdf(exit_code=0):
+        script = tmp_path / 'qpdf'
+        script.write_text('#!/bin/sh\nfor out; do :; done\n'
+                          f"printf '%%PDF-1.7 << /Linearized 1 >>\\n' > \"$out\"\nexit {exit_code}\n")
+        script.chmod(0o755)
+        monkeypatch.setattr(app_module, 'QPDF', str(script))
+    return use_qpdf
+
+
+def test_linearized_copy_is_written_once(app_module, qpdf, pdf_name):
+    qpdf()
+    web_path = app_module.artifact_path(pdf_name, 'web')
+    try:
+        assert app_module.web_pdf_path(pdf_name) is None
+        assert app_module.linearize_pdf(pdf_name)
+        assert app_module.web_pdf_path(pdf_name) == web_path
+        assert app_module.is_linearized(web_path)
+        assert not app_module.linearize_pdf(pdf_name)
+    finally:
+        os.remove(web_path)
+
+
+def test_failed_linearization_leaves_no_copy(app_module, qpdf, pdf_name):
+    qpdf(exit_code=2)
+    assert not app_module.linearize_pdf(pdf_name)
+    web_path = app_module.artifact_path(pdf_name, 'web')
+    assert not os.path.exists(web_path) and not os.path.exists(f'{web_path}.tmp')
+
+
+def test_linearized_upload_is_not_copied(app_module, qpdf):
+    qpdf()
+    data = b'%PDF-1.7\n1 0 obj << /Linearized 1 /L 100 >> endobj\n%%EOF\n'
+    name = f'{hashlib.sha256(data).hexdigest()}_fast.pdf'
+    with open(os.path.join(app_module.UPLOAD_FOLDER, name), 'wb') as f:
+        f.write(data)
+    assert not app_module.linearize_pdf(name)
+    assert app_module.web_pdf_path(name) is None
+
+
+def test_failed_thumbnail_leaves_no_lock_or_output(app_module, client, pdf_name, tmp_path, monkeypatch):
+    # Scripted pdftoppm: writes part of the PNG to <prefix>.png, then fails like a page past the end
+    script = tmp_path / 'pdftoppm'
+    script.write_text('#!/bin/sh\nfor prefix; do :; done\nprintf partial > "$prefix.png"\nexit 99\n')
+    script.chmod(0o755)
+    monkeypatch.setattr(app_module, 'PDFTOPPM', str(script))
+    before = set(os.listdir(app_module.THUMB_FOLDER))
+    for page in (7, 8, 9):
+        assert client.get(f'/thumb/{pdf_name}/{page}').status_code == 404
+    assert app_module._thumb_locks == {}
+    assert set(os.listdir(app_module.THUMB_FOLDER)) == before
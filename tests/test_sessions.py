@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(app_module, tmp_path, request):
+    if request.param == 'memory':
+        return app_module.MemorySessionStore(max_turns=4, max_sessions=2, ttl=60)
+    return app_module.SQLiteSessionStore(str(tmp_path / 'sessions.db'), max_turns=4, ttl=60)
+
+
+def turn(role, number):
+    return {'role': role, 'content': f'{role} {number}'}
+
+
+def test_history_round_trips_newest_turns_only(store):
+    assert store.history('a') == []
+    for number in range(3):
+        store.append('a', turn('user', number), turn('assistant', number))
+    assert store.history('a') == [turn('user', 1), turn('assistant', 1), turn('user', 2), turn('assistant', 2)]
+    assert store.history('b') == []
+
+    store.clear('a')
+    assert store.history('a') == []
+
+
+def test_idle_sessions_expire(app_module, store, monkeypatch):
+    store.append('a', turn('user', 0), turn('assistant', 0))
+    monkeypatch.setattr(app_module.time, 'time', lambda now=time.time(): now + 61)
+    assert store.history('a') == []
+    # A new turn starts the session over
+    store.append('a', turn('user', 1))
+    assert store.history('a') == [turn('user', 1)]
+
+
+def test_memory_store_drops_least_recently_used_sessions(app_module):
+    store = app_module.MemorySessionStore(max_turns=4, max_sessions=2, ttl=60)
+    for session_id in ('a', 'b', 'c'):
+        store.append(session_id, turn('user', session_id))
+    assert store.history('a') == []
+    assert store.history('c') == [turn('user', 'c')]
+
+
+def test_chat_continues_a_session_from_its_id(app_module, client, fake_openai):
+    first = client.post('/chat', json={'message': 'First question?'}).get_json()
+    session_id = first['session_id']
+    client.post('/chat', json={'message': 'Second question?', 'session_id': session_id})
+    assert [entry['content'] for entry in app_module.chat_sessions.history(session_id)] == [
+        'First question?', ''.join(fake_openai), 'Second question?', ''.join(fake_openai)]
+
+    assert client.delete(f'/chat/session/{session_id}').get_json() == {'cleared': session_id}
+    assert app_module.chat_sessions.history(session_id) == []
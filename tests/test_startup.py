@@ -0,0 +1,24 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+IMPORT_CHECK = '''
+import os, threading
+import app
+assert not os.path.exists('uploads'), os.listdir('uploads')
+assert threading.active_count() == 1, threading.enumerate()
+assert app._tokenizer is None
+app.start_app()
+assert os.path.exists(app.METADATA_DB) and os.path.isdir(app.THUMB_FOLDER)
+assert any(thread.name == 'job-heartbeat' for thread in threading.enumerate())
+'''
+
+
+def test_import_has_no_side_effects(tmp_path):
+    # A fresh interpreter: the test session has already imported and started the app
+    env = {**os.environ, 'PYTHONPATH': ROOT, 'JOB_WORKERS': '1'}
+    result = subprocess.run([sys.executable, '-c', IMPORT_CHECK], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+NAME = f"{'c' * 64}_summaries.pdf"
+SUMMARIES = {
+    'backend': 'extractive',
+    'pages': {'1': 'Page one summary.', '12': 'Page twelve summary.'},
+    'sections': [{'first': 1, 'last': 10, 'summary': 'First section summary.'},
+                 {'first': 11, 'last': 20, 'summary': 'Second section summary.'}],
+    'document': 'Document summary.',
+}
+
+
+@pytest.fixture
+def summaries(app_module):
+    with open(app_module.artifact_path(NAME, 'summaries.json'), 'w') as f:
+        json.dump(SUMMARIES, f)
+    return SUMMARIES
+
+
+def answer(app_module, message, **context):
+    return app_module.summary_answer(message, {'filename': NAME, 'currentPage': 12, **context})
+
+
+@pytest.mark.parametrize('message, expected', [
+    ('Summarize this document', 'Document summary.'),
+    ('give me a summary of the paper.', 'Document summary.'),
+    ('Please summarise the PDF', 'Document summary.'),
+    ('summarize this page', 'Page twelve summary.'),
+    ('Summarize page 1', 'Page one summary.'),
+    ('summarize this section', 'Second section summary.'),
+])
+def test_summary_requests_are_answered_from_the_cache(app_module, summaries, message, expected):
+    assert expected in answer(app_module, message)
+
+
+@pytest.mark.parametrize('message', [
+    'What does the executive summary say about revenue?',
+    'Summarize this',
+    'summarize the document and list every risk it mentions',
+    'Is there an overview of the methods?',
+])
+def test_questions_go_to_the_model(app_module, summaries, message):
+    assert answer(app_module, message) is None
+
+
+def test_selection_is_never_replaced_by_a_cached_summary(app_module, summaries):
+    assert answer(app_module, 'Summarize this document', selectedText='Revenue grew 12%.') is None
+
+
+def test_interrupted_summaries_resume(app_module, monkeypatch):
+    name = f"{'d' * 64}_resume.pdf"
+    pages = [(n, f'Text of page {n}. It has words.') for n in range(1, 26)]
+    monkeypatch.setattr(app_module, 'iter_pages', lambda filename: iter(pages))
+    monkeypatch.setattr(app_module, 'summary_backend', lambda: 'counting')
+    calls = []
+
+    def counting(text, kind):
+        calls.append(kind)
+        if len(calls) == 20 and fail:
+            raise RuntimeError('rate limited')
+        return f'{kind} summary {len(calls)}'
+
+    monkeypatch.setitem(app_module.SUMMARY_BACKENDS, 'counting', counting)
+    fail = True
+    with pytest.raises(RuntimeError):
+        app_module.build_summaries(name)
+    failed_calls = len(calls)
+
+    fail = False
+    calls.clear()
+    assert app_module.build_summaries(name) == 25
+    # 25 pages + 3 sections + 1 document, minus what the first run finished
+    assert len(calls) == 25 + 3 + 1 - (failed_calls - 1)
+    assert app_module.load_summaries(name)['document']
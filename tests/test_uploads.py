@@ -0,0 +1,134 @@
+import hashlib
+import io
+import os
+import threading
+import time
+
+PDF_BYTES = b'%PDF-1.4\n' + bytes(range(256)) * 64 + b'\n%%EOF\n'
+
+
+def create(client, data=PDF_BYTES):
+    response = client.post('/uploads', json={'filename': 'chunked.pdf', 'size': len(data)})
+    assert response.status_code == 201
+    return response.get_json()['upload_id']
+
+
+def put(client, upload_id, offset, body):
+    return client.put(f'/uploads/{upload_id}?offset={offset}', data=body)
+
+
+def test_chunked_upload_completes_with_the_content_hash(client):
+    upload_id = create(client)
+    for offset in range(0, len(PDF_BYTES), 4096):
+        response = put(client, upload_id, offset, PDF_BYTES[offset:offset + 4096])
+        assert response.status_code == 200
+    payload = response.get_json()
+    assert payload['complete']
+    assert payload['filename'].startswith(hashlib.sha256(PDF_BYTES).hexdigest())
+
+
+def test_chunks_from_other_workers_are_hashed_at_the_end(app_module, client):
+    upload_id = create(client)
+    assert put(client, upload_id, 0, PDF_BYTES[:4096]).status_code == 200
+    # The next chunk went to another worker: this process has no hash state for it
+    app_module._upload_hashers.pop(upload_id)
+    payload = put(client, upload_id, 4096, PDF_BYTES[4096:]).get_json()
+    assert payload['filename'].startswith(hashlib.sha256(PDF_BYTES).hexdigest())
+
+
+def test_repeated_offset_is_rejected(client):
+    upload_id = create(client)
+    assert put(client, upload_id, 0, PDF_BYTES[:4096]).status_code == 200
+    response = put(client, upload_id, 0, PDF_BYTES[:4096])
+    assert response.status_code == 409
+    assert response.get_json()['offset'] == 4096
+
+
+def test_offset_is_checked_while_holding_the_part_lock(app_module, client):
+    upload_id = create(client)
+    results = []
+    with app_module.locked_part(upload_id) as part:
+        # Another worker holds the lock and appends the same chunk meanwhile
+        racer = threading.Thread(target=lambda: results.append(put(app_module.app.test_client(), upload_id, 0,
+                                                                   PDF_BYTES[:4096]).status_code))
+        racer.start()
+        time.sleep(0.2)
+        assert racer.is_alive()
+        part.write(PDF_BYTES[:4096])
+    racer.join(5)
+    assert results == [409]
+
+
+def test_rejected_upload_is_gone(client):
+    upload_id = create(client)
+    assert put(client, upload_id, 0, b'GIF89a' + PDF_BYTES[6:4096]).status_code == 415
+    assert put(client, upload_id, 0, PDF_BYTES[:4096]).status_code == 404
+    assert client.get(f'/uploads/{upload_id}').status_code == 404
+
+
+def test_first_chunk_shorter_than_the_header_is_checked(client):
+    upload_id = create(client)
+    assert put(client, upload_id, 0, b'%P').status_code == 200
+    assert put(client, upload_id, 2, b'NG' + PDF_BYTES[4:4096]).status_code == 415
+    assert client.get(f'/uploads/{upload_id}').status_code == 404
+
+
+def spools(app_module):
+    return [name for name in os.listdir(app_module.UPLOAD_FOLDER) if name.startswith('.upload-')]
+
+
+def test_aborted_form_upload_leaves_no_spool(app_module, client):
+    body = (b'--boundary\r\nContent-Disposition: form-data; name="file"; filename="cut.pdf"\r\n'
+            b'Content-Type: application/pdf\r\n\r\n' + PDF_BYTES)
+    # The client disconnected: the file part never ends and the closing boundary never comes
+    client.post('/', data=body, content_type='multipart/form-data; boundary=boundary')
+    assert spools(app_module) == []
+
+
+def test_stale_spools_are_swept(app_module):
+    stale = os.path.join(app_module.UPLOAD_FOLDER, '.upload-stale.tmp')
+    fresh = os.path.join(app_module.UPLOAD_FOLDER, '.upload-fresh.tmp')
+    for path in (stale, fresh):
+        open(path, 'wb').close()
+    old = time.time() - app_module.UPLOAD_SPOOL_STALE_AFTER - 1
+    os.utime(stale, (old, old))
+    try:
+        app_module.sweep_upload_spools()
+        # A spool another worker is still writing is left alone
+        assert spools(app_module) == ['.upload-fresh.tmp']
+    finally:
+        os.remove(fresh)
+
+
+def test_repeat_upload_is_stored_once(app_module, client):
+    data = PDF_BYTES + b'% dedup\n'
+    digest = hashlib.sha256(data).hexdigest()
+    names = []
+    for name in ('first.pdf', 'second.pdf'):
+        response = client.post('/', data={'file': (io.BytesIO(data), name)}, content_type='multipart/form-data')
+        assert response.status_code == 302
+        names.append(response.headers['Location'].rsplit('/', 1)[-1])
+    assert names == [f'{digest}_first.pdf', f'{digest}_second.pdf']
+
+    # Both names are links to the one object and share its artifacts
+    object_path = os.path.join(app_module.OBJECTS_FOLDER, f'{digest}.pdf')
+    assert all(os.path.samefile(os.path.join(app_module.UPLOAD_FOLDER, name), object_path) for name in names)
+    assert {app_module.doc_key(name) for name in names} == {digest}
+    assert spools(app_module) == []
+
+
+def test_recent_list_comes_from_the_metadata_index(app_module, client):
+    later = time.time() + 3600  # Newer than anything other tests uploaded
+    digest = hashlib.sha256(b'recent').hexdigest()
+    names = [f'{digest}_recent-{number}.pdf' for number in range(app_module.RECENT_FILES_LIMIT + 1)]
+    for number, name in enumerate(names):
+        app_module.record_upload(name, 2048, uploaded_at=later + number)
+    try:
+        app_module.record_page_count(names[0], 12)
+        recent = app_module.recent_uploads()
+        assert [file['name'] for file in recent] == names[::-1][:app_module.RECENT_FILES_LIMIT]
+        # Aliases of one document share its page count
+        assert {file['pages'] for file in recent} == {12}
+        assert 'recent-5.pdf' in client.get('/').get_data(as_text=True)
+    finally:
+        app_module.get_db(app_module.METADATA_DB).execute('DELETE FROM files WHERE doc_key = ?', (digest,))